@@ -0,0 +1,154 @@
+"""
+Admission control: separate concurrency pools for writes and reports
+
+Each worker process runs a fixed number of request threads (gunicorn
+--threads). Without limits, a few admins opening heavy reports can hold
+every thread, and staff submissions to /api/production wait behind them.
+Views are tagged with @admit('write') or @admit('report'); each class has
+its own pool:
+
+- `write` (floor data entry): up to ADMISSION_WRITE_CONCURRENCY at once,
+  the rest wait in a queue of up to ADMISSION_WRITE_QUEUE for as long as
+  ADMISSION_WRITE_WAIT_MS.
+- `report` (reports, history, imports, job submissions): up to
+  ADMISSION_REPORT_CONCURRENCY at once and a short queue of
+  ADMISSION_REPORT_QUEUE. When the queue is full, a report is shed at once
+  with a 503 and Retry-After (ADMISSION_RETRY_AFTER seconds) instead of
+  holding a thread; one that waits longer than ADMISSION_REPORT_WAIT_MS
+  gets the same answer.
+
+Keep ADMISSION_REPORT_CONCURRENCY + ADMISSION_REPORT_QUEUE below the
+threads per worker, so some threads are always left for writes. Views
+without a class (pages, login, metrics) are not limited. A concurrency of
+0 turns a class's limit off.
+
+Report views put @admit below @report_cache, so a 304 answered from
+data_versions is never queued. `stats()` reports, per class, the running
+and queued requests, totals admitted and shed, and queue wait times.
+"""
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify
+
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+
+
+class Overloaded(Exception):
+    """A request was refused because its class's queue is full or it waited too long"""
+
+    def __init__(self, name, reason):
+        super().__init__(f"Server busy ({name} requests {reason}), retry in {ADMISSION_RETRY_AFTER}s")
+        self.name = name
+
+
+class AdmissionPool:
+    """At most `concurrency` requests at once, up to `queue_limit` more waiting up to `max_wait` seconds"""
+
+    def __init__(self, name, concurrency, queue_limit, max_wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self.active = self.queued = 0
+        self.admitted = self.shed = self.timed_out = 0
+        self.max_active = self.max_queued = 0
+        self.waited = 0
+        self.wait_seconds = self.max_wait_seconds = 0.0
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed; raises Overloaded"""
+        with self._condition:
+            if self.concurrency > 0 and self.active >= self.concurrency:
+                if self.queued >= self.queue_limit:
+                    self.shed += 1
+                    raise Overloaded(self.name, "queue is full")
+                self._wait()
+            self.active += 1
+            self.admitted += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def _wait(self):
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            while self.active >= self.concurrency:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timed_out += 1
+                    raise Overloaded(self.name, "waited too long")
+                self._condition.wait(remaining)
+        finally:
+            self.queued -= 1
+            waited = time.monotonic() - started
+            self.waited += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "concurrency": self.concurrency,
+                "queue_limit": self.queue_limit,
+                "active": self.active,
+                "queued": self.queued,
+                "max_active": self.max_active,
+                "max_queued": self.max_queued,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "timed_out": self.timed_out,
+                "queued_total": self.waited,
+                "avg_wait_ms": round(self.wait_seconds / self.waited * 1000, 2) if self.waited else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+            }
+
+
+POOLS = {
+    'write': AdmissionPool(
+        'write',
+        int(os.getenv("ADMISSION_WRITE_CONCURRENCY", "4")),
+        int(os.getenv("ADMISSION_WRITE_QUEUE", "64")),
+        int(os.getenv("ADMISSION_WRITE_WAIT_MS", "30000")) / 1000,
+    ),
+    'report': AdmissionPool(
+        'report',
+        int(os.getenv("ADMISSION_REPORT_CONCURRENCY", "2")),
+        int(os.getenv("ADMISSION_REPORT_QUEUE", "2")),
+        int(os.getenv("ADMISSION_REPORT_WAIT_MS", "2000")) / 1000,
+    ),
+}
+
+
+def admit(name):
+    """Decorator: run the view in the `name` pool, or answer 503 + Retry-After when it is overloaded"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            pool = POOLS[name]
+            try:
+                pool.acquire()
+            except Overloaded as e:
+                response = jsonify({"success": False, "error": str(e)})
+                response.status_code = 503
+                response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+                return response
+            try:
+                return view(*args, **kwargs)
+            finally:
+                pool.release()
+        return wrapper
+    return decorator
+
+
+def stats():
+    return {name: pool.stats() for name, pool in POOLS.items()}
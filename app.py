@@ -1,9 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, g
 from flask_cors import CORS
-from models import SessionLocal, Worker, Item, Section, ProductionLog, Attendance, MachineDowntime, Requisition
+from models import SessionLocal, ReadSessionLocal, Worker, Item, Section, ProductionLog, Attendance, Requisition, REPLICATION_ROLE, PLANT_ID, OUTBOX_MODE
 from auth import login_user, register_user, require_auth, require_role, get_user_role
-from validation import validate_production_data, validate_attendance_data, validate_downtime_data, validate_requisition_data, validate_material_flow, check_data_integrity
-from datetime import datetime, date
+from session_store import create_session_interface, regenerate_session
+from inventory import adjust_stock, stock_levels
+from archive import with_archive
+from attendance import section_attendance, worker_attendance, absentees
+from jobs import runner as job_runner, JOB_KINDS
+from integrity import issues_page, has_dirty_days, scan_closed_days
+from importer import import_file, IMPORT_KINDS, REJECTED_PREVIEW
+from http_cache import conditional, init_compression
+from admission import admit, stats as admission_stats
+from assets import init_assets
+from locks import section_day_lock
+from entries import record_production, record_attendance, record_downtime, EntryRejected
+from ingest import INGEST_MODE, buffer as ingest_buffer, entry_status
+from outbox import dispatcher as outbox_dispatcher
+import query_cache
+from replication import apply_changeset, get_marks, ReplicationError
+from payroll import payroll_rows
+from reports import leaderboard, downtime_page, LEADERBOARD_METRICS
+from requisitions import pending_requisitions, approve_requisitions, reject_requisitions, issue_requisitions, cancel_requisitions, receive_stock
+from validation import check_data_integrity
+from schemas import ValidationError, ProductionEntry, AttendanceEntry, DowntimeEntry, RequisitionEntry
+from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 from sqlalchemy import func
 import os
@@ -14,13 +34,75 @@ app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
 CORS(app)  # Enable CORS for all routes
 
+# Optional server-side sessions (SESSION_BACKEND=sqlite keeps only an id in the cookie)
+session_interface = create_session_interface()
+if session_interface:
+    app.session_interface = session_interface
+
+# gzip/brotli for text and JSON responses
+init_compression(app)
+
+# Content-hashed static URLs served with long-lived caching
+init_assets(app)
+
+# Outbox delivery thread (OUTBOX_MODE=thread), started on the first request so
+# it runs in each worker process rather than in a preloading parent
+@app.before_request
+def start_outbox_dispatcher():
+    if OUTBOX_MODE == 'thread':
+        outbox_dispatcher.start()
+
 # Dependency to get DB session
+# Sessions live for the request and are closed on teardown, so their
+# connections (on SQLite, the one writer connection) go back to the pool.
+# Logged-in users get sessions scoped to their plant (see PlantScoped in models.py).
+def plant_session(sessions):
+    plant_id = current_plant_id()
+    return sessions(info={'plant_id': plant_id}) if plant_id else sessions()
+
 def get_db():
-    db = SessionLocal()
-    try:
-        return db
-    finally:
-        db.close()
+    if 'db' not in g:
+        g.db = plant_session(SessionLocal)
+    return g.db
+
+# Report queries may be served by the read replica (see REPLICA_DATABASE_URL).
+def get_read_db():
+    if 'read_db' not in g:
+        g.read_db = plant_session(ReadSessionLocal)
+    return g.read_db
+
+@app.teardown_appcontext
+def close_dbs(exc):
+    for name in ('db', 'read_db'):
+        db = g.pop(name, None)
+        if db is not None:
+            db.close()
+
+@app.errorhandler(ValidationError)
+def validation_failed(e):
+    # Same shape for every payload: a readable summary plus the full list
+    return jsonify({"success": False, "error": str(e), "errors": e.errors}), 400
+
+def report_cache(*tables):
+    """Conditional GET for a report view reading `tables` (see http_cache.py)"""
+    return conditional(tables, lambda: get_read_db())
+
+def current_section_id():
+    """Section of the logged-in user, stored in the session as plain data"""
+    return session['user'].get('user_metadata', {}).get('section_id', 1)
+
+def current_plant_id():
+    """
+    Plant the logged-in user's queries are scoped to
+
+    Users without a plant belong to this instance's PLANT_ID, so their
+    queries use the plant-leading indexes too. A plant_id of "*" (the
+    consolidated view) and requests without a login are not scoped.
+    """
+    if 'user' not in session:
+        return None
+    plant_id = session['user'].get('user_metadata', {}).get('plant_id') or PLANT_ID
+    return None if plant_id == '*' else plant_id
 
 @app.route("/")
 def index():
@@ -41,6 +123,7 @@ def login():
         if result['success']:
             # Store only serializable user data in session
             user = result['user']
+            regenerate_session(session)
             session['user'] = {
                 'email': user.email,
                 'id': user.id,
@@ -70,19 +153,20 @@ def staff_dashboard():
     if 'user' not in session:
         return redirect(url_for('login'))
     
-    db = get_db()
+    db = get_read_db()
     
     # Get user's section
-    user_section_id = session['user'].get('user_metadata', {}).get('section_id', 1)
+    user_section_id = current_section_id()
     
+    # Plain rows rather than ORM objects, so repeat views come from the query cache
     # Get workers in user's section
-    workers = db.query(Worker).filter(Worker.section_id == user_section_id).all()
+    workers = db.query(Worker.id, Worker.name).filter(Worker.section_id == user_section_id).all()
     
     # Get all items
-    items = db.query(Item).all()
+    items = db.query(Item.id, Item.name, Item.unit, Item.default_target).all()
     
     # Get user's section
-    section = db.query(Section).filter(Section.id == user_section_id).first()
+    section = db.query(Section.id, Section.name).filter(Section.id == user_section_id).first()
     
     return render_template('staff_dashboard.html', 
                          workers=workers, 
@@ -97,93 +181,71 @@ def admin_dashboard():
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('login'))
     
-    db = get_db()
+    db = get_read_db()
     
     # Get summary data
     total_workers = db.query(Worker).count()
     total_sections = db.query(Section).count()
-    pending_requisitions = db.query(Requisition).filter(Requisition.status == 'pending').count()
     
-    # Get today's production summary
+    # Get today's production summary (one aggregate row, cached between writes)
     today = date.today()
-    today_production = db.query(ProductionLog).filter(ProductionLog.date == today).all()
+    total_target, total_actual, total_wastage = db.query(
+        func.coalesce(func.sum(ProductionLog.target), 0),
+        func.coalesce(func.sum(ProductionLog.actual), 0),
+        func.coalesce(func.sum(ProductionLog.wastage), 0)
+    ).filter(ProductionLog.date == today).one()
     
     production_summary = {
-        'total_target': sum(p.target for p in today_production),
-        'total_actual': sum(p.actual for p in today_production),
-        'total_wastage': sum(p.wastage for p in today_production)
+        'total_target': total_target,
+        'total_actual': total_actual,
+        'total_wastage': total_wastage
     }
     
-    # Get pending requisitions
-    pending_reqs = db.query(Requisition).filter(Requisition.status == 'pending').all()
+    # Get one page of pending requisitions
+    pending_page = pending_requisitions(db, page=request.args.get('page', 1, type=int))
     
     return render_template('admin_dashboard.html',
                          total_workers=total_workers,
                          total_sections=total_sections,
-                         pending_requisitions=pending_requisitions,
+                         pending_requisitions=pending_page['total'],
                          production_summary=production_summary,
-                         pending_reqs=pending_reqs,
+                         pending_reqs=pending_page['requisitions'],
+                         pending_page=pending_page,
                          date=date,
                          datetime=datetime)
 
 # API Routes
 
+def queue_entry(kind):
+    """Buffered ingestion: log the validated payload and acknowledge right away"""
+    entry_id = ingest_buffer.submit(kind, current_section_id(), request.get_json(silent=True),
+                                    current_plant_id())
+    return jsonify({"success": True, "queued": True, "entry_id": entry_id,
+                    "message": "Entry received and queued for saving"}), 202
+
 @app.route("/api/production", methods=['POST'])
+@admit('write')
 def api_production():
     if 'user' not in session:
         return jsonify({"success": False, "error": "Authentication required"}), 401
     
+    entry = ProductionEntry.validate(request.get_json(silent=True))
+    if INGEST_MODE == 'buffered':
+        return queue_entry('production')
+    
     try:
-        data = request.get_json()
-        
-        # Validate input data
-        validation_result = validate_production_data(data)
-        if not validation_result['valid']:
-            return jsonify({"success": False, "errors": validation_result['errors']}), 400
-        
         db = get_db()
+        user_section_id = current_section_id()
         
-        # Get item to auto-fill target
-        item = db.query(Item).filter(Item.id == data['item_id']).first()
-        if not item:
-            return jsonify({"success": False, "error": "Item not found"}), 404
-        
-        # Calculate fields
-        target = item.default_target
-        actual = int(data['actual'])
-        input_material = float(data['input_material'])
-        output_material = float(data['output_material'])
-        wastage = input_material - output_material
-        entry_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
-        
-        # Calculate overtime hours
-        overtime_hours = 0
-        if actual > target:
-            overtime_hours = (actual - target) / (target / 8)
-        
-        # Material flow validation
-        user_section_id = session['user'].user_metadata.get('section_id', 1)
-        
-        material_flow_validation = validate_material_flow(user_section_id, output_material, entry_date, db)
-        if not material_flow_validation['valid']:
-            return jsonify({"success": False, "error": material_flow_validation['error']}), 400
-        
-        # Create production log
-        production_log = ProductionLog(
-            worker_id=data['worker_id'],
-            item_id=data['item_id'],
-            section_id=user_section_id,
-            date=entry_date,
-            target=target,
-            actual=actual,
-            input_material=input_material,
-            output_material=output_material,
-            wastage=wastage,
-            overtime_hours=overtime_hours
-        )
-        
-        db.add(production_log)
-        db.commit()
+        # Material flow validation and the insert run under a (section, date)
+        # lock so concurrent entries cannot both spend the same input
+        with section_day_lock(db, user_section_id, entry.date):
+            try:
+                record_production(db, entry, user_section_id)
+            except EntryRejected as e:
+                db.rollback()
+                return jsonify({"success": False, "error": str(e)}), e.status
+            db.commit()
         
         return jsonify({"success": True, "message": "Production data saved successfully"})
         
@@ -191,32 +253,18 @@ def api_production():
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route("/api/attendance", methods=['POST'])
+@admit('write')
 def api_attendance():
     if 'user' not in session:
         return jsonify({"success": False, "error": "Authentication required"}), 401
     
+    entry = AttendanceEntry.validate(request.get_json(silent=True))
+    if INGEST_MODE == 'buffered':
+        return queue_entry('attendance')
+    
     try:
-        data = request.get_json()
-        
-        # Validate input data
-        validation_result = validate_attendance_data(data)
-        if not validation_result['valid']:
-            return jsonify({"success": False, "errors": validation_result['errors']}), 400
-        
         db = get_db()
-        entry_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
-        user_section_id = session['user'].user_metadata.get('section_id', 1)
-        
-        # Create attendance records for selected workers
-        for worker_id in data['workers']:
-            attendance = Attendance(
-                worker_id=int(worker_id),
-                section_id=user_section_id,
-                date=entry_date,
-                present=True
-            )
-            db.add(attendance)
-        
+        record_attendance(db, entry, current_section_id())
         db.commit()
         
         return jsonify({"success": True, "message": "Attendance saved successfully"})
@@ -225,35 +273,18 @@ def api_attendance():
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route("/api/downtime", methods=['POST'])
+@admit('write')
 def api_downtime():
     if 'user' not in session:
         return jsonify({"success": False, "error": "Authentication required"}), 401
     
+    entry = DowntimeEntry.validate(request.get_json(silent=True))
+    if INGEST_MODE == 'buffered':
+        return queue_entry('downtime')
+    
     try:
-        data = request.get_json()
-        
-        # Validate input data
-        validation_result = validate_downtime_data(data)
-        if not validation_result['valid']:
-            return jsonify({"success": False, "errors": validation_result['errors']}), 400
-        
         db = get_db()
-        
-        # Parse validated times
-        start_time = datetime.strptime(data['start_time'], '%Y-%m-%dT%H:%M')
-        end_time = datetime.strptime(data['end_time'], '%Y-%m-%dT%H:%M')
-        
-        user_section_id = session['user'].user_metadata.get('section_id', 1)
-        
-        downtime = MachineDowntime(
-            section_id=user_section_id,
-            machine_name=data['machine_name'],
-            start_time=start_time,
-            end_time=end_time,
-            remarks=data.get('remarks', '')
-        )
-        
-        db.add(downtime)
+        record_downtime(db, entry, current_section_id())
         db.commit()
         
         return jsonify({"success": True, "message": "Downtime recorded successfully"})
@@ -261,26 +292,36 @@ def api_downtime():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/api/ingest/<entry_id>", methods=['GET'])
+def api_ingest_status(entry_id):
+    if 'user' not in session:
+        return jsonify({"success": False, "error": "Authentication required"}), 401
+    
+    try:
+        status = entry_status(get_db(), entry_id)
+        if status is None:
+            return jsonify({"success": False, "error": "Entry not found"}), 404
+        return jsonify({"success": True, "entry_id": entry_id, **status})
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route("/api/requisition", methods=['POST'])
+@admit('write')
 def api_requisition():
     if 'user' not in session:
         return jsonify({"success": False, "error": "Authentication required"}), 401
     
+    entry = RequisitionEntry.validate(request.get_json(silent=True))
+    
     try:
-        data = request.get_json()
-        
-        # Validate input data
-        validation_result = validate_requisition_data(data)
-        if not validation_result['valid']:
-            return jsonify({"success": False, "errors": validation_result['errors']}), 400
-        
         db = get_db()
-        user_section_id = session['user'].user_metadata.get('section_id', 1)
+        user_section_id = current_section_id()
         
         requisition = Requisition(
-            item_id=data['item_id'],
+            item_id=entry.item_id,
             section_id=user_section_id,
-            quantity=int(data['quantity']),
+            quantity=entry.quantity,
             status='pending'
         )
         
@@ -294,20 +335,42 @@ def api_requisition():
 
 # Admin API Routes
 
+def report_date_range():
+    """Optional inclusive start/end (YYYY-MM-DD) query args; raises ValueError"""
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    return start, end
+
 @app.route("/api/reports/production", methods=['GET'])
+@report_cache('production_logs', 'production_logs_archive', 'archive_watermarks', 'items')
+@admit('report')
 def api_reports_production():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({"success": False, "error": "Admin access required"}), 403
     
     try:
-        db = get_db()
+        start, end = report_date_range()
+    except ValueError:
+        return jsonify({"success": False, "error": "Dates must be YYYY-MM-DD"}), 400
+    
+    try:
+        db = get_read_db()
         
-        # Get production data grouped by item
-        production_data = db.query(
+        # Get production data grouped by item, including archived months when the range needs them
+        source = with_archive(db, ProductionLog, start)
+        logs = source.c
+        query = db.query(
             Item.name,
-            func.sum(ProductionLog.target).label('total_target'),
-            func.sum(ProductionLog.actual).label('total_actual')
-        ).join(ProductionLog).group_by(Item.name).all()
+            func.sum(logs.target).label('total_target'),
+            func.sum(logs.actual).label('total_actual')
+        ).join(source, logs.item_id == Item.id)
+        if start:
+            query = query.filter(logs.date >= start)
+        if end:
+            query = query.filter(logs.date <= end)
+        production_data = query.group_by(Item.name).all()
         
         labels = [p.name for p in production_data]
         targets = [int(p.total_target) for p in production_data]
@@ -324,42 +387,114 @@ def api_reports_production():
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route("/api/reports/attendance", methods=['GET'])
+@report_cache('attendance_months', 'sections')
+@admit('report')
 def api_reports_attendance():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({"success": False, "error": "Admin access required"}), 403
     
     try:
-        db = get_db()
-        
-        # Get attendance data by section
-        attendance_data = db.query(
-            Section.name,
-            func.count(Attendance.id).label('present_count')
-        ).join(Attendance).filter(Attendance.present == True).group_by(Section.name).all()
-        
-        return jsonify({
-            "success": True,
-            "data": [{"section": a.name, "present": a.present_count} for a in attendance_data]
-        })
-        
+        start, end = report_date_range()
+    except ValueError:
+        return jsonify({"success": False, "error": "Dates must be YYYY-MM-DD"}), 400
+    
+    try:
+        # Present days, workers and attendance rate by section, from the monthly bitsets
+        return jsonify({"success": True, "data": section_attendance(get_read_db(), start, end)})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/reports/attendance/workers", methods=['GET'])
+@report_cache('attendance_months', 'workers')
+@admit('report')
+def api_reports_attendance_workers():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    try:
+        start, end = report_date_range()
+    except ValueError:
+        return jsonify({"success": False, "error": "Dates must be YYYY-MM-DD"}), 400
+    
+    try:
+        data = worker_attendance(get_read_db(), start, end, request.args.get('section_id', type=int))
+        return jsonify({"success": True, "data": data})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/reports/attendance/absent", methods=['GET'])
+@report_cache('attendance_months', 'workers')
+@admit('report')
+def api_reports_absentees():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    try:
+        day = datetime.strptime(request.args.get('date') or date.today().isoformat(), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({"success": False, "error": "Date must be YYYY-MM-DD"}), 400
+    
+    try:
+        data = absentees(get_read_db(), day, request.args.get('section_id', type=int))
+        return jsonify({"success": True, "date": day.isoformat(), "data": data})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/reports/payroll", methods=['GET'])
+@report_cache('payroll_runs', 'workers')
+@admit('report')
+def api_reports_payroll():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    try:
+        start, end = report_date_range()
+    except ValueError:
+        return jsonify({"success": False, "error": "Dates must be YYYY-MM-DD"}), 400
+    if start is None or end is None:
+        return jsonify({"success": False, "error": "start and end of the pay period are required"}), 400
+    
+    try:
+        # Rows written by the payroll job (POST /api/jobs/payroll) for exactly this period
+        data = payroll_rows(get_read_db(), start, end, request.args.get('section_id', type=int))
+        return jsonify({"success": True, "start": start.isoformat(), "end": end.isoformat(), "data": data})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route("/api/reports/downtime", methods=['GET'])
+@report_cache('machine_downtime', 'machine_downtime_archive', 'archive_watermarks')
+@admit('report')
 def api_reports_downtime():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({"success": False, "error": "Admin access required"}), 403
     
     try:
-        db = get_db()
+        start, end = report_date_range()
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    except ValueError:
+        return jsonify({"success": False, "error": "Dates must be YYYY-MM-DD"}), 400
+    
+    try:
+        db = get_read_db()
         
-        # Get recent downtime records
-        downtime_records = db.query(MachineDowntime).order_by(MachineDowntime.created_at.desc()).limit(20).all()
+        # Get one page of downtime records, newest first
+        downtime_records, next_cursor = downtime_page(
+            db,
+            section_id=request.args.get('section_id', type=int),
+            machine=request.args.get('machine'),
+            start=start,
+            end=end,
+            min_hours=request.args.get('min_hours', type=float),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
         
         data = []
         for record in downtime_records:
-            duration_hours = (record.end_time - record.start_time).total_seconds() / 3600
+            duration_hours = record.duration_hours or 0
             data.append({
+                "id": record.id,
+                "section_id": record.section_id,
                 "machine": record.machine_name,
                 "start_time": record.start_time.isoformat(),
                 "end_time": record.end_time.isoformat(),
@@ -370,19 +505,24 @@ def api_reports_downtime():
         
         return jsonify({
             "success": True,
-            "data": data
+            "data": data,
+            "next_cursor": next_cursor
         })
         
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route("/api/worker_history/<int:worker_id>", methods=['GET'])
+@report_cache('production_logs', 'items')
+@admit('report')
 def api_worker_history(worker_id):
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({"success": False, "error": "Admin access required"}), 403
     
     try:
-        db = get_db()
+        db = get_read_db()
         
         # Get worker's production history
         history = db.query(ProductionLog, Item.name).join(Item).filter(
@@ -407,12 +547,64 @@ def api_worker_history(worker_id):
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/api/reports/leaderboard", methods=['GET'])
+@report_cache('worker_daily_stats', 'workers', 'sections')
+@admit('report')
+def api_reports_leaderboard():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    metric = request.args.get('metric', 'efficiency')
+    if metric not in LEADERBOARD_METRICS:
+        return jsonify({"success": False, "error": f"metric must be one of {', '.join(LEADERBOARD_METRICS)}"}), 400
+    
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else date.today()
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({"success": False, "error": "Dates must be YYYY-MM-DD"}), 400
+    
+    try:
+        db = get_read_db()
+        rows = leaderboard(
+            db, start, end, metric,
+            section_id=request.args.get('section_id', type=int),
+            limit=request.args.get('limit', type=int)
+        )
+        
+        return jsonify({
+            "success": True,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "metric": metric,
+            "data": [{
+                "worker_id": r.worker_id,
+                "worker": r.worker_name,
+                "section_id": r.section_id,
+                "section": r.section_name,
+                "target": int(r.target or 0),
+                "actual": int(r.actual or 0),
+                "efficiency": round(r.efficiency, 1) if r.efficiency is not None else None,
+                "wastage": round(r.wastage or 0, 2),
+                "wastage_pct": round(r.wastage_pct, 2) if r.wastage_pct is not None else None,
+                "overtime_hours": round(r.overtime_hours or 0, 2),
+                "section_rank": r.section_rank,
+                "overall_rank": r.overall_rank
+            } for r in rows]
+        })
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route("/api/requisition/<int:requisition_id>/<action>", methods=['POST'])
+@admit('write')
 def api_requisition_action(requisition_id, action):
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({"success": False, "error": "Admin access required"}), 403
     
-    if action not in ['approve', 'reject']:
+    # Each action applies to requisitions in one status only
+    required_status = {'approve': 'pending', 'reject': 'pending', 'issue': 'approved', 'cancel': 'approved'}
+    if action not in required_status:
         return jsonify({"success": False, "error": "Invalid action"}), 400
     
     try:
@@ -422,24 +614,226 @@ def api_requisition_action(requisition_id, action):
         requisition = db.query(Requisition).filter(Requisition.id == requisition_id).first()
         if not requisition:
             return jsonify({"success": False, "error": "Requisition not found"}), 404
+        if requisition.status != required_status[action]:
+            return jsonify({"success": False, "error": f"Requisition is already {requisition.status}"}), 409
         
-        requisition.status = 'approved' if action == 'approve' else 'rejected'
-        requisition.remarks = data.get('remarks', '')
+        if action == 'approve':
+            result = approve_requisitions(db, ids=[requisition_id], remarks=data.get('remarks', ''))
+            if result['insufficient_stock']:
+                return jsonify({"success": False, "error": "Insufficient stock to approve requisition"}), 409
+        elif action == 'reject':
+            reject_requisitions(db, ids=[requisition_id], remarks=data.get('remarks', ''))
+        elif action == 'issue':
+            issue_requisitions(db, ids=[requisition_id])
+        else:
+            cancel_requisitions(db, ids=[requisition_id])
+        
+        past = {'approve': 'approved', 'reject': 'rejected', 'issue': 'issued', 'cancel': 'cancelled'}[action]
+        return jsonify({"success": True, "message": f"Requisition {past} successfully"})
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/requisitions/<action>", methods=['POST'])
+@admit('write')
+def api_requisitions_bulk_action(action):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    if action not in ['approve', 'reject', 'issue', 'cancel']:
+        return jsonify({"success": False, "error": "Invalid action"}), 400
+    
+    try:
+        data = request.get_json() or {}
+        filters = {
+            'ids': [int(i) for i in data['ids']] if data.get('ids') else None,
+            'section_id': data.get('section_id'),
+            'item_id': data.get('item_id')
+        }
+        if all(value is None for value in filters.values()):
+            return jsonify({"success": False, "error": "Provide ids, section_id or item_id"}), 400
+        
+        db = get_db()
+        if action == 'issue':
+            return jsonify({"success": True, "issued": len(issue_requisitions(db, **filters))})
+        if action == 'cancel':
+            return jsonify({"success": True, "cancelled": len(cancel_requisitions(db, **filters))})
+        if action == 'approve':
+            result = approve_requisitions(db, remarks=data.get('remarks', ''), **filters)
+        else:
+            result = reject_requisitions(db, remarks=data.get('remarks', ''), **filters)
         
+        return jsonify({
+            "success": True,
+            "approved": len(result['approved']),
+            "rejected": result['rejected'],
+            "insufficient_stock": result['insufficient_stock']
+        })
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/requisitions/pending", methods=['GET'])
+def api_requisitions_pending():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    try:
+        db = get_db()
+        result = pending_requisitions(
+            db,
+            section_id=request.args.get('section_id', type=int),
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 50, type=int)
+        )
+        
+        return jsonify({
+            "success": True,
+            "requisitions": [{
+                "id": r.id,
+                "item": r.item.name if r.item else None,
+                "section": r.section.name if r.section else None,
+                "quantity": r.quantity,
+                "created_at": r.created_at.isoformat()
+            } for r in result['requisitions']],
+            "total": result['total'],
+            "page": result['page'],
+            "pages": result['pages']
+        })
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/stock/<int:item_id>", methods=['POST'])
+@admit('write')
+def api_receive_stock(item_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    try:
+        data = request.get_json() or {}
+        quantity = int(data.get('quantity', 0))
+        if quantity <= 0:
+            return jsonify({"success": False, "error": "Quantity must be greater than 0"}), 400
+        
+        db = get_db()
+        if not db.query(Item).filter(Item.id == item_id).first():
+            return jsonify({"success": False, "error": "Item not found"}), 404
+        
+        stock = receive_stock(db, item_id, quantity)
+        return jsonify({
+            "success": True,
+            "on_hand": stock.on_hand,
+            "reserved": stock.reserved,
+            "available": stock.on_hand - stock.reserved
+        })
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/inventory/stock", methods=['GET'])
+def api_inventory_stock():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    try:
+        as_of = request.args.get('as_of')
+        if as_of:
+            as_of = datetime.fromisoformat(as_of)
+        
+        db = get_read_db()
+        levels = stock_levels(
+            db,
+            item_id=request.args.get('item_id', type=int),
+            section_id=request.args.get('section_id', type=int),
+            as_of=as_of
+        )
+        
+        return jsonify({
+            "success": True,
+            "as_of": (as_of or datetime.now()).isoformat(),
+            "data": [{"item_id": item_id, "section_id": section_id, "quantity": quantity}
+                     for (item_id, section_id), quantity in sorted(levels.items(), key=lambda kv: (kv[0][0], kv[0][1] or 0))]
+        })
+        
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid as_of, use YYYY-MM-DD or YYYY-MM-DDTHH:MM"}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/inventory/adjust", methods=['POST'])
+@admit('write')
+def api_inventory_adjust():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    try:
+        data = request.get_json() or {}
+        if not data.get('item_id') or not data.get('quantity'):
+            return jsonify({"success": False, "error": "item_id and a non-zero quantity are required"}), 400
+        
+        db = get_db()
+        try:
+            movement = adjust_stock(
+                db,
+                int(data['item_id']),
+                data.get('section_id'),
+                float(data['quantity']),
+                remarks=data.get('remarks', '')
+            )
+        except ValueError as e:
+            db.rollback()
+            return jsonify({"success": False, "error": str(e)}), 400
         db.commit()
         
-        return jsonify({"success": True, "message": f"Requisition {action}d successfully"})
+        return jsonify({"success": True, "movement_id": movement.id})
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/import/<kind>", methods=['POST'])
+@admit('report')
+def api_import(kind):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    if kind not in IMPORT_KINDS:
+        return jsonify({"success": False, "error": f"Unknown import kind: {kind}"}), 404
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({"success": False, "error": "Upload a .csv or .xlsx file as 'file'"}), 400
+    
+    try:
+        db = get_db()
+        try:
+            result = import_file(db, kind, upload.stream, upload.filename,
+                                 dry_run=request.form.get('dry_run') in ('1', 'true'))
+        except (ValueError, RuntimeError) as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        
+        rejected = result['rejected']
+        return jsonify({
+            "success": True,
+            "imported": result['imported'],
+            "rejected_count": len(rejected),
+            "rejected": [
+                {"line": line, "errors": errors, "row": {key: None if value is None else str(value) for key, value in row.items()}}
+                for line, errors, row in rejected[:REJECTED_PREVIEW]
+            ]
+        })
         
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route("/api/reports/material_flow", methods=['GET'])
+@report_cache('production_logs', 'sections')
+@admit('report')
 def api_reports_material_flow():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({"success": False, "error": "Admin access required"}), 403
     
     try:
-        db = get_db()
+        db = get_read_db()
         
         # Get material flow data
         sections = db.query(Section).all()
@@ -488,18 +882,146 @@ def test_db():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-if __name__ == "__main__":
-    app.run(host='0.0.0.0', debug=True, port=5000)
-
-
 @app.route("/api/data_integrity", methods=['GET'])
+@admit('report')
 def api_data_integrity():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({"success": False, "error": "Admin access required"}), 403
     
+    status = request.args.get('status', 'open')
+    if status not in ('open', 'resolved', 'all'):
+        return jsonify({"success": False, "error": "status must be open, resolved or all"}), 400
+    try:
+        day = request.args.get('day')
+        day = datetime.strptime(day, '%Y-%m-%d').date() if day else None
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    except ValueError:
+        return jsonify({"success": False, "error": "day must be YYYY-MM-DD"}), 400
+    
+    try:
+        db = get_read_db()
+        
+        # Issues found by the nightly scan of closed days
+        issues, next_cursor = issues_page(
+            db,
+            status=status,
+            day=day,
+            issue_type=request.args.get('type'),
+            severity=request.args.get('severity'),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+        
+        # Days whose logs changed since their last scan are re-scanned off the request path
+        scan = job_runner.submit('integrity_scan') if has_dirty_days(db) else None
+        
+        return jsonify({
+            "success": True,
+            "issues": [{
+                "id": issue.id,
+                "day": issue.day.isoformat(),
+                "type": issue.type,
+                "description": issue.description,
+                "details": issue.details,
+                "severity": issue.severity,
+                "first_seen": issue.first_seen.isoformat(),
+                "last_seen": issue.last_seen.isoformat(),
+                "resolved_at": issue.resolved_at.isoformat() if issue.resolved_at else None
+            } for issue in issues],
+            "next_cursor": next_cursor,
+            "scan_job_id": scan['id'] if scan else None
+        })
+        
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/cron/integrity_scan", methods=['GET'])
+def api_cron_integrity_scan():
+    # Called by the scheduler (Vercel Cron sends the CRON_SECRET as a bearer token)
+    cron_secret = os.getenv('CRON_SECRET')
+    if not cron_secret or request.headers.get('Authorization') != f"Bearer {cron_secret}":
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    
+    try:
+        scanned = scan_closed_days(get_db())
+        return jsonify({
+            "success": True,
+            "days": {day.isoformat(): {"opened": opened, "resolved": resolved} for day, (opened, resolved) in scanned.items()}
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+def replication_plant():
+    """Plant id of an authenticated replication request, or None"""
+    token = os.getenv('REPLICATION_TOKEN')
+    if not token or request.headers.get('Authorization') != f"Bearer {token}":
+        return None
+    return request.headers.get('X-Plant-Id') or None
+
+@app.route("/api/replication/marks", methods=['GET'])
+def api_replication_marks():
+    # Edge plants ask where central stands before building a changeset
+    if REPLICATION_ROLE != 'central':
+        return jsonify({"success": False, "error": "Not a central instance"}), 404
+    plant_id = replication_plant()
+    if plant_id is None:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    
+    try:
+        return jsonify({"success": True, "plant": plant_id, "marks": get_marks(get_db(), plant_id)})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/replication/changesets", methods=['POST'])
+def api_replication_changeset():
+    if REPLICATION_ROLE != 'central':
+        return jsonify({"success": False, "error": "Not a central instance"}), 404
+    plant_id = replication_plant()
+    if plant_id is None:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+    
+    try:
+        result = apply_changeset(get_db(), request.get_data(), plant_id)
+        return jsonify({"success": True, **result})
+    except ReplicationError as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/metrics", methods=['GET'])
+def api_metrics():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    # Counters of this worker process
+    return jsonify({"success": True, "query_cache": query_cache.stats(), "admission": admission_stats()})
+
+@app.route("/api/jobs/<kind>", methods=['POST'])
+@admit('report')
+def api_submit_job(kind):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    if kind not in JOB_KINDS:
+        return jsonify({"success": False, "error": "Unknown job kind"}), 400
+    
     try:
-        result = check_data_integrity()
-        return jsonify(result)
+        job_info = job_runner.submit(kind, request.get_json(silent=True) or {}, current_plant_id())
+        return jsonify({"success": True, "job": job_info}), 200 if job_info['status'] == 'done' else 202
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/api/jobs/<job_id>", methods=['GET'])
+def api_job_status(job_id):
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({"success": False, "error": "Admin access required"}), 403
+    
+    job_info = job_runner.get(job_id)
+    if job_info is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, "job": job_info})
+
+if __name__ == "__main__":
+    app.run(host='0.0.0.0', debug=True, port=5000)
@@ -0,0 +1,223 @@
+"""
+Monthly partitions and archival for the time-series tables
+
+On Postgres, production_logs, attendance and machine_downtime are range
+partitioned by month (see init_db.sql). `ensure_partitions` creates the
+upcoming months ahead of time and `archive_before` moves whole partitions
+older than the retention window to the matching *_archive table by detaching
+and re-attaching them, so no rows are copied. Any stragglers (e.g. rows in the
+default partition) and all rows on other databases are moved with
+INSERT ... SELECT / DELETE in the same transaction.
+
+Reports call `with_archive` for the table they read; it only adds the
+archive table to the query when the requested range starts before the
+archive watermark.
+"""
+import os
+import re
+from datetime import date, datetime
+from sqlalchemy import select, insert, delete, text, union_all
+from models import (
+    SessionLocal, ProductionLog, Attendance, MachineDowntime,
+    ProductionLogArchive, AttendanceArchive, MachineDowntimeArchive, ArchiveWatermark
+)
+
+ARCHIVE_RETENTION_MONTHS = int(os.getenv("ARCHIVE_RETENTION_MONTHS", "24"))
+
+# table name -> (live model, archive model, partition key column)
+ARCHIVED_TABLES = {
+    'production_logs': (ProductionLog, ProductionLogArchive, 'date'),
+    'attendance': (Attendance, AttendanceArchive, 'date'),
+    'machine_downtime': (MachineDowntime, MachineDowntimeArchive, 'start_time'),
+}
+
+_PARTITION_NAME = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table_name, month):
+    return f"{table_name}_y{month.year:04d}m{month.month:02d}"
+
+
+def retention_cutoff(today=None, retention_months=None):
+    """First day of the oldest month that stays in the live tables"""
+    if retention_months is None:
+        retention_months = ARCHIVE_RETENTION_MONTHS
+    return add_months(month_start(today or date.today()), -retention_months)
+
+
+def archive_cutoff(db, table_name):
+    """Date before which the table's rows live in its archive table, or None"""
+    return db.query(ArchiveWatermark.archived_before).filter(
+        ArchiveWatermark.table_name == table_name
+    ).scalar()
+
+
+def with_archive(db, model, start=None):
+    """
+    The live table, or live + archive rows when `start` reaches the archive
+
+    `start` of None means an unbounded range. Returns a selectable with the
+    live table's column names. Core selectables are not covered by the
+    session's plant scoping, so a plant-scoped session's rows are filtered
+    here.
+    """
+    live, archived, _ = ARCHIVED_TABLES[model.__tablename__]
+    cutoff = archive_cutoff(db, model.__tablename__)
+    plant_id = db.info.get('plant_id')
+    columns = [column.name for column in live.__table__.columns]
+
+    def rows(table):
+        query = select(*[table.c[name] for name in columns])
+        return query if plant_id is None else query.where(table.c.plant_id == plant_id)
+
+    if cutoff is None or (start is not None and start >= cutoff):
+        return live.__table__ if plant_id is None else rows(live.__table__).subquery(live.__tablename__)
+    return union_all(rows(live.__table__), rows(archived.__table__)).subquery(live.__tablename__)
+
+
+def ensure_partitions(db, months_ahead=3, today=None):
+    """Create the monthly partitions for this month and the next few (Postgres only)"""
+    if db.get_bind().dialect.name != 'postgresql':
+        return 0
+    first = month_start(today or date.today())
+    created = 0
+    for table_name in ARCHIVED_TABLES:
+        for offset in range(months_ahead + 1):
+            month = add_months(first, offset)
+            db.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{partition_name(table_name, month)}" '
+                f'PARTITION OF "{table_name}" '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created += 1
+    db.commit()
+    return created
+
+
+def _live_partitions(db, table_name):
+    """(name, month) of each monthly partition attached to a live table"""
+    rows = db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :parent"
+    ), {"parent": table_name}).scalars()
+    partitions = []
+    for name in rows:
+        match = _PARTITION_NAME.search(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def archive_before(db, cutoff, parquet_dir=None):
+    """
+    Move every row older than `cutoff` (a month start) to the archive tables
+
+    Returns {table_name: partitions moved + rows moved individually}. With
+    `parquet_dir`, each moved month is also written out as a Parquet file.
+    """
+    postgres = db.get_bind().dialect.name == 'postgresql'
+    moved = {}
+    for table_name, (live, archived, key) in ARCHIVED_TABLES.items():
+        count = 0
+        if postgres:
+            for name, month in _live_partitions(db, table_name):
+                if add_months(month, 1) > cutoff:
+                    continue
+                bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                db.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"'))
+                db.execute(text(f'ALTER TABLE "{archived.__tablename__}" ATTACH PARTITION "{name}" {bounds}'))
+                count += 1
+
+        key_column = getattr(live, key)
+        bound = cutoff if key == 'date' else datetime.combine(cutoff, datetime.min.time())
+        columns = [column.name for column in live.__table__.columns]
+        count += db.execute(insert(archived).from_select(
+            columns,
+            select(*[live.__table__.c[name] for name in columns]).where(key_column < bound)
+        )).rowcount
+        # Rows moved to the archive are not deleted as far as outbox consumers are concerned
+        db.execute(delete(live).where(key_column < bound).execution_options(outbox=False))
+
+        watermark = db.get(ArchiveWatermark, table_name)
+        if watermark is None:
+            db.add(ArchiveWatermark(table_name=table_name, archived_before=cutoff))
+        elif watermark.archived_before < cutoff:
+            watermark.archived_before = cutoff
+            watermark.archived_at = datetime.now()
+        moved[table_name] = count
+    db.commit()
+
+    if parquet_dir:
+        for table_name in ARCHIVED_TABLES:
+            export_parquet(db, table_name, cutoff, parquet_dir)
+    return moved
+
+
+def export_parquet(db, table_name, cutoff, directory):
+    """
+    Write each archived month before `cutoff` to <directory>/<table>/<YYYY-MM>.parquet
+
+    Months already exported are skipped. Needs pyarrow, which is only
+    imported here.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    _, archived, key = ARCHIVED_TABLES[table_name]
+    key_column = getattr(archived, key)
+    target = os.path.join(directory, table_name)
+    os.makedirs(target, exist_ok=True)
+    columns = [column.name for column in archived.__table__.columns]
+
+    first = db.query(key_column).order_by(key_column).limit(1).scalar()
+    if first is None:
+        return 0
+    written = 0
+    month = month_start(first)
+    while month < cutoff:
+        path = os.path.join(target, f"{month:%Y-%m}.parquet")
+        if not os.path.exists(path):
+            lower, upper = month, add_months(month, 1)
+            if key != 'date':
+                lower, upper = (datetime.combine(d, datetime.min.time()) for d in (lower, upper))
+            rows = db.execute(
+                select(archived.__table__).where(key_column >= lower, key_column < upper)
+            ).mappings().all()
+            if rows:
+                table = pa.Table.from_pylist([dict(row) for row in rows])
+                pq.write_table(table.select(columns), path, compression='zstd')
+                written += 1
+        month = add_months(month, 1)
+    return written
+
+
+if __name__ == "__main__":
+    # Intended to run from cron, e.g. monthly: python archive.py [--parquet DIR]
+    import argparse
+    parser = argparse.ArgumentParser(description="Create upcoming partitions and archive old months")
+    parser.add_argument('--retention-months', type=int, default=ARCHIVE_RETENTION_MONTHS)
+    parser.add_argument('--parquet', metavar='DIR', help="also export archived months as Parquet files")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        ensure_partitions(db)
+        cutoff = retention_cutoff(retention_months=args.retention_months)
+        for table_name, count in archive_before(db, cutoff, args.parquet).items():
+            print(f"{table_name}: archived {count} before {cutoff}")
+    finally:
+        db.close()
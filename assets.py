@@ -0,0 +1,233 @@
+"""
+Fingerprinted static assets with long-lived caching
+
+`url_for('static', filename=...)` returns a URL with a content hash in the
+file name (js/main.js -> js/main.<hash>.js), so a changed file always gets a
+new URL. Fingerprinted URLs are served with `Cache-Control: immutable` and a
+one-year max-age; plain URLs keep Flask's default revalidation. When the
+client accepts it and a precompressed `.br`/`.gz` sibling exists, that file
+is served instead.
+
+The hashes come from static/manifest.json when it is newer than every static
+file, otherwise they are computed on first use. No bundler is involved:
+
+    python assets.py build    # write the manifest and .gz/.br variants
+    python assets.py vendor   # download Bootstrap/Chart.js into static/vendor, then build
+
+Templates load third-party libraries with `vendor_url(name)`, which points at
+the local copy under static/vendor when it has been vendored (for LAN
+deployments without internet access) and at the CDN otherwise.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+
+from flask import request, send_from_directory, url_for, abort
+from werkzeug.security import safe_join
+
+HASH_LENGTH = 12
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+PRECOMPRESS_EXTENSIONS = ('.js', '.css', '.svg', '.json', '.txt', '.map')
+PRECOMPRESS_MIN_SIZE = 500
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_HASHED_NAME = re.compile(r'^(.*)\.([0-9a-f]{%d})(\.[^./]+)$' % HASH_LENGTH)
+
+# name -> (path under static/, CDN URL, extra files relative to the CDN URL)
+VENDOR = {
+    'bootstrap.css': ('vendor/bootstrap/bootstrap.min.css',
+                      'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css', ()),
+    'bootstrap.js': ('vendor/bootstrap/bootstrap.bundle.min.js',
+                     'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js', ()),
+    'bootstrap-icons.css': ('vendor/bootstrap-icons/bootstrap-icons.min.css',
+                            'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.min.css',
+                            ('fonts/bootstrap-icons.woff2', 'fonts/bootstrap-icons.woff')),
+    'chart.js': ('vendor/chart.js/chart.umd.js',
+                 'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.js', ()),
+}
+
+
+def hashed_name(filename, digest):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def _is_generated(filename):
+    return filename == MANIFEST_NAME or filename.endswith(('.gz', '.br'))
+
+
+def _static_files(static_folder):
+    for directory, _, names in os.walk(static_folder):
+        for name in names:
+            path = os.path.join(directory, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if not _is_generated(filename):
+                yield filename, path
+
+
+def build_manifest(static_folder):
+    """{filename: fingerprinted filename} for every static file"""
+    manifest = {}
+    for filename, path in _static_files(static_folder):
+        with open(path, 'rb') as f:
+            manifest[filename] = hashed_name(filename, hashlib.sha256(f.read()).hexdigest())
+    return manifest
+
+
+class AssetManifest:
+    """Maps static files to their fingerprinted names and back, loaded once"""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._forward = None
+        self._reverse = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._forward is not None:
+                return
+            manifest = None
+            path = os.path.join(self.static_folder, MANIFEST_NAME)
+            if os.path.exists(path):
+                built = os.path.getmtime(path)
+                # A file edited after the last build makes the manifest stale
+                if all(os.path.getmtime(p) <= built for _, p in _static_files(self.static_folder)):
+                    with open(path) as f:
+                        manifest = json.load(f)
+            if manifest is None:
+                manifest = build_manifest(self.static_folder)
+            self._reverse = {hashed: filename for filename, hashed in manifest.items()}
+            self._forward = manifest
+
+    def url_path(self, filename):
+        if self._forward is None:
+            self._load()
+        return self._forward.get(filename, filename)
+
+    def resolve(self, requested):
+        """The file behind a fingerprinted name, or None if it is not current"""
+        if self._reverse is None:
+            self._load()
+        return self._reverse.get(requested)
+
+
+def serve_static(manifest, filename):
+    """Static view: immutable caching for fingerprinted names, precompressed variants"""
+    original = manifest.resolve(filename)
+    immutable = original is not None
+    if original is None:
+        original = filename
+        match = _HASHED_NAME.match(filename)
+        if match and not os.path.isfile(safe_join(manifest.static_folder, filename) or ''):
+            # An outdated fingerprint (e.g. a page cached across a deploy): serve the
+            # current file, but without the long-lived caching
+            original = match.group(1) + match.group(3)
+    path = safe_join(manifest.static_folder, original)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(original)[0] or 'application/octet-stream'
+    served, encoding, has_variants = original, None, False
+    for name, extension in ENCODINGS:
+        if os.path.isfile(path + extension):
+            has_variants = True
+            if encoding is None and name in request.accept_encodings:
+                served, encoding = original + extension, name
+
+    max_age = 31536000 if immutable else None
+    response = send_from_directory(manifest.static_folder, served, mimetype=mimetype, max_age=max_age)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if has_variants:
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+def vendored(static_folder, name):
+    return os.path.isfile(os.path.join(static_folder, VENDOR[name][0]))
+
+
+def init_assets(app):
+    """Fingerprint `static` URLs, serve them with long-lived caching and add vendor_url()"""
+    manifest = AssetManifest(app.static_folder)
+    local = {name: vendored(app.static_folder, name) for name in VENDOR}
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and not app.debug:
+            values['filename'] = manifest.url_path(values['filename'])
+
+    def vendor_url(name):
+        path, cdn_url, _ = VENDOR[name]
+        return url_for('static', filename=path) if local[name] else cdn_url
+
+    app.view_functions['static'] = lambda filename: serve_static(manifest, filename)
+    app.jinja_env.globals['vendor_url'] = vendor_url
+    return manifest
+
+
+def precompress(static_folder):
+    """Write .gz (and .br when brotli is installed) next to compressible files"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    written = 0
+    for filename, path in _static_files(static_folder):
+        if not filename.endswith(PRECOMPRESS_EXTENSIONS) or os.path.getsize(path) < PRECOMPRESS_MIN_SIZE:
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli:
+            variants.append(('.br', brotli.compress(data, quality=11)))
+        for extension, compressed in variants:
+            with open(path + extension, 'wb') as f:
+                f.write(compressed)
+            written += 1
+    return written
+
+
+def build(static_folder):
+    """Precompress assets and write the manifest (last, so it is newer than every file)"""
+    written = precompress(static_folder)
+    manifest = build_manifest(static_folder)
+    with open(os.path.join(static_folder, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return len(manifest), written
+
+
+def vendor(static_folder):
+    """Download the CDN libraries (and the files their CSS refers to) into static/vendor"""
+    from urllib.request import urlopen
+    for name, (path, cdn_url, extra) in VENDOR.items():
+        base = cdn_url.rsplit('/', 1)[0]
+        target_dir = os.path.dirname(os.path.join(static_folder, path))
+        downloads = [(cdn_url, os.path.join(static_folder, path))]
+        downloads += [(f"{base}/{relative}", os.path.join(target_dir, relative)) for relative in extra]
+        for url, target in downloads:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with urlopen(url, timeout=30) as response, open(target, 'wb') as f:
+                f.write(response.read())
+            print(f"{name}: {url} -> {os.path.relpath(target, static_folder)}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets")
+    parser.add_argument('command', choices=['build', 'vendor'])
+    parser.add_argument('--static', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    args = parser.parse_args()
+
+    if args.command == 'vendor':
+        vendor(args.static)
+    files, compressed = build(args.static)
+    print(f"Manifest: {files} files, {compressed} precompressed variants")
@@ -0,0 +1,191 @@
+"""
+Attendance reports from per-worker monthly bitsets
+
+attendance_months holds one row per worker, section and month. Its `days`
+column has bit n set when the worker was present on day n + 1, and
+`present` is its popcount. section_attendance_months holds the OR of a
+section's bitsets, i.e. the days the section worked. The flush hook in
+models.py keeps both in step with attendance rows, and bulk imports and
+replication call add_attendance_bits. The bitsets also cover months that
+archive.py has moved out of the live attendance table.
+
+Reports read one small row per worker and month instead of one row per
+worker and day:
+- present days are popcounts, summed in SQL for whole months
+- a section's working days come from its OR-ed bitset
+- streaks are runs of set bits in a worker's bitsets laid end to end
+
+Rebuild a range after changing attendance outside the app:
+python attendance.py 2024-01-01 [2024-12-31]
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import delete, func, select
+from models import AttendanceMonth, SectionAttendanceMonth, Attendance, Worker, Section, add_attendance_bits
+from archive import with_archive
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def day_mask(month, start, end):
+    """Bits of `month` that fall within [start, end]"""
+    if month < month_start(start) or month > month_start(end):
+        return 0
+    first = start.day if month_start(start) == month else 1
+    last = end.day if month_start(end) == month else (next_month(month) - month).days
+    return ((1 << last) - 1) ^ ((1 << (first - 1)) - 1)
+
+
+def _range(db, start, end):
+    """Resolve an open-ended range against the stored months"""
+    end = end or date.today()
+    if start is None:
+        start = db.query(AttendanceMonth.month).order_by(AttendanceMonth.month).limit(1).scalar() or end
+    return start, end
+
+
+def _months(db, first, last, start, end, section_id=None):
+    """(worker_id, section_id, month, days) rows for months first..last, days masked to [start, end]"""
+    query = select(AttendanceMonth.worker_id, AttendanceMonth.section_id, AttendanceMonth.month,
+                   AttendanceMonth.days).where(AttendanceMonth.month.between(first, last))
+    if section_id is not None:
+        query = query.where(AttendanceMonth.section_id == section_id)
+    masks = {}
+    for worker_id, row_section_id, month, days in db.execute(query):
+        if month not in masks:
+            masks[month] = day_mask(month, start, end)
+        yield worker_id, row_section_id, month, days & masks[month]
+
+
+def _whole_months(start, end):
+    """(first, last) month wholly inside [start, end]; first > last when there is none"""
+    first = month_start(start) if start.day == 1 else next_month(month_start(start))
+    last = month_start(end)
+    if next_month(last) - timedelta(days=1) != end:
+        last = month_start(last - timedelta(days=1))
+    return first, last
+
+
+def section_attendance(db, start=None, end=None):
+    """
+    Per section: present worker-days, working days, peak headcount and rate
+
+    Working days are days anyone in the section was present. The rate is
+    present / the sum over months of (workers present that month x working
+    days). Whole months come from section_attendance_months; only the
+    partial months at either end of the range read worker bitsets.
+    """
+    start, end = _range(db, start, end)
+    first, last = _whole_months(start, end)
+    # section -> [present, working days, worker-days available, peak workers]
+    totals = {}
+
+    def add(section_id, days, present, workers):
+        total = totals.setdefault(section_id, [0, 0, 0, 0])
+        total[0] += present
+        total[1] += days.bit_count()
+        total[2] += workers * days.bit_count()
+        total[3] = max(total[3], workers)
+
+    if first <= last:
+        for row in db.query(SectionAttendanceMonth.section_id, SectionAttendanceMonth.days,
+                            SectionAttendanceMonth.present, SectionAttendanceMonth.workers) \
+                .filter(SectionAttendanceMonth.month.between(first, last)):
+            add(row.section_id, row.days, row.present, row.workers)
+    for month in {month_start(start), month_start(end)}:
+        if first <= month <= last:
+            continue
+        sections = {}
+        for _, section_id, _, days in _months(db, month, month, start, end):
+            if days:
+                section = sections.setdefault(section_id, [0, 0, 0])
+                section[0] |= days
+                section[1] += days.bit_count()
+                section[2] += 1
+        for section_id, (days, present, workers) in sections.items():
+            add(section_id, days, present, workers)
+
+    names = dict(db.query(Section.id, Section.name).filter(Section.id.in_(totals)).all()) if totals else {}
+    return [
+        {"section_id": section_id, "section": names.get(section_id), "present": present,
+         "working_days": working_days, "headcount": headcount,
+         "rate": round(present / available, 4) if available else None}
+        for section_id, (present, working_days, available, headcount)
+        in sorted(totals.items(), key=lambda item: names.get(item[0]) or '')
+    ]
+
+
+def longest_run(bits):
+    """Length of the longest run of set bits, in O(log length) big-int operations"""
+    if not bits:
+        return 0
+    # runs[i] marks where runs of at least 2**i set bits start
+    runs = [bits]
+    while runs[-1] & (runs[-1] >> (1 << len(runs) - 1)):
+        runs.append(runs[-1] & (runs[-1] >> (1 << len(runs) - 1)))
+    length, starts = 1 << len(runs) - 1, runs[-1]
+    for i in range(len(runs) - 2, -1, -1):
+        longer = starts & (runs[i] >> length)
+        if longer:
+            starts, length = longer, length + (1 << i)
+    return length
+
+
+def worker_attendance(db, start=None, end=None, section_id=None):
+    """Per worker: present days and longest run of consecutive present days"""
+    start, end = _range(db, start, end)
+    origin = month_start(start)
+    timelines = {}
+    for worker_id, _, month, days in _months(db, month_start(start), end, start, end, section_id):
+        # Lay each month's bits at its offset in days from the first month
+        timelines[worker_id] = timelines.get(worker_id, 0) | days << (month - origin).days
+    names = dict(db.query(Worker.id, Worker.name).filter(Worker.id.in_(timelines)).all()) if timelines else {}
+    return [
+        {"worker_id": worker_id, "name": names.get(worker_id), "present": bits.bit_count(),
+         "longest_streak": longest_run(bits)}
+        for worker_id, bits in sorted(timelines.items())
+    ]
+
+
+def absentees(db, day, section_id=None):
+    """Workers (of a section) with no attendance marked present on `day`"""
+    bit = 1 << (day.day - 1)
+    present = {worker_id for worker_id, _, _, days in _months(db, month_start(day), day, day, day) if days & bit}
+    query = db.query(Worker.id, Worker.name, Worker.section_id).order_by(Worker.id)
+    if section_id is not None:
+        query = query.filter(Worker.section_id == section_id)
+    return [{"worker_id": row.id, "name": row.name, "section_id": row.section_id}
+            for row in query if row.id not in present]
+
+
+def rebuild_attendance_months(db, start, end):
+    """Recompute the bitsets of every month overlapping [start, end] from the attendance rows"""
+    first, last = month_start(start), next_month(month_start(end))
+    db.execute(delete(AttendanceMonth).where(AttendanceMonth.month >= first, AttendanceMonth.month < last))
+    db.execute(delete(SectionAttendanceMonth).where(SectionAttendanceMonth.month >= first,
+                                                    SectionAttendanceMonth.month < last))
+    records = with_archive(db, Attendance, first).c
+    rows = db.execute(select(records.plant_id, records.worker_id, records.section_id, records.date,
+                             records.present).where(records.date >= first, records.date < last))
+    add_attendance_bits(db.connection(), [row._asdict() for row in rows])
+    db.commit()
+
+
+if __name__ == "__main__":
+    import sys
+    from models import SessionLocal
+
+    start = date.fromisoformat(sys.argv[1])
+    end = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else date.today()
+    db = SessionLocal()
+    try:
+        rebuild_attendance_months(db, start, end)
+        print(f"Attendance bitmaps rebuilt for {start} to {end}")
+    finally:
+        db.close()
@@ -1,17 +1,7 @@
 import os
 from functools import wraps
 from flask import request, jsonify, session
-import jwt
-
-# Import Supabase client conditionally
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-if SUPABASE_URL and SUPABASE_KEY:
-    from supabase import create_client, Client
-    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-else:
-    supabase_client = None # For local testing without Supabase
+from clients import get_supabase_client
 
 # Dummy user data for local testing
 LOCAL_USERS = {
@@ -22,6 +12,7 @@ LOCAL_USERS = {
 
 def login_user(email, password):
     """Login user with Supabase Auth or local dummy auth"""
+    supabase_client = get_supabase_client()
     if supabase_client:
         try:
             response = supabase_client.auth.sign_in_with_password({
@@ -70,6 +61,7 @@ def login_user(email, password):
 
 def register_user(email, password, role="staff", section_id=1):
     """Register a new user with Supabase Auth or local dummy auth"""
+    supabase_client = get_supabase_client()
     if supabase_client:
         try:
             response = supabase_client.auth.sign_up({
@@ -98,6 +90,7 @@ def register_user(email, password, role="staff", section_id=1):
 
 def get_user_role(user_id):
     """Get user role from user metadata (Supabase or local dummy) """
+    supabase_client = get_supabase_client()
     if supabase_client:
         try:
             user = supabase_client.auth.get_user()
@@ -115,6 +108,8 @@ def get_user_role(user_id):
 
 def verify_token(token):
     """Verify JWT token"""
+    import jwt  # only needed by token-authenticated API calls
+    
     try:
         # For demo purposes, we'll use a simple verification
         # In production, use proper JWT verification with Supabase
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Admission control benchmark: staff entries while admins run heavy reports
+
+Emulates one gunicorn worker with --threads request threads (a thread pool
+that requests queue for, as in gthread). --admins clients keep requesting
+the full-range production report over --logs production logs, while staff
+submit a production entry every --interval-ms. Runs once with the
+admission pools off and once with the defaults, and prints the entry
+latencies and the report outcomes.
+
+Usage: python bench_admission.py [--logs 200000] [--threads 8] [--admins 12] [--seconds 10]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+DAYS = 365
+
+
+def seed(url, logs):
+    from models import Base, Section, Worker, Item, ProductionLog
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        connection.execute(text("PRAGMA journal_mode=WAL"))
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([Section(id=1, name='Raw Material')]
+               + [Item(id=i, name=f"Item {i}", unit='pcs', default_target=10) for i in range(1, 51)]
+               + [Worker(id=i, name=f"Worker {i}", section_id=1) for i in range(1, 101)])
+    db.commit()
+    first = date.today() - timedelta(days=DAYS)
+    for start in range(0, logs, 10000):
+        db.execute(insert(ProductionLog), [
+            {'plant_id': 'main', 'worker_id': i % 100 + 1, 'item_id': i % 50 + 1, 'section_id': 1,
+             'date': first + timedelta(days=i % DAYS), 'target': 10, 'actual': 8 + i % 5, 'input_material': 10,
+             'output_material': 9, 'wastage': 1, 'overtime_hours': 0}
+            for i in range(start, min(start + 10000, logs))])
+    db.commit()
+    db.close()
+    engine.dispose()
+
+
+def client(role, section_id=1):
+    from app import app
+    test_client = app.test_client()
+    with test_client.session_transaction() as sess:
+        sess['user'] = {'id': role, 'user_metadata': {'section_id': section_id}}
+        sess['role'] = role
+    return test_client
+
+
+def run(threads, admins, seconds, interval):
+    """Returns (entry latencies in seconds, report status counts)"""
+    stop = threading.Event()
+    local = threading.local()
+    latencies = []
+    reports = {}
+
+    def request(role, method, url, **kwargs):
+        # Runs on a "request thread"; one test client per thread and role
+        key = f"client_{role}"
+        if not hasattr(local, key):
+            setattr(local, key, client(role))
+        return getattr(getattr(local, key), method)(url, **kwargs).status_code
+
+    with ThreadPoolExecutor(max_workers=threads) as server:
+        def admin():
+            while not stop.is_set():
+                status = server.submit(request, 'admin', 'get', '/api/reports/production').result()
+                reports[status] = reports.get(status, 0) + 1
+                if status == 503:
+                    time.sleep(0.2)  # the dashboard backs off instead of hammering
+
+        def staff():
+            pending = []
+            while not stop.is_set():
+                submitted = time.perf_counter()
+                future = server.submit(request, 'staff', 'post', '/api/production', json={
+                    'worker_id': 1, 'item_id': 1, 'date': date.today().isoformat(),
+                    'actual': 1, 'input_material': 1, 'output_material': 1})
+                future.add_done_callback(lambda f, t=submitted: latencies.append(time.perf_counter() - t))
+                pending.append(future)
+                time.sleep(interval)
+            for future in pending:
+                if future.result() != 200:
+                    raise RuntimeError(f"Entry failed with {future.result()}")
+
+        clients = [threading.Thread(target=admin) for _ in range(admins)] + [threading.Thread(target=staff)]
+        for thread in clients:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in clients:
+            thread.join()
+    return latencies, reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--logs', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--admins', type=int, default=12)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--interval-ms', type=int, default=50)
+    args = parser.parse_args()
+
+    import admission
+    import query_cache
+    # Admins pick ad-hoc ranges, so every report runs its SQL
+    query_cache.cache.max_entries = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'admission.db')}"
+        seed(url, args.logs)
+        engine = create_engine(url, connect_args={'check_same_thread': False, 'timeout': 30},
+                               pool_size=args.threads * 2, max_overflow=0)
+        sessions = sessionmaker(bind=engine)
+        reads = sessionmaker(bind=engine, info={'read_only': True})
+
+        with patch('app.SessionLocal', sessions), patch('app.ReadSessionLocal', reads):
+            for label, off in (('pools off', True), ('pools on', False)):
+                # Fresh pools (and counters) per run, with the configured limits or none
+                pools = {name: admission.AdmissionPool(name, 0 if off else pool.concurrency, pool.queue_limit,
+                                                       pool.max_wait)
+                         for name, pool in admission.POOLS.items()}
+                with patch.dict(admission.POOLS, pools):
+                    latencies, reports = run(args.threads, args.admins, args.seconds, args.interval_ms / 1000)
+                    stats = admission.stats()
+                latencies.sort()
+                print(f"{label:9}  entries {len(latencies):4}: p50 {statistics.median(latencies) * 1000:7.1f}ms "
+                      f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.1f}ms "
+                      f"max {latencies[-1] * 1000:7.1f}ms  reports {dict(sorted(reports.items()))}")
+        print(f"admission (pools on): {stats}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
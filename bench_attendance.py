@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Attendance report benchmark: attendance rows vs monthly bitsets
+
+Seeds a SQLite file with attendance for --workers workers over --years
+years (about 85% presence, no Sundays), then times the section report the
+old way (COUNT over attendance rows) and from attendance_months
+(section_attendance, worker_attendance with streaks) over the whole range
+and the last year.
+
+Usage: python bench_attendance.py [--workers 1000] [--years 5] [--sections 10]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+
+def seed(url, workers, years, sections):
+    """Returns (first day, last day, attendance rows)"""
+    from models import Base, Section, Worker, Attendance, add_attendance_bits
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([Section(id=i, name=f"Section {i}") for i in range(1, sections + 1)])
+    db.add_all([Worker(id=i, name=f"Worker {i}", section_id=i % sections + 1) for i in range(1, workers + 1)])
+    db.commit()
+
+    rng = random.Random(1)
+    end = date.today()
+    start = date(end.year - years, end.month, 1)
+    total = 0
+    day = start
+    while day <= end:
+        if day.weekday() != 6:
+            rows = [{'plant_id': 'main', 'worker_id': i, 'section_id': i % sections + 1, 'date': day, 'present': True}
+                    for i in range(1, workers + 1) if rng.random() < 0.85]
+            db.execute(insert(Attendance), rows)
+            add_attendance_bits(db.connection(), rows)
+            total += len(rows)
+        if day.day == 1:
+            db.commit()
+        day += timedelta(days=1)
+    db.commit()
+    db.close()
+    engine.dispose()
+    return start, end, total
+
+
+def timed(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=1000)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--sections', type=int, default=10)
+    args = parser.parse_args()
+
+    from models import Attendance, AttendanceMonth, SectionAttendanceMonth, Section
+    from attendance import section_attendance, worker_attendance
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'attendance.db')}"
+        started = time.perf_counter()
+        start, end, rows = seed(url, args.workers, args.years, args.sections)
+        print(f"Seeded {rows} attendance rows ({args.workers} workers, {start} to {end}) "
+              f"in {time.perf_counter() - started:.0f}s")
+
+        engine = create_engine(url)
+        # Scoped like the app's request sessions
+        db = sessionmaker(bind=engine)(info={'plant_id': 'main'})
+        months = db.query(func.count()).select_from(AttendanceMonth).scalar()
+        section_months = db.query(func.count()).select_from(SectionAttendanceMonth).scalar()
+
+        def rows_report():
+            return db.query(Section.name, func.count(Attendance.id)).join(Attendance, Attendance.section_id == Section.id) \
+                .filter(Attendance.present == True, Attendance.date.between(start, end)).group_by(Section.name).all()
+
+        seconds, _ = timed(rows_report)
+        print(f"rows     section report {seconds * 1000:8.1f}ms, reads {rows} attendance rows")
+        year = end.replace(year=end.year - 1) + timedelta(days=1)
+        for label, first in ((f"{args.years}y", start), ('1y', year)):
+            seconds, _ = timed(lambda: section_attendance(db, first, end))
+            print(f"bitsets  section report {label:>3} {seconds * 1000:8.1f}ms")
+            seconds, _ = timed(lambda: worker_attendance(db, first, end))
+            print(f"bitsets  worker report  {label:>3} {seconds * 1000:8.1f}ms "
+                  f"(present days and longest streak per worker)")
+        print(f"bitsets: {months} worker-month and {section_months} section-month rows")
+        db.close()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
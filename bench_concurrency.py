@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test for production entries
+
+Fires many parallel POST /api/production submissions for one downstream
+section and day, all competing for the same upstream output. Afterwards it
+checks the material-flow invariant (the section never consumed more input
+than upstream produced) and prints the throughput.
+
+By default it runs against a fresh SQLite file. --database-url can point
+at a scratch Postgres database; its tables are created and seeded, so do
+not use a real one.
+
+Usage: python bench_concurrency.py [--submissions 500] [--workers 32] [--database-url URL]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+UPSTREAM_OUTPUT = 100.0
+
+
+def seed(sessions, day):
+    from models import Base, Section, Worker, Item, ProductionLog
+    db = sessions()
+    try:
+        Base.metadata.create_all(bind=db.get_bind())
+        db.add_all([Section(id=1, name='Raw Material', next_section_id=2), Section(id=2, name='Processing'),
+                    Worker(id=1, name='Upstream', section_id=1), Worker(id=2, name='Downstream', section_id=2),
+                    Item(id=1, name='Sheet', unit='kg', default_target=10)])
+        db.flush()
+        db.add(ProductionLog(worker_id=1, item_id=1, section_id=1, date=day, target=10, actual=10,
+                             input_material=UPSTREAM_OUTPUT, output_material=UPSTREAM_OUTPUT,
+                             wastage=0, overtime_hours=0))
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_stress(database_url, submissions, workers):
+    """
+    Submit `submissions` entries of 1kg each from `workers` threads
+
+    Returns (accepted, consumed kg, seconds).
+    """
+    from app import app
+    from models import ProductionLog
+
+    connect_args = {'check_same_thread': False, 'timeout': 30} if database_url.startswith('sqlite') else {}
+    engine = create_engine(database_url, connect_args=connect_args, pool_size=workers, max_overflow=0)
+    sessions = sessionmaker(bind=engine)
+    day = date.today()
+    seed(sessions, day)
+
+    local = threading.local()
+
+    def submit(_):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user'] = {'id': 'stress', 'user_metadata': {'section_id': 2}}
+                sess['role'] = 'staff'
+        response = client.post('/api/production', json={
+            'worker_id': 2, 'item_id': 1, 'date': day.isoformat(),
+            'actual': 1, 'input_material': 1, 'output_material': 1
+        })
+        return response.status_code
+
+    started = time.perf_counter()
+    with patch('app.get_db', side_effect=lambda: sessions()):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            statuses = list(pool.map(submit, range(submissions)))
+    elapsed = time.perf_counter() - started
+
+    db = sessions()
+    try:
+        consumed = db.query(func.coalesce(func.sum(ProductionLog.input_material), 0)).filter(
+            ProductionLog.section_id == 2, ProductionLog.date == day
+        ).scalar()
+    finally:
+        db.close()
+        engine.dispose()
+    unexpected = [status for status in statuses if status not in (200, 400)]
+    if unexpected:
+        raise RuntimeError(f"Unexpected responses: {sorted(set(unexpected))}")
+    return statuses.count(200), consumed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--submissions', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--database-url', help="scratch database (default: a temporary SQLite file)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'stress.db')}"
+        accepted, consumed, elapsed = run_stress(url, args.submissions, args.workers)
+
+    print(f"{args.submissions} submissions from {args.workers} threads in {elapsed:.2f}s "
+          f"({args.submissions / elapsed:.0f}/s)")
+    print(f"accepted {accepted}, consumed {consumed}kg of {UPSTREAM_OUTPUT}kg upstream output")
+    if consumed > UPSTREAM_OUTPUT:
+        raise SystemExit("FAIL: section consumed more input than upstream produced")
+    print("OK: material flow invariant held")
+
+
+if __name__ == "__main__":
+    main()
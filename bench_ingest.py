@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Shift-end ingestion benchmark: per-request commits vs write-behind group commit
+
+Posts a burst of attendance and downtime entries from many threads, once
+with INGEST_MODE=direct (each request commits) and once with buffered
+ingestion (see ingest.py). It reports request throughput, database
+commits and entries per commit, and the time until every entry is in the
+database.
+
+By default it runs against a fresh SQLite file. --database-url can point
+at a scratch database; its tables are created and seeded.
+
+Usage: python bench_ingest.py [--entries 2000] [--workers 32] [--database-url URL]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+
+
+def make_sessions(database_url, workers):
+    from models import Base, Section, Worker
+    connect_args = {'check_same_thread': False, 'timeout': 30} if database_url.startswith('sqlite') else {}
+    engine = create_engine(database_url, connect_args=connect_args, pool_size=workers + 2, max_overflow=0)
+    Base.metadata.create_all(bind=engine)
+    sessions = sessionmaker(bind=engine)
+    db = sessions()
+    if not db.get(Section, 1):
+        db.add_all([Section(id=1, name='Assembly')] + [Worker(id=i, name=f"Worker {i}", section_id=1) for i in range(1, 21)])
+        db.commit()
+    db.close()
+    return engine, sessions
+
+
+def burst(entries, workers):
+    """POST `entries` payloads from `workers` threads; returns seconds taken"""
+    from app import app
+    today = date.today().isoformat()
+    local = threading.local()
+
+    def submit(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user'] = {'id': 'bench', 'user_metadata': {'section_id': 1}}
+                sess['role'] = 'staff'
+        if i % 2:
+            response = client.post('/api/attendance', json={'workers': [i % 20 + 1], 'date': today})
+        else:
+            response = client.post('/api/downtime', json={
+                'machine_name': f"Press {i % 7}", 'start_time': f"{today}T08:00", 'end_time': f"{today}T08:30"})
+        if response.status_code not in (200, 202):
+            raise RuntimeError(response.get_json())
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(submit, range(entries)))
+    return time.perf_counter() - started
+
+
+def run(mode, database_url, entries, workers, log_dir):
+    """Returns (request seconds, seconds until stored, commits)"""
+    from ingest import IngestBuffer
+    from models import Attendance, MachineDowntime
+    engine, sessions = make_sessions(database_url, workers)
+    commits = []
+    event.listen(engine, 'commit', lambda conn: commits.append(1))
+
+    buffer = IngestBuffer(sessions=sessions, directory=log_dir)
+    with patch('app.get_db', side_effect=lambda: sessions()), \
+            patch('app.INGEST_MODE', mode), patch('app.ingest_buffer', buffer), \
+            patch('ingest.buffer', buffer):
+        started = time.perf_counter()
+        request_seconds = burst(entries, workers)
+        if mode == 'buffered':
+            buffer.stop()
+        stored_seconds = time.perf_counter() - started
+
+    db = sessions()
+    stored = db.query(func.count(Attendance.id)).scalar() + db.query(func.count(MachineDowntime.id)).scalar()
+    db.close()
+    engine.dispose()
+    if stored < entries:
+        raise RuntimeError(f"{mode}: only {stored} of {entries} entries stored")
+    return request_seconds, stored_seconds, len(commits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--database-url', help="scratch database (default: temporary SQLite files)")
+    args = parser.parse_args()
+
+    for mode in ('direct', 'buffered'):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = args.database_url or f"sqlite:///{os.path.join(tmp, 'ingest.db')}"
+            request_seconds, stored_seconds, commits = run(mode, url, args.entries, args.workers,
+                                                           os.path.join(tmp, 'logs'))
+        print(f"{mode:<9} {args.entries / request_seconds:8.0f} requests/s, "
+              f"{commits:5d} commits ({commits / stored_seconds:4.0f}/s, {args.entries / commits:5.1f} entries each), "
+              f"all stored after {stored_seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
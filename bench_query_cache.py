@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Query cache benchmark: repeated report queries with and without the cache
+
+Seeds a SQLite file with --logs production logs, then runs the admin
+dashboard's queries and a production-by-section report --repeat times in
+read-only sessions (like get_read_db), once with the query cache disabled
+and once enabled, and after a write to show the first run after a change.
+
+Usage: python bench_query_cache.py [--logs 200000] [--repeat 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+DAYS = 60
+
+
+def seed(url, logs):
+    from models import Base, Section, Worker, Item, ProductionLog
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([Section(id=i, name=f"Section {i}") for i in range(1, 11)]
+               + [Item(id=i, name=f"Item {i}", unit='pcs', default_target=10) for i in range(1, 21)]
+               + [Worker(id=i, name=f"Worker {i}", section_id=i % 10 + 1) for i in range(1, 201)])
+    db.commit()
+    first = date.today() - timedelta(days=DAYS - 1)
+    rows = [{'plant_id': 'main', 'worker_id': i % 200 + 1, 'item_id': i % 20 + 1, 'section_id': i % 10 + 1,
+             'date': first + timedelta(days=i % DAYS), 'target': 10, 'actual': 8 + i % 5, 'input_material': 10,
+             'output_material': 9, 'wastage': 1, 'overtime_hours': 0} for i in range(logs)]
+    for start in range(0, logs, 10000):
+        db.execute(insert(ProductionLog), rows[start:start + 10000])
+    db.commit()
+    db.close()
+    engine.dispose()
+
+
+def reports(db):
+    from models import Worker, Section, ProductionLog
+    db.query(Worker).count()
+    db.query(Section).count()
+    db.query(func.sum(ProductionLog.target), func.sum(ProductionLog.actual), func.sum(ProductionLog.wastage)) \
+        .filter(ProductionLog.date == date.today()).one()
+    db.query(Section.name, func.sum(ProductionLog.target), func.sum(ProductionLog.actual)) \
+        .join(ProductionLog, ProductionLog.section_id == Section.id) \
+        .filter(ProductionLog.date >= date.today() - timedelta(days=29)).group_by(Section.name).all()
+
+
+def timed(sessions, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        db = sessions()
+        try:
+            reports(db)
+        finally:
+            db.close()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--logs', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    import query_cache
+    from models import Worker
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'cache.db')}"
+        seed(url, args.logs)
+        engine = create_engine(url)
+        reads = sessionmaker(bind=engine, info={'read_only': True})
+
+        query_cache.cache.max_entries = 0
+        print(f"no cache   {timed(reads, args.repeat) * 1000:7.2f}ms per dashboard + report")
+        query_cache.cache.max_entries = 1000
+        timed(reads, 1)
+        print(f"cached     {timed(reads, args.repeat) * 1000:7.2f}ms per dashboard + report")
+
+        db = sessionmaker(bind=engine)()
+        db.add(Worker(name='New worker', section_id=1))
+        db.commit()
+        db.close()
+        print(f"after write {timed(reads, 1) * 1000:6.2f}ms (first run re-queries the changed tables)")
+        print(f"cache: {query_cache.stats()}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Mixed read/write benchmark for the SQLite edge profile
+
+Runs a report-style read / check-then-insert write mix from several worker
+processes (like gunicorn workers), each with several threads, against one
+SQLite file. It runs once with SQLAlchemy's SQLite defaults and once with
+the edge profile from sqlite_edge.py, and reports reads and writes per
+second and how many operations failed with "database is locked".
+
+Usage: python bench_sqlite.py [--processes 4] [--threads 8] [--seconds 5] [--write-ratio 0.2]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+DAYS = 30
+
+
+def make_engines(url, profile):
+    if profile == 'edge':
+        import sqlite_edge
+        return sqlite_edge.create_engines(url)
+    engine = create_engine(url, connect_args={'check_same_thread': False})
+    return engine, engine
+
+
+def seed(url):
+    from models import Base, Section, Worker, Item, ProductionLog
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([Section(id=1, name='Assembly'), Item(id=1, name='Bolt', unit='pcs', default_target=10)]
+               + [Worker(id=i, name=f"Worker {i}", section_id=1) for i in range(1, 21)])
+    db.add_all(ProductionLog(worker_id=i % 20 + 1, item_id=1, section_id=1, date=date(2024, 1, i % DAYS + 1),
+                             target=10, actual=10, input_material=10, output_material=9, wastage=1,
+                             overtime_hours=0) for i in range(5000))
+    db.commit()
+    db.close()
+    engine.dispose()
+
+
+def worker_process(url, profile, threads, seconds, write_ratio):
+    """Returns (reads, writes, locked errors) for one process"""
+    from models import ProductionLog
+    writer, reader = make_engines(url, profile)
+    write_sessions, read_sessions = sessionmaker(bind=writer), sessionmaker(bind=reader)
+    deadline = time.monotonic() + seconds
+
+    def read(db, day):
+        db.query(ProductionLog.worker_id, func.sum(ProductionLog.actual)).filter(
+            ProductionLog.date == day).group_by(ProductionLog.worker_id).all()
+
+    def write(db, day):
+        # Same shape as a production entry: check what was consumed, then insert
+        db.query(func.sum(ProductionLog.input_material)).filter(
+            ProductionLog.section_id == 1, ProductionLog.date == day).scalar()
+        db.add(ProductionLog(worker_id=1, item_id=1, section_id=1, date=day, target=10, actual=10,
+                             input_material=1, output_material=1, wastage=0, overtime_hours=0))
+        db.flush()
+        # ... and keep the transaction open for follow-up queries (stats, stock)
+        read(db, day)
+        db.commit()
+
+    def loop(_):
+        counts = [0, 0, 0]
+        rng = random.Random()
+        while time.monotonic() < deadline:
+            writing = rng.random() < write_ratio
+            db = (write_sessions if writing else read_sessions)()
+            try:
+                (write if writing else read)(db, date(2024, 1, rng.randint(1, DAYS)))
+                counts[1 if writing else 0] += 1
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                counts[2] += 1
+            finally:
+                db.close()
+        return counts
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(loop, range(threads)))
+    writer.dispose()
+    reader.dispose()
+    return tuple(sum(counts[i] for counts in results) for i in range(3))
+
+
+def run(profile, processes, threads, seconds, write_ratio):
+    """Returns (reads/s, writes/s, locked errors)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'edge.db')}"
+        seed(url)
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            results = pool.starmap(worker_process, [(url, profile, threads, seconds, write_ratio)] * processes)
+    reads, writes, locked = (sum(result[i] for result in results) for i in range(3))
+    return reads / seconds, writes / seconds, locked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"{args.processes} processes x {args.threads} threads, {args.write_ratio:.0%} writes, {args.seconds:g}s")
+    for profile in ('default', 'edge'):
+        reads, writes, locked = run(profile, args.processes, args.threads, args.seconds, args.write_ratio)
+        print(f"{profile:<8} {reads:7.0f} reads/s {writes:6.0f} writes/s {locked:6d} 'database is locked' errors")
+
+
+if __name__ == "__main__":
+    main()
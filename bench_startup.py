@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Cold-start import benchmark
+
+Imports the app in fresh interpreters with `python -X importtime` (the way a
+serverless cold start does) and fails when the cumulative import time of
+`app` exceeds the budget, or when a module that must stay lazy (Supabase,
+JWT, the Postgres driver) is imported eagerly.
+
+Usage: python bench_startup.py [--budget-ms 800] [--runs 5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules that should only load on first use, never at import time
+LAZY_MODULES = ('supabase', 'gotrue', 'postgrest', 'httpx', 'jwt', 'psycopg', 'psycopg2')
+
+
+def measure_import(runs=5, module='app'):
+    """
+    Import `module` in `runs` fresh interpreters
+
+    Returns (best cumulative microseconds, set of top-level modules imported).
+    """
+    env = dict(os.environ)
+    # Same shape as the Vercel configuration: Supabase credentials present
+    env.setdefault('SUPABASE_URL', 'https://example.supabase.co')
+    env.setdefault('SUPABASE_KEY', 'benchmark-key')
+    env.pop('USE_LOCAL_DB', None)
+
+    best, modules = None, set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, cumulative, name = line.split('|')
+            name = name.strip()
+            modules.add(name.split('.')[0])
+            if name == module and cumulative.strip().isdigit():
+                value = int(cumulative)
+                best = value if best is None else min(best, value)
+    return best, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('IMPORT_BUDGET_MS', '800')))
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    best_us, modules = measure_import(args.runs)
+    eager = sorted(m for m in LAZY_MODULES if m in modules)
+
+    print(f"import app: {best_us / 1000:.1f}ms (best of {args.runs}, budget {args.budget_ms:.0f}ms)")
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if best_us / 1000 > args.budget_ms:
+        print("FAIL: cold-start import budget exceeded")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
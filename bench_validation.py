@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Payload validation micro-benchmark
+
+Times the compiled schemas from schemas.py on a single payload of each kind
+and on a batch of production entries (the shape a bulk import sends), and
+prints the cost per payload.
+
+Usage: python bench_validation.py [--batch 5000] [--repeat 5]
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from schemas import ProductionEntry, AttendanceEntry, DowntimeEntry, RequisitionEntry
+
+
+def sample_payloads(today):
+    day = today.isoformat()
+    start = f"{day}T08:00"
+    return {
+        'production': (ProductionEntry, {
+            'worker_id': 1, 'item_id': 2, 'date': day,
+            'actual': 120, 'input_material': '50.5', 'output_material': 48.0
+        }),
+        'attendance': (AttendanceEntry, {'workers': ['1', '2', '3', '4', '5', '6'], 'date': day}),
+        'downtime': (DowntimeEntry, {
+            'machine_name': 'Extruder 2', 'start_time': start, 'end_time': f"{day}T09:30", 'remarks': 'belt'
+        }),
+        'requisition': (RequisitionEntry, {'item_id': '3', 'quantity': '10'}),
+    }
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--batch', type=int, default=5000, help="production entries per batch")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    today = date.today()
+    loops = 10000
+    for name, (schema, payload) in sample_payloads(today).items():
+        elapsed = best_of(args.repeat, lambda: [schema.validate(payload, today) for _ in range(loops)])
+        print(f"{name:<12} {elapsed / loops * 1e6:8.2f} us/payload")
+
+    _, production = sample_payloads(today)['production']
+    batch = [dict(production, worker_id=i % 200 + 1, date=(today + timedelta(days=i % 7)).isoformat())
+             for i in range(args.batch)]
+    # Every 50th row is invalid so the error path is part of the measurement
+    for row in batch[::50]:
+        row['output_material'] = 99.0
+    elapsed = best_of(args.repeat, lambda: ProductionEntry.validate_many(batch, today))
+    _, rejected = ProductionEntry.validate_many(batch, today)
+    print(f"batch x{args.batch:<6} {elapsed * 1e3:8.2f} ms total, "
+          f"{elapsed / args.batch * 1e6:.2f} us/entry, {len(rejected)} rejected")
+
+
+if __name__ == "__main__":
+    main()
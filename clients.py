@@ -0,0 +1,30 @@
+"""
+Shared external service clients, created lazily on first use
+"""
+import os
+import threading
+
+# Read at import time, like the rest of the configuration
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+_supabase_client = None
+_lock = threading.Lock()
+
+
+def get_supabase_client():
+    """
+    The single Supabase client for the process, or None for local testing
+
+    The supabase package and its HTTP stack are only imported here, so cold
+    starts that never touch Supabase Auth do not pay for them.
+    """
+    global _supabase_client
+    if not (SUPABASE_URL and SUPABASE_KEY):
+        return None
+    if _supabase_client is None:
+        with _lock:
+            if _supabase_client is None:
+                from supabase import create_client
+                _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase_client
@@ -0,0 +1,71 @@
+"""
+Writing validated shop-floor entries to the database
+
+The API routes (one entry per request) and the ingestion flusher (batches
+of entries, see ingest.py) both go through these functions. They add rows
+to the session; committing is up to the caller. Production entries must be
+recorded while holding the entry's (section, date) lock from locks.py.
+"""
+from models import Item, ProductionLog, Attendance, MachineDowntime
+from inventory import record_movement
+from reports import add_to_daily_stats
+from validation import validate_material_flow
+
+
+class EntryRejected(ValueError):
+    """The entry is well-formed but cannot be recorded (e.g. not enough input)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def record_production(db, entry, section_id):
+    """Check material flow and add the log, its stock movement and daily stats"""
+    item = db.query(Item).filter(Item.id == entry.item_id).first()
+    if not item:
+        raise EntryRejected("Item not found", 404)
+
+    # Calculate fields
+    target = item.default_target
+    overtime_hours = 0
+    if entry.actual > target:
+        overtime_hours = (entry.actual - target) / (target / 8)
+
+    material_flow_validation = validate_material_flow(section_id, entry.output_material, entry.date, db)
+    if not material_flow_validation['valid']:
+        raise EntryRejected(material_flow_validation['error'])
+
+    production_log = ProductionLog(
+        worker_id=entry.worker_id,
+        item_id=entry.item_id,
+        section_id=section_id,
+        date=entry.date,
+        target=target,
+        actual=entry.actual,
+        input_material=entry.input_material,
+        output_material=entry.output_material,
+        wastage=entry.input_material - entry.output_material,
+        overtime_hours=overtime_hours
+    )
+    db.add(production_log)
+    db.flush()
+    record_movement(db, production_log.item_id, section_id, entry.actual, 'production', production_log.id)
+    add_to_daily_stats(db, production_log)
+    return production_log
+
+
+def record_attendance(db, entry, section_id):
+    """Mark each selected worker present"""
+    for worker_id in entry.workers:
+        db.add(Attendance(worker_id=worker_id, section_id=section_id, date=entry.date, present=True))
+
+
+def record_downtime(db, entry, section_id):
+    db.add(MachineDowntime(
+        section_id=section_id,
+        machine_name=entry.machine_name,
+        start_time=entry.start_time,
+        end_time=entry.end_time,
+        remarks=entry.remarks
+    ))
@@ -0,0 +1,145 @@
+"""
+HTTP caching for report APIs: version-based ETags and response compression
+
+Report responses carry a strong ETag built from the data_versions counters
+of the tables the report reads (see versions.py), the request URL, the
+caller's role and section, and today's date (several reports default to
+today). A request whose If-None-Match still matches gets a 304 after one
+small lookup in data_versions, before the report's own queries run.
+
+`init_compression` gzips (or brotli-compresses, when the `brotli` package
+is installed and the client accepts it) text and JSON responses. A
+compressed response's ETag gets an encoding suffix so that each
+representation has its own strong validator.
+"""
+import gzip
+import hashlib
+from datetime import date
+from functools import wraps
+
+from flask import request, session, make_response
+from versions import version_key
+
+COMPRESS_MIN_SIZE = 500
+COMPRESS_MIMETYPES = {
+    'application/json', 'application/javascript', 'text/javascript',
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'image/svg+xml',
+}
+ENCODING_SUFFIXES = ('-br', '-gzip')
+
+_brotli = None
+
+
+def _brotli_module():
+    # brotli is optional; look it up once
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+def report_etag(db, tables):
+    """Strong ETag for the current request over the given tables"""
+    user = session.get('user') or {}
+    parts = (
+        request.full_path,
+        version_key(db, tables),
+        str(session.get('role')),
+        str(user.get('user_metadata', {}).get('section_id')),
+        str(db.info.get('plant_id')),
+        date.today().isoformat(),
+    )
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def _matches(etag):
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return False
+    if if_none_match.star_tag:
+        return True
+    for tag in if_none_match.as_set():
+        for suffix in ENCODING_SUFFIXES:
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)]
+                break
+        if tag == etag:
+            return True
+    return False
+
+
+def conditional(tables, get_db):
+    """
+    Decorator for GET report views: 304 when the client's copy is current
+
+    `get_db` returns the session the report reads from, so the versions come
+    from the same database as the data.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if 'user' not in session:
+                # Anonymous requests go straight to the view, which rejects them
+                return view(*args, **kwargs)
+            db = get_db()
+            try:
+                etag = report_etag(db, tables)
+            except Exception:
+                # Without version counters the report is served uncached
+                db.rollback()
+                return view(*args, **kwargs)
+            if _matches(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.vary.add('Accept-Encoding')
+            # Cached per user, and always revalidated
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def _choose_encoding(accept_encoding):
+    if 'br' in accept_encoding and _brotli_module():
+        return 'br'
+    if 'gzip' in accept_encoding:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request hook compressing text responses the client accepts"""
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        response.set_data(_brotli_module().compress(data, quality=5))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{'br' if encoding == 'br' else 'gzip'}", weak)
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
@@ -0,0 +1,324 @@
+"""
+Bulk import of historical production and attendance from CSV or XLSX
+
+Files are streamed in chunks of IMPORT_CHUNK_SIZE rows. Each chunk is
+validated with the import schemas below, worker/item/section names (or ids)
+are resolved through lookup maps loaded once per import, and the valid rows
+are loaded with one bulk INSERT per chunk, or COPY on Postgres with
+psycopg2. Rows that fail are collected in a rejected-rows report instead of
+failing the import.
+
+Imports are the only path that may load past dates: the import schemas
+leave out the backdating rule that the API schemas in schemas.py enforce.
+
+CLI: python importer.py production history.csv [--rejects rejects.csv] [--dry-run]
+"""
+import csv
+import io
+import os
+from datetime import date, datetime
+from sqlalchemy import insert
+from models import (SessionLocal, Worker, Item, Section, ProductionLog, Attendance, PLANT_ID, bump_table_versions,
+                    mark_days_changed, add_attendance_bits, append_outbox_events, OUTBOX_MODE, OUTBOX_TABLES)
+from reports import rebuild_daily_stats
+from schemas import Schema, Field, Int, Float, Date, Bool, output_within_input
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+# Rejected rows returned by the upload endpoint; the CLI writes all of them
+REJECTED_PREVIEW = 100
+
+
+class Reference(Field):
+    """A worker, item or section given by name or id; resolved after validation"""
+
+    def coerce(self, value, today):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        value = str(value).strip()
+        if not value:
+            raise ValueError(self.required_error)
+        return value
+
+
+ProductionImportRow = Schema('ProductionImportRow', {
+    'worker': Reference(),
+    'item': Reference(),
+    'section': Reference(required=False),
+    'date': Date(),
+    'actual': Int(min=0, min_error="Actual production cannot be negative"),
+    'input_material': Float(min=0, min_error="Input material cannot be negative"),
+    'output_material': Float(min=0, min_error="Output material cannot be negative"),
+    'target': Int(required=False, min=1, min_error="Target must be greater than 0"),
+    'overtime_hours': Float(required=False, min=0),
+}, checks=[output_within_input]).compile()
+
+AttendanceImportRow = Schema('AttendanceImportRow', {
+    'worker': Reference(),
+    'section': Reference(required=False),
+    'date': Date(),
+    'present': Bool(required=False, default=True),
+}).compile()
+
+# Header spellings accepted for each field
+_ALIASES = {
+    'worker_id': 'worker', 'worker_name': 'worker',
+    'item_id': 'item', 'item_name': 'item',
+    'section_id': 'section', 'section_name': 'section',
+    'input': 'input_material', 'output': 'output_material',
+    'overtime': 'overtime_hours',
+}
+
+
+def _header(name):
+    key = str(name or '').strip().lower().replace(' ', '_')
+    return _ALIASES.get(key, key)
+
+
+def read_csv(stream):
+    """Rows of a CSV file (text or binary stream) as dicts"""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(stream)
+    header = [_header(name) for name in next(reader, [])]
+    for values in reader:
+        if any(values):
+            yield dict(zip(header, values))
+
+
+def read_xlsx(stream):
+    """Rows of the first sheet of an XLSX workbook; needs openpyxl"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("XLSX import needs openpyxl (pip install openpyxl)")
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [_header(name) for name in next(rows, ())]
+        for values in rows:
+            if any(value not in (None, '') for value in values):
+                yield {key: value for key, value in zip(header, values)}
+    finally:
+        workbook.close()
+
+
+def read_rows(stream, filename):
+    if filename.lower().endswith('.xlsx'):
+        return read_xlsx(stream)
+    if filename.lower().endswith('.csv'):
+        return read_csv(stream)
+    raise ValueError("Unsupported file type, use .csv or .xlsx")
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Lookups:
+    """Name and id maps for workers, items and sections, loaded once per import"""
+
+    def __init__(self, db):
+        self.worker_section = dict(db.query(Worker.id, Worker.section_id))
+        self.item_target = dict(db.query(Item.id, Item.default_target))
+        self.maps = {
+            'worker': self._map(db.query(Worker.id, Worker.name)),
+            'item': self._map(db.query(Item.id, Item.name)),
+            'section': self._map(db.query(Section.id, Section.name)),
+        }
+
+    @staticmethod
+    def _map(rows):
+        by_key = {}
+        for record_id, name in rows:
+            by_key[str(record_id)] = record_id
+            # Names are matched case-insensitively; ids win over a name that looks like one
+            by_key.setdefault(name.strip().lower(), record_id)
+        return by_key
+
+    def resolve(self, kind, value, errors):
+        record_id = self.maps[kind].get(value.lower())
+        if record_id is None:
+            errors.append(f"Unknown {kind} '{value}'")
+        return record_id
+
+
+def _production_rows(records, lookups, now):
+    rows, rejected = [], []
+    for line, entry in records:
+        errors = []
+        worker_id = lookups.resolve('worker', entry.worker, errors)
+        item_id = lookups.resolve('item', entry.item, errors)
+        section_id = lookups.resolve('section', entry.section, errors) if entry.section else lookups.worker_section.get(worker_id)
+        if worker_id is not None and section_id is None:
+            errors.append("Section is required for a worker without one")
+        if errors:
+            rejected.append((line, errors))
+            continue
+        target = entry.target or lookups.item_target[item_id]
+        overtime_hours = entry.overtime_hours
+        if overtime_hours is None:
+            # Same rule as the production form
+            overtime_hours = (entry.actual - target) / (target / 8) if entry.actual > target and target else 0
+        rows.append({
+            'worker_id': worker_id, 'item_id': item_id, 'section_id': section_id, 'date': entry.date,
+            'target': target, 'actual': entry.actual,
+            'input_material': entry.input_material, 'output_material': entry.output_material,
+            'wastage': entry.input_material - entry.output_material,
+            'overtime_hours': overtime_hours, 'created_at': now,
+        })
+    return rows, rejected
+
+
+def _attendance_rows(records, lookups, now):
+    rows, rejected = [], []
+    for line, entry in records:
+        errors = []
+        worker_id = lookups.resolve('worker', entry.worker, errors)
+        section_id = lookups.resolve('section', entry.section, errors) if entry.section else lookups.worker_section.get(worker_id)
+        if worker_id is not None and section_id is None:
+            errors.append("Section is required for a worker without one")
+        if errors:
+            rejected.append((line, errors))
+            continue
+        rows.append({'worker_id': worker_id, 'section_id': section_id, 'date': entry.date,
+                     'present': entry.present, 'created_at': now})
+    return rows, rejected
+
+
+# kind -> (row schema, model, row builder)
+IMPORT_KINDS = {
+    'production': (ProductionImportRow, ProductionLog, _production_rows),
+    'attendance': (AttendanceImportRow, Attendance, _attendance_rows),
+}
+
+
+def _copy_rows(db, model, rows):
+    """COPY rows into the table; returns False when the driver cannot COPY"""
+    connection = db.connection()
+    if connection.dialect.name != 'postgresql' or connection.dialect.driver != 'psycopg2':
+        return False
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[name] is None else row[name] for name in columns])
+    buffer.seek(0)
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY "{model.__tablename__}" ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+    finally:
+        cursor.close()
+    return True
+
+
+def _bulk_insert(db, model, rows):
+    # Explicit, since COPY skips column defaults
+    plant_id = db.info.get('plant_id') or PLANT_ID
+    rows = [dict(row, plant_id=plant_id) for row in rows]
+    if _copy_rows(db, model, rows):
+        # COPY bypasses the Session, so bump the version counter and write outbox events here
+        bump_table_versions(db.connection(), [model.__tablename__])
+        if OUTBOX_MODE != 'off' and model.__tablename__ in OUTBOX_TABLES:
+            append_outbox_events(db.connection(), model.__tablename__, 'insert', rows)
+    else:
+        db.execute(insert(model), rows)
+    if model is Attendance:
+        add_attendance_bits(db.connection(), rows)
+
+
+def import_rows(db, kind, rows, chunk_size=None, dry_run=False):
+    """
+    Validate and load an iterable of row dicts in one transaction
+
+    Returns {"imported": n, "rejected": [(line, errors, row), ...]} where
+    line is the spreadsheet line (the header is line 1). With dry_run
+    nothing is written.
+    """
+    schema, model, build = IMPORT_KINDS[kind]
+    lookups = Lookups(db)
+    today = date.today()
+    now = datetime.now()
+    imported = 0
+    rejected = []
+    days = set()
+    line = 1
+    try:
+        for chunk in _chunks(rows, chunk_size or IMPORT_CHUNK_SIZE):
+            first_line = line + 1
+            line += len(chunk)
+            records, invalid = schema.validate_many(chunk, today)
+            rejected.extend((first_line + index, errors, chunk[index]) for index, errors in invalid)
+            failed = {index for index, _ in invalid}
+            passed = [index for index in range(len(chunk)) if index not in failed]
+            valid, unresolved = build(
+                [(first_line + index, record) for index, record in zip(passed, records)], lookups, now
+            )
+            rejected.extend((number, errors, chunk[number - first_line]) for number, errors in unresolved)
+
+            if valid and not dry_run:
+                _bulk_insert(db, model, valid)
+                days.update(row['date'] for row in valid)
+            imported += len(valid)
+
+        if days and model is ProductionLog:
+            mark_days_changed(db.connection(), days)
+            rebuild_daily_stats(db, min(days), max(days))
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    rejected.sort(key=lambda item: item[0])
+    return {"imported": imported, "rejected": rejected}
+
+
+def import_file(db, kind, stream, filename, chunk_size=None, dry_run=False):
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    return import_rows(db, kind, read_rows(stream, filename), chunk_size, dry_run)
+
+
+def write_rejects(rejected, stream):
+    """Write the rejected-rows report as CSV: line, errors, then the original columns"""
+    columns = []
+    for _, _, row in rejected:
+        columns.extend(key for key in row if key not in columns)
+    writer = csv.writer(stream)
+    writer.writerow(['line', 'errors'] + columns)
+    for line, errors, row in rejected:
+        writer.writerow([line, '; '.join(errors)] + [row.get(key, '') for key in columns])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Import historical production or attendance data")
+    parser.add_argument('kind', choices=sorted(IMPORT_KINDS))
+    parser.add_argument('path', help=".csv or .xlsx file")
+    parser.add_argument('--rejects', metavar='CSV', help="write rejected rows to this file")
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help="validate only, write nothing")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        with open(args.path, 'rb') as stream:
+            result = import_file(db, args.kind, stream, args.path, args.chunk_size, args.dry_run)
+    finally:
+        db.close()
+    print(f"{'Validated' if args.dry_run else 'Imported'} {result['imported']} rows, rejected {len(result['rejected'])}")
+    if args.rejects and result['rejected']:
+        with open(args.rejects, 'w', newline='') as out:
+            write_rejects(result['rejected'], out)
+        print(f"Rejected rows written to {args.rejects}")
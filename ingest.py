@@ -0,0 +1,348 @@
+"""
+Write-behind ingestion with group commit
+
+With INGEST_MODE=buffered, validated production, attendance and downtime
+entries are appended to a local append-only log (fsynced) and acknowledged
+straight away. A background flusher applies them in batches: every
+INGEST_FLUSH_MS milliseconds or INGEST_BATCH_SIZE entries, each batch goes
+in one transaction. The database sees one commit per batch instead of one
+per tablet at shift end.
+
+Every entry has an id. It is recorded in ingested_entries in the same
+transaction that applies it, so replaying a log is idempotent. Each process
+writes its own log file and holds an flock on it. On start, logs left
+behind by a dead process (no lock holder) are replayed and then deleted.
+
+Production entries still run the material flow check, at flush time, under
+the (section, date) locks. An entry that fails is stored as rejected with
+its error; GET /api/ingest/<entry_id> reports pending, applied or rejected.
+
+Buffered mode needs a persistent local disk and a long-running process
+(gunicorn/pm2); it is not meant for serverless deployments.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; orphaned logs are then left alone
+    fcntl = None
+
+from sqlalchemy import delete, select
+from models import SessionLocal, IngestedEntry
+from locks import section_day_locks
+from schemas import ProductionEntry, AttendanceEntry, DowntimeEntry, ValidationError
+from entries import record_production, record_attendance, record_downtime, EntryRejected
+
+INGEST_MODE = os.getenv("INGEST_MODE", "direct").lower()
+INGEST_LOG_DIR = os.getenv("INGEST_LOG_DIR", "./ingest_logs")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "200"))
+INGEST_FLUSH_MS = int(os.getenv("INGEST_FLUSH_MS", "20"))
+INGEST_FSYNC = os.getenv("INGEST_FSYNC", "1") != "0"
+# A drained log is started afresh once it grows past this size
+INGEST_LOG_ROTATE_BYTES = 1024 * 1024
+# How long applied entry ids are kept for idempotent replay
+INGEST_RETENTION = timedelta(days=7)
+
+# kind -> (schema, recorder)
+INGEST_KINDS = {
+    'production': (ProductionEntry, record_production),
+    'attendance': (AttendanceEntry, record_attendance),
+    'downtime': (DowntimeEntry, record_downtime),
+}
+
+
+class IngestLog:
+    """Append-only JSON-lines file owned (flocked) by this process"""
+
+    def __init__(self, directory, fsync=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self.path = os.path.join(self.directory, f"ingest.{os.getpid()}.{uuid.uuid4().hex[:8]}.log")
+        self._file = open(self.path, 'ab')
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def append(self, record):
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def rotate_if_drained(self, is_drained):
+        """Start a new file when everything written so far has been applied"""
+        with self._lock:
+            if self._file.tell() < INGEST_LOG_ROTATE_BYTES or not is_drained():
+                return False
+            old_file, old_path = self._file, self.path
+            self._open()
+            old_file.close()
+            os.remove(old_path)
+            return True
+
+    def close(self, remove=False):
+        with self._lock:
+            self._file.close()
+            if remove:
+                os.remove(self.path)
+
+
+def read_log(path):
+    """Records in a log file; a torn last line (crash mid-write) is skipped"""
+    records = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def orphaned_logs(directory, own_path=None):
+    """Log files no live process holds a lock on"""
+    orphans = []
+    for path in sorted(glob.glob(os.path.join(directory, 'ingest.*.log'))):
+        if path == own_path or fcntl is None:
+            continue
+        with open(path, 'rb') as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        orphans.append(path)
+    return orphans
+
+
+def _parse(record):
+    """Typed entry for a log record, validated as of the day it was received"""
+    schema, _ = INGEST_KINDS[record['kind']]
+    received = datetime.fromisoformat(record['received_at']).date()
+    return schema.validate(record['payload'], today=received)
+
+
+def apply_batch(db, records):
+    """
+    Apply records in one transaction, skipping ids that were already applied
+
+    Entries the checks reject are stored as rejected. Returns the number of
+    records newly applied or rejected. Raises if the transaction fails.
+    """
+    ids = [record['id'] for record in records]
+    done = set(db.execute(select(IngestedEntry.id).where(IngestedEntry.id.in_(ids))).scalars())
+    todo = []
+    for record in records:
+        if record['id'] not in done:
+            done.add(record['id'])
+            todo.append(record)
+    if not todo:
+        return 0
+
+    parsed = []
+    for record in todo:
+        try:
+            parsed.append((record, _parse(record), None))
+        except (ValidationError, KeyError, ValueError) as e:
+            parsed.append((record, None, str(e)))
+    keys = [(record['section_id'], entry.date) for record, entry, _ in parsed
+            if entry is not None and record['kind'] == 'production']
+
+    now = datetime.now()
+    with section_day_locks(db, keys):
+        for record, entry, error in parsed:
+            # Entries are written (and checked) within the plant they were received for
+            db.info['plant_id'] = record.get('plant_id')
+            if error is None:
+                try:
+                    INGEST_KINDS[record['kind']][1](db, entry, record['section_id'])
+                except EntryRejected as e:
+                    error = str(e)
+            db.add(IngestedEntry(id=record['id'], kind=record['kind'],
+                                 status='rejected' if error else 'applied', error=error, applied_at=now))
+        db.commit()
+    db.info.pop('plant_id', None)
+    return len(todo)
+
+
+class IngestBuffer:
+    """Durable local queue in front of the database, flushed by one thread"""
+
+    def __init__(self, sessions=SessionLocal, directory=INGEST_LOG_DIR, batch_size=INGEST_BATCH_SIZE,
+                 flush_ms=INGEST_FLUSH_MS, fsync=INGEST_FSYNC):
+        self.sessions = sessions
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.fsync = fsync
+        self.log = None
+        self._queue = deque()
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._last_purge = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Open this process's log, replay orphaned logs and start the flusher"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.log = IngestLog(self.directory, self.fsync)
+            self.recover()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='ingest-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def recover(self):
+        """Apply every entry in logs left by dead processes, then delete them"""
+        recovered = 0
+        for path in orphaned_logs(self.directory, self.log.path if self.log else None):
+            records = read_log(path)
+            for start in range(0, len(records), self.batch_size):
+                recovered += self._apply(records[start:start + self.batch_size])
+            os.remove(path)
+        return recovered
+
+    def submit(self, kind, section_id, payload, plant_id=None):
+        """Append an already validated entry to the log; returns its id"""
+        if self._thread is None:
+            self.start()
+        record = {
+            'id': uuid.uuid4().hex, 'kind': kind, 'section_id': section_id, 'plant_id': plant_id,
+            'payload': payload, 'received_at': datetime.now().isoformat(),
+        }
+        self.log.append(record)
+        with self._condition:
+            self._queue.append(record)
+            self._pending[record['id']] = record
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+        return record['id']
+
+    def status(self, entry_id):
+        """'pending', or None when the entry is not waiting in this process"""
+        return 'pending' if entry_id in self._pending else None
+
+    def flush(self):
+        """Apply everything queued so far (used by the flusher and on shutdown)"""
+        applied = 0
+        while True:
+            with self._condition:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if not batch:
+                return applied
+            try:
+                applied += self._apply(batch)
+            except Exception:
+                # Put the batch back in front; it is retried on the next pass
+                with self._condition:
+                    self._queue.extendleft(reversed(batch))
+                raise
+            with self._condition:
+                for record in batch:
+                    self._pending.pop(record['id'], None)
+
+    def _apply(self, records):
+        db = self.sessions()
+        try:
+            try:
+                return apply_batch(db, records)
+            except Exception:
+                db.rollback()
+            # One bad entry fails the whole batch; apply them one by one instead
+            applied = 0
+            for record in records:
+                try:
+                    applied += apply_batch(db, [record])
+                except Exception as e:
+                    db.rollback()
+                    # If the database itself is failing this raises too, and the
+                    # entry stays queued
+                    db.add(IngestedEntry(id=record['id'], kind=record['kind'], status='rejected',
+                                         error=str(e), applied_at=datetime.now()))
+                    db.commit()
+                    applied += 1
+            return applied
+        finally:
+            db.close()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._queue and not self._stopping:
+                    self._condition.wait(self.flush_interval)
+                elif len(self._queue) < self.batch_size and not self._stopping:
+                    # Give concurrent requests a moment to join the batch
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+            try:
+                self.flush()
+                self.log.rotate_if_drained(lambda: not self._pending)
+                self._purge()
+            except Exception as e:
+                # The entries stay in the log and are retried on the next pass or restart
+                print(f"Ingest flush failed: {e}")
+                time.sleep(self.flush_interval)
+            if stopping:
+                return
+
+    def _purge(self):
+        if self._last_purge is not None and time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        db = self.sessions()
+        try:
+            db.execute(delete(IngestedEntry).where(IngestedEntry.applied_at < datetime.now() - INGEST_RETENTION))
+            db.commit()
+        finally:
+            db.close()
+
+    def stop(self):
+        """Flush what is queued and stop the flusher; the log is removed once drained"""
+        with self._condition:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        self.log.close(remove=not self._pending)
+
+
+buffer = IngestBuffer()
+
+
+def entry_status(db, entry_id):
+    """{"status", "error"} for an ingested entry, or None if unknown"""
+    if buffer.status(entry_id):
+        return {"status": "pending", "error": None}
+    record = db.get(IngestedEntry, entry_id)
+    if record is None:
+        return None
+    return {"status": record.status, "error": record.error}
+
+
+if __name__ == "__main__":
+    # Replay logs left behind by stopped processes: python ingest.py
+    recovering = IngestBuffer()
+    recovering.log = None
+    print(f"Recovered {recovering.recover()} entries")
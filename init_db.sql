@@ -3,25 +3,36 @@
 CREATE TABLE IF NOT EXISTS sections (
     id SERIAL PRIMARY KEY,
     name TEXT NOT NULL,
-    next_section_id INTEGER REFERENCES sections(id)
+    next_section_id INTEGER REFERENCES sections(id),
+    plant_id TEXT NOT NULL DEFAULT 'main'
 );
 
 CREATE TABLE IF NOT EXISTS workers (
     id SERIAL PRIMARY KEY,
     name TEXT NOT NULL,
     section_id INTEGER REFERENCES sections(id),
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main'
 );
 
 CREATE TABLE IF NOT EXISTS items (
     id SERIAL PRIMARY KEY,
     name TEXT NOT NULL,
     unit TEXT NOT NULL,
-    default_target INTEGER NOT NULL
+    default_target INTEGER NOT NULL,
+    piece_rate FLOAT NOT NULL DEFAULT 0,
+    plant_id TEXT NOT NULL DEFAULT 'main'
 );
 
+CREATE INDEX IF NOT EXISTS ix_sections_plant ON sections (plant_id);
+CREATE INDEX IF NOT EXISTS ix_workers_plant_section ON workers (plant_id, section_id);
+CREATE INDEX IF NOT EXISTS ix_items_plant ON items (plant_id);
+
+-- production_logs, attendance and machine_downtime are partitioned by month.
+-- Partitions for upcoming months are created by `python archive.py` (run it
+-- from cron); the default partitions only catch rows outside those months.
 CREATE TABLE IF NOT EXISTS production_logs (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     worker_id INTEGER REFERENCES workers(id),
     item_id INTEGER REFERENCES items(id),
     section_id INTEGER REFERENCES sections(id),
@@ -32,26 +43,142 @@ CREATE TABLE IF NOT EXISTS production_logs (
     output_material FLOAT NOT NULL,
     wastage FLOAT NOT NULL,
     overtime_hours FLOAT NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main',
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date);
+
+CREATE INDEX IF NOT EXISTS ix_production_logs_plant_date_section ON production_logs (plant_id, date, section_id);
+
+CREATE TABLE IF NOT EXISTS worker_daily_stats (
+    worker_id INTEGER REFERENCES workers(id),
+    section_id INTEGER REFERENCES sections(id),
+    date DATE NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 0,
+    target INTEGER NOT NULL DEFAULT 0,
+    actual INTEGER NOT NULL DEFAULT 0,
+    input_material FLOAT NOT NULL DEFAULT 0,
+    output_material FLOAT NOT NULL DEFAULT 0,
+    wastage FLOAT NOT NULL DEFAULT 0,
+    overtime_hours FLOAT NOT NULL DEFAULT 0,
+    plant_id TEXT NOT NULL DEFAULT 'main',
+    PRIMARY KEY (worker_id, section_id, date)
 );
 
+CREATE INDEX IF NOT EXISTS ix_worker_daily_stats_plant_date_section ON worker_daily_stats (plant_id, date, section_id);
+
 CREATE TABLE IF NOT EXISTS attendance (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     worker_id INTEGER REFERENCES workers(id),
     section_id INTEGER REFERENCES sections(id),
     date DATE NOT NULL,
     present BOOLEAN NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main',
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date);
+
+CREATE INDEX IF NOT EXISTS ix_attendance_plant_date_section ON attendance (plant_id, date, section_id);
+
+-- Attendance as monthly bitsets (bit n = day n + 1), kept in step with
+-- attendance by the app (see attendance.py)
+CREATE TABLE IF NOT EXISTS attendance_months (
+    worker_id INTEGER REFERENCES workers(id),
+    section_id INTEGER REFERENCES sections(id),
+    month DATE NOT NULL,
+    days INTEGER NOT NULL DEFAULT 0,
+    present INTEGER NOT NULL DEFAULT 0,
+    plant_id TEXT NOT NULL DEFAULT 'main',
+    PRIMARY KEY (worker_id, section_id, month)
 );
 
-CREATE TABLE IF NOT EXISTS machine_downtime (
+CREATE INDEX IF NOT EXISTS ix_attendance_months_plant_month_section ON attendance_months (plant_id, month, section_id);
+
+CREATE TABLE IF NOT EXISTS section_attendance_months (
+    section_id INTEGER REFERENCES sections(id),
+    month DATE NOT NULL,
+    days INTEGER NOT NULL DEFAULT 0,
+    present INTEGER NOT NULL DEFAULT 0,
+    workers INTEGER NOT NULL DEFAULT 0,
+    plant_id TEXT NOT NULL DEFAULT 'main',
+    PRIMARY KEY (section_id, month)
+);
+
+-- One row per worker and pay period, written by payroll.py
+CREATE TABLE IF NOT EXISTS payroll_runs (
     id SERIAL PRIMARY KEY,
+    worker_id INTEGER NOT NULL REFERENCES workers(id),
+    section_id INTEGER REFERENCES sections(id),
+    period_start DATE NOT NULL,
+    period_end DATE NOT NULL,
+    units INTEGER NOT NULL DEFAULT 0,
+    piece_earnings FLOAT NOT NULL DEFAULT 0,
+    overtime_hours FLOAT NOT NULL DEFAULT 0,
+    overtime_pay FLOAT NOT NULL DEFAULT 0,
+    present_days INTEGER NOT NULL DEFAULT 0,
+    working_days INTEGER NOT NULL DEFAULT 0,
+    absent_days INTEGER NOT NULL DEFAULT 0,
+    deductions FLOAT NOT NULL DEFAULT 0,
+    net_pay FLOAT NOT NULL DEFAULT 0,
+    inputs_digest TEXT NOT NULL,
+    computed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main'
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_payroll_runs_plant_period_worker ON payroll_runs (plant_id, period_start, period_end, worker_id);
+
+CREATE TABLE IF NOT EXISTS machine_downtime (
+    id SERIAL,
     section_id INTEGER REFERENCES sections(id),
     machine_name TEXT NOT NULL,
     start_time TIMESTAMP WITH TIME ZONE NOT NULL,
     end_time TIMESTAMP WITH TIME ZONE NOT NULL,
     remarks TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main',
+    PRIMARY KEY (id, start_time)
+) PARTITION BY RANGE (start_time);
+
+CREATE INDEX IF NOT EXISTS ix_machine_downtime_plant_section_start ON machine_downtime (plant_id, section_id, start_time);
+
+-- Archive tables: monthly partitions older than ARCHIVE_RETENTION_MONTHS are
+-- detached from the live tables and attached here by archive.py
+CREATE TABLE IF NOT EXISTS production_logs_archive (LIKE production_logs INCLUDING DEFAULTS, PRIMARY KEY (id, date)) PARTITION BY RANGE (date);
+CREATE TABLE IF NOT EXISTS attendance_archive (LIKE attendance INCLUDING DEFAULTS, PRIMARY KEY (id, date)) PARTITION BY RANGE (date);
+CREATE TABLE IF NOT EXISTS machine_downtime_archive (LIKE machine_downtime INCLUDING DEFAULTS, PRIMARY KEY (id, start_time)) PARTITION BY RANGE (start_time);
+
+CREATE INDEX IF NOT EXISTS ix_production_logs_archive_plant_date ON production_logs_archive (plant_id, date);
+CREATE INDEX IF NOT EXISTS ix_attendance_archive_plant_date ON attendance_archive (plant_id, date);
+CREATE INDEX IF NOT EXISTS ix_machine_downtime_archive_plant_section_start ON machine_downtime_archive (plant_id, section_id, start_time);
+
+CREATE TABLE IF NOT EXISTS production_logs_default PARTITION OF production_logs DEFAULT;
+CREATE TABLE IF NOT EXISTS attendance_default PARTITION OF attendance DEFAULT;
+CREATE TABLE IF NOT EXISTS machine_downtime_default PARTITION OF machine_downtime DEFAULT;
+CREATE TABLE IF NOT EXISTS production_logs_archive_default PARTITION OF production_logs_archive DEFAULT;
+CREATE TABLE IF NOT EXISTS attendance_archive_default PARTITION OF attendance_archive DEFAULT;
+CREATE TABLE IF NOT EXISTS machine_downtime_archive_default PARTITION OF machine_downtime_archive DEFAULT;
+
+-- This month and the next three, so the sample data below lands in a monthly partition
+DO $$
+DECLARE
+    month DATE;
+    parent TEXT;
+BEGIN
+    FOR i IN 0..3 LOOP
+        month := (date_trunc('month', CURRENT_DATE) + make_interval(months => i))::date;
+        FOREACH parent IN ARRAY ARRAY['production_logs', 'attendance', 'machine_downtime'] LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                parent || to_char(month, '"_y"YYYY"m"MM'), parent, month, (month + INTERVAL '1 month')::date
+            );
+        END LOOP;
+    END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS archive_watermarks (
+    table_name TEXT PRIMARY KEY,
+    archived_before DATE NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
 CREATE TABLE IF NOT EXISTS requisitions (
@@ -61,9 +188,169 @@ CREATE TABLE IF NOT EXISTS requisitions (
     quantity INTEGER NOT NULL,
     status TEXT NOT NULL DEFAULT 'pending',
     remarks TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main'
+);
+
+CREATE INDEX IF NOT EXISTS ix_requisitions_plant_status_section ON requisitions (plant_id, status, section_id, created_at);
+
+CREATE TABLE IF NOT EXISTS item_stock (
+    item_id INTEGER PRIMARY KEY REFERENCES items(id),
+    on_hand INTEGER NOT NULL DEFAULT 0,
+    reserved INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main'
+);
+
+CREATE TABLE IF NOT EXISTS inventory_movements (
+    id SERIAL PRIMARY KEY,
+    item_id INTEGER NOT NULL REFERENCES items(id),
+    section_id INTEGER REFERENCES sections(id),
+    quantity FLOAT NOT NULL,
+    kind TEXT NOT NULL,
+    reference_id INTEGER,
+    remarks TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main'
 );
 
+CREATE INDEX IF NOT EXISTS ix_inventory_movements_plant_item_section ON inventory_movements (plant_id, item_id, section_id, id);
+
+CREATE TABLE IF NOT EXISTS inventory_snapshots (
+    id SERIAL PRIMARY KEY,
+    item_id INTEGER NOT NULL REFERENCES items(id),
+    section_id INTEGER REFERENCES sections(id),
+    balance FLOAT NOT NULL,
+    last_movement_id INTEGER NOT NULL,
+    taken_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    plant_id TEXT NOT NULL DEFAULT 'main'
+);
+
+CREATE INDEX IF NOT EXISTS ix_inventory_snapshots_plant_item_section ON inventory_snapshots (plant_id, item_id, section_id, last_movement_id);
+
+CREATE TABLE IF NOT EXISTS data_versions (
+    table_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    cache_key TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    result TEXT,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS ix_jobs_cache_key ON jobs (cache_key, status);
+CREATE INDEX IF NOT EXISTS ix_jobs_status_created ON jobs (status, created_at);
+
+CREATE TABLE IF NOT EXISTS integrity_issues (
+    id SERIAL PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE,
+    day DATE NOT NULL,
+    type TEXT NOT NULL,
+    description TEXT NOT NULL,
+    details TEXT,
+    severity TEXT NOT NULL,
+    first_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    last_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    resolved_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS ix_integrity_issues_open_day ON integrity_issues (resolved_at, day, id);
+CREATE INDEX IF NOT EXISTS ix_integrity_issues_day ON integrity_issues (day, id);
+
+CREATE TABLE IF NOT EXISTS integrity_scan_days (
+    day DATE PRIMARY KEY,
+    changed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    scanned_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Entries applied from the buffered ingestion log (ingest.py)
+CREATE TABLE IF NOT EXISTS ingested_entries (
+    id VARCHAR(32) PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ix_ingested_entries_applied_at ON ingested_entries (applied_at);
+
+-- Replication (replication.py). change_log is written on edge plants only;
+-- replication_keys and replication_marks are kept by the central instance.
+CREATE TABLE IF NOT EXISTS change_log (
+    id SERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    changed_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS replication_keys (
+    plant_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    source_id INTEGER NOT NULL,
+    central_id INTEGER NOT NULL,
+    PRIMARY KEY (plant_id, table_name, source_id)
+);
+
+CREATE TABLE IF NOT EXISTS replication_marks (
+    plant_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    high_water INTEGER NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (plant_id, table_name)
+);
+
+-- Change events for outbox consumers (outbox.py), written when OUTBOX_MODE is not off
+CREATE TABLE IF NOT EXISTS outbox_events (
+    id SERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    row_id INTEGER,
+    plant_id TEXT,
+    payload TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS outbox_checkpoints (
+    consumer TEXT PRIMARY KEY,
+    last_event_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Upgrading a single-plant database: existing rows belong to plant 'main'
+-- (PLANT_ID), and the indexes above replace these section-leading ones.
+ALTER TABLE sections ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE workers ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE items ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE production_logs ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE worker_daily_stats ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE attendance ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE machine_downtime ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE production_logs_archive ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE attendance_archive ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE machine_downtime_archive ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE requisitions ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE item_stock ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE inventory_movements ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+ALTER TABLE inventory_snapshots ADD COLUMN IF NOT EXISTS plant_id TEXT NOT NULL DEFAULT 'main';
+DROP INDEX IF EXISTS ix_worker_daily_stats_date_section;
+DROP INDEX IF EXISTS ix_machine_downtime_section_start;
+DROP INDEX IF EXISTS ix_requisitions_status_section;
+DROP INDEX IF EXISTS ix_inventory_movements_item_section;
+DROP INDEX IF EXISTS ix_inventory_snapshots_item_section;
+DROP INDEX IF EXISTS ix_production_logs_archive_date;
+DROP INDEX IF EXISTS ix_attendance_archive_date;
+DROP INDEX IF EXISTS ix_machine_downtime_archive_section_start;
+-- Piece rates for payroll; existing items start at 0
+ALTER TABLE items ADD COLUMN IF NOT EXISTS piece_rate FLOAT NOT NULL DEFAULT 0;
+
 -- Sample Data
 
 INSERT INTO sections (name, next_section_id) VALUES
@@ -96,6 +383,11 @@ INSERT INTO production_logs (worker_id, item_id, section_id, date, target, actua
     (4, 4, 2, CURRENT_DATE, 120, 130, 250.0, 240.0, 10.0, 0.67),
     (1, 5, 1, CURRENT_DATE, 90, 85, 300.0, 280.0, 20.0, 0.0);
 
+INSERT INTO worker_daily_stats (worker_id, section_id, date, entries, target, actual, input_material, output_material, wastage, overtime_hours)
+SELECT worker_id, section_id, date, COUNT(*), SUM(target), SUM(actual), SUM(input_material), SUM(output_material), SUM(wastage), SUM(overtime_hours)
+FROM production_logs
+GROUP BY worker_id, section_id, date;
+
 INSERT INTO attendance (worker_id, section_id, date, present) VALUES
     (1, 1, CURRENT_DATE, TRUE),
     (2, 1, CURRENT_DATE, TRUE),
@@ -103,6 +395,24 @@ INSERT INTO attendance (worker_id, section_id, date, present) VALUES
     (4, 2, CURRENT_DATE, TRUE),
     (5, 1, CURRENT_DATE, FALSE);
 
+-- Also backfills the bitsets when upgrading a database that has attendance rows
+INSERT INTO attendance_months (plant_id, worker_id, section_id, month, days, present)
+SELECT plant_id, worker_id, section_id, month, BIT_OR(1 << (EXTRACT(DAY FROM date)::INTEGER - 1)), COUNT(DISTINCT date)
+FROM (
+    SELECT plant_id, worker_id, section_id, date, date_trunc('month', date)::DATE AS month FROM attendance WHERE present
+    UNION ALL
+    SELECT plant_id, worker_id, section_id, date, date_trunc('month', date)::DATE FROM attendance_archive WHERE present
+) rows
+WHERE worker_id IS NOT NULL AND section_id IS NOT NULL
+GROUP BY plant_id, worker_id, section_id, month
+ON CONFLICT DO NOTHING;
+
+INSERT INTO section_attendance_months (plant_id, section_id, month, days, present, workers)
+SELECT MIN(plant_id), section_id, month, BIT_OR(days), SUM(present), COUNT(*)
+FROM attendance_months
+GROUP BY section_id, month
+ON CONFLICT DO NOTHING;
+
 INSERT INTO machine_downtime (section_id, machine_name, start_time, end_time, remarks) VALUES
     (1, 'Machine1', NOW() - INTERVAL '2 hours', NOW() - INTERVAL '1 hour', 'Routine maintenance'),
     (2, 'Machine2', NOW() - INTERVAL '30 minutes', NOW(), 'Minor fault');
@@ -0,0 +1,148 @@
+"""
+Nightly integrity scan with persisted results
+
+Each closed day is checked once, and then again only when its production
+logs change. Writes to production_logs mark the day in integrity_scan_days
+(see models.py). Findings are stored in integrity_issues, keyed by a
+fingerprint of (day, type, description). Re-scanning a day therefore
+updates issues that are still present, opens new ones and sets resolved_at
+on the ones that went away, instead of producing a fresh list.
+"""
+import hashlib
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, insert, or_, and_
+from sqlalchemy.exc import IntegrityError
+from models import SessionLocal, IntegrityIssue, IntegrityScanDay
+from validation import check_data_integrity
+from reports import encode_cursor, decode_cursor
+
+# How far back the scheduler makes sure every closed day has been scanned
+SCAN_LOOKBACK_DAYS = 30
+
+
+def fingerprint(day, issue):
+    return hashlib.sha1(f"{day.isoformat()}|{issue['type']}|{issue['description']}".encode()).hexdigest()
+
+
+def scan_day(db, day):
+    """
+    Check one day and reconcile its stored issues
+
+    Returns (opened, resolved) counts.
+    """
+    started_at = datetime.now()
+    result = check_data_integrity(db, day=day)
+    if not result['success']:
+        raise RuntimeError(result['error'])
+    found = {fingerprint(day, issue): issue for issue in result['issues']}
+
+    stored = {issue.fingerprint: issue for issue in db.query(IntegrityIssue).filter(IntegrityIssue.day == day)}
+    opened = resolved = 0
+    for key, issue in found.items():
+        record = stored.get(key)
+        if record is None:
+            db.add(IntegrityIssue(
+                fingerprint=key, day=day, type=issue['type'], description=issue['description'],
+                details=issue['details'], severity=issue['severity'], first_seen=started_at, last_seen=started_at
+            ))
+            opened += 1
+            continue
+        if record.resolved_at is not None:
+            record.resolved_at = None
+            opened += 1
+        record.details = issue['details']
+        record.severity = issue['severity']
+        record.last_seen = started_at
+    for key, record in stored.items():
+        if key not in found and record.resolved_at is None:
+            record.resolved_at = started_at
+            resolved += 1
+
+    # Only mark the day clean if nothing changed while we were scanning
+    marker = db.get(IntegrityScanDay, day)
+    if marker is None:
+        db.add(IntegrityScanDay(day=day, changed_at=started_at, scanned_at=started_at))
+    elif marker.changed_at <= started_at:
+        marker.scanned_at = started_at
+    db.commit()
+    return opened, resolved
+
+
+def days_to_scan(db, today=None, lookback_days=SCAN_LOOKBACK_DAYS):
+    """Closed days that changed since their last scan, or were never scanned"""
+    today = today or date.today()
+    first = today - timedelta(days=lookback_days)
+    known = {row.day for row in db.query(IntegrityScanDay.day).filter(IntegrityScanDay.day.between(first, today))}
+    missing = [first + timedelta(days=i) for i in range(lookback_days) if first + timedelta(days=i) not in known]
+    if missing:
+        # Quiet days still need one scan (e.g. for workers with no entries)
+        now = datetime.now()
+        try:
+            db.execute(insert(IntegrityScanDay), [{"day": day, "changed_at": now} for day in missing])
+            db.commit()
+        except IntegrityError:
+            # A concurrent scheduler added them first
+            db.rollback()
+
+    return [row.day for row in db.query(IntegrityScanDay.day).filter(
+        IntegrityScanDay.day < today,
+        or_(IntegrityScanDay.scanned_at.is_(None), IntegrityScanDay.changed_at > IntegrityScanDay.scanned_at)
+    ).order_by(IntegrityScanDay.day)]
+
+
+def scan_closed_days(db, today=None, lookback_days=SCAN_LOOKBACK_DAYS):
+    """Scan every closed day that needs it; returns {day: (opened, resolved)}"""
+    return {day: scan_day(db, day) for day in days_to_scan(db, today, lookback_days)}
+
+
+def has_dirty_days(db, today=None):
+    today = today or date.today()
+    return db.query(IntegrityScanDay.day).filter(
+        IntegrityScanDay.day < today,
+        or_(IntegrityScanDay.scanned_at.is_(None), IntegrityScanDay.changed_at > IntegrityScanDay.scanned_at)
+    ).first() is not None
+
+
+def issues_page(db, status='open', day=None, issue_type=None, severity=None, cursor=None, limit=50):
+    """
+    One page of stored issues, newest day first
+
+    Returns (issues, next_cursor); the cursor holds the last (day, id) seen.
+    """
+    query = select(IntegrityIssue)
+    if status == 'open':
+        query = query.where(IntegrityIssue.resolved_at.is_(None))
+    elif status == 'resolved':
+        query = query.where(IntegrityIssue.resolved_at.is_not(None))
+    if day is not None:
+        query = query.where(IntegrityIssue.day == day)
+    if issue_type:
+        query = query.where(IntegrityIssue.type == issue_type)
+    if severity:
+        query = query.where(IntegrityIssue.severity == severity)
+    if cursor:
+        last_day, last_id = decode_cursor(cursor)
+        last_day = last_day.date()
+        query = query.where(or_(
+            IntegrityIssue.day < last_day,
+            and_(IntegrityIssue.day == last_day, IntegrityIssue.id < last_id)
+        ))
+
+    issues = db.execute(
+        query.order_by(IntegrityIssue.day.desc(), IntegrityIssue.id.desc()).limit(limit + 1)
+    ).scalars().all()
+    next_cursor = None
+    if len(issues) > limit:
+        issues = issues[:limit]
+        next_cursor = encode_cursor(issues[-1].day, issues[-1].id)
+    return issues, next_cursor
+
+
+if __name__ == "__main__":
+    # Intended to run nightly from cron: python integrity.py
+    db = SessionLocal()
+    try:
+        for scanned_day, (opened, resolved) in scan_closed_days(db).items():
+            print(f"{scanned_day}: {opened} opened, {resolved} resolved")
+    finally:
+        db.close()
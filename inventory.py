@@ -0,0 +1,185 @@
+"""
+Append-only inventory ledger with snapshot checkpoints
+
+Every stock change is an InventoryMovement row. Balances are never updated in
+place; instead `checkpoint` periodically writes an InventorySnapshot per
+(item, section) and stock levels are computed as latest snapshot + the
+movements recorded after it.
+
+For stock-tracked items (those with an item_stock row) the central store's
+ledger balance and item_stock.on_hand move together: every central-store
+movement for a tracked item is written alongside the matching on_hand
+change. Untracked items never get central-store movements.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, func, and_
+from models import SessionLocal, InventoryMovement, InventorySnapshot, ItemStock
+
+# Movements younger than this are left out of a checkpoint, so a transaction
+# that took a lower id but has not committed yet cannot land below the watermark
+CHECKPOINT_SAFETY_LAG = timedelta(minutes=5)
+
+
+def record_movement(db, item_id, section_id, quantity, kind, reference_id=None, remarks=None):
+    """
+    Append one movement to the ledger, committed with the caller's transaction
+    """
+    movement = InventoryMovement(
+        item_id=item_id,
+        section_id=section_id,
+        quantity=quantity,
+        kind=kind,
+        reference_id=reference_id,
+        remarks=remarks
+    )
+    db.add(movement)
+    return movement
+
+
+def adjust_stock(db, item_id, section_id, quantity, remarks=None):
+    """
+    Record a manual adjustment, keeping item_stock in step for the central store
+
+    A positive central-store adjustment of an untracked item starts tracking
+    it. Raises ValueError when the central store would go below zero.
+    """
+    if section_id is None:
+        stock = db.query(ItemStock).filter(ItemStock.item_id == item_id).with_for_update().first()
+        if stock is None:
+            if quantity < 0:
+                raise ValueError("Item has no central stock to adjust")
+            db.add(ItemStock(item_id=item_id, on_hand=quantity, reserved=0))
+        elif not db.execute(
+            update(ItemStock)
+            .where(ItemStock.item_id == item_id, ItemStock.on_hand + quantity >= 0)
+            .values(on_hand=ItemStock.on_hand + quantity)
+        ).rowcount:
+            raise ValueError("Adjustment would take central stock below zero")
+    return record_movement(db, item_id, section_id, quantity, 'adjustment', remarks=remarks)
+
+
+def record_movements(db, movements):
+    """
+    Append many movements with a single executemany INSERT
+    """
+    if movements:
+        now = datetime.now()
+        db.execute(insert(InventoryMovement), [dict(m, created_at=now) for m in movements])
+
+
+def _latest_snapshots(as_of=None):
+    """Latest snapshot per (item, section), taken no later than as_of"""
+    latest = select(
+        InventorySnapshot.item_id,
+        InventorySnapshot.section_id,
+        func.max(InventorySnapshot.last_movement_id).label('last_movement_id')
+    )
+    if as_of is not None:
+        latest = latest.where(InventorySnapshot.taken_at <= as_of)
+    latest = latest.group_by(InventorySnapshot.item_id, InventorySnapshot.section_id).subquery()
+
+    return select(
+        InventorySnapshot.item_id,
+        InventorySnapshot.section_id,
+        InventorySnapshot.balance,
+        InventorySnapshot.last_movement_id
+    ).join(latest, and_(
+        InventorySnapshot.item_id == latest.c.item_id,
+        InventorySnapshot.section_id.is_not_distinct_from(latest.c.section_id),
+        InventorySnapshot.last_movement_id == latest.c.last_movement_id
+    )).subquery()
+
+
+def stock_levels(db, item_id=None, section_id=None, as_of=None):
+    """
+    Stock per (item, section) at as_of (default now)
+
+    Returns {(item_id, section_id): balance}; section_id None is the
+    central store. Only movements after each key's latest snapshot are read.
+    """
+    return _balances(db, item_id, section_id, as_of)
+
+
+def _balances(db, item_id=None, section_id=None, as_of=None, through_movement_id=None):
+    snapshots = _latest_snapshots(as_of)
+
+    base_query = select(snapshots.c.item_id, snapshots.c.section_id, snapshots.c.balance)
+    delta_query = select(
+        InventoryMovement.item_id,
+        InventoryMovement.section_id,
+        func.sum(InventoryMovement.quantity)
+    ).outerjoin(snapshots, and_(
+        InventoryMovement.item_id == snapshots.c.item_id,
+        InventoryMovement.section_id.is_not_distinct_from(snapshots.c.section_id)
+    )).where(
+        InventoryMovement.id > func.coalesce(snapshots.c.last_movement_id, 0)
+    ).group_by(InventoryMovement.item_id, InventoryMovement.section_id)
+
+    if as_of is not None:
+        delta_query = delta_query.where(InventoryMovement.created_at <= as_of)
+    if through_movement_id is not None:
+        delta_query = delta_query.where(InventoryMovement.id <= through_movement_id)
+    if item_id is not None:
+        base_query = base_query.where(snapshots.c.item_id == item_id)
+        delta_query = delta_query.where(InventoryMovement.item_id == item_id)
+    if section_id is not None:
+        base_query = base_query.where(snapshots.c.section_id == section_id)
+        delta_query = delta_query.where(InventoryMovement.section_id == section_id)
+
+    balances = {(row[0], row[1]): row[2] for row in db.execute(base_query)}
+    for row_item, row_section, delta in db.execute(delta_query):
+        key = (row_item, row_section)
+        balances[key] = balances.get(key, 0) + (delta or 0)
+    return balances
+
+
+def checkpoint(db, safety_lag=CHECKPOINT_SAFETY_LAG):
+    """
+    Write a snapshot for every (item, section) that moved since its last one
+
+    Only movements older than `safety_lag` are folded in. Returns the number
+    of snapshots written.
+    """
+    last_movement_id = db.query(func.max(InventoryMovement.id)).filter(
+        InventoryMovement.created_at <= datetime.now() - safety_lag
+    ).scalar()
+    if last_movement_id is None:
+        return 0
+
+    snapshots = _latest_snapshots()
+    changed = db.execute(
+        select(InventoryMovement.item_id, InventoryMovement.section_id, InventoryMovement.plant_id).outerjoin(snapshots, and_(
+            InventoryMovement.item_id == snapshots.c.item_id,
+            InventoryMovement.section_id.is_not_distinct_from(snapshots.c.section_id)
+        )).where(
+            InventoryMovement.id > func.coalesce(snapshots.c.last_movement_id, 0),
+            InventoryMovement.id <= last_movement_id
+        ).distinct()
+    ).all()
+    if not changed:
+        return 0
+
+    # Items belong to one plant, so each (item, section) has a single plant
+    changed_keys = {(row[0], row[1]): row[2] for row in changed}
+    taken_at = datetime.now()
+    levels = _balances(db, through_movement_id=last_movement_id)
+    rows = [{
+        "item_id": key[0],
+        "section_id": key[1],
+        "plant_id": plant_id,
+        "balance": levels.get(key, 0),
+        "last_movement_id": last_movement_id,
+        "taken_at": taken_at
+    } for key, plant_id in changed_keys.items()]
+    db.execute(insert(InventorySnapshot), rows)
+    db.commit()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    # Intended to run from cron, e.g. hourly: python inventory.py
+    db = SessionLocal()
+    try:
+        print(f"Inventory checkpoint: {checkpoint(db)} snapshots written")
+    finally:
+        db.close()
@@ -0,0 +1,249 @@
+"""
+Background jobs for heavy reports and integrity scans
+
+Jobs are rows in the jobs table, so their status and results survive the
+process and can be polled from any worker. A submitted job runs off the
+request path:
+
+- thread (default): in this process's thread pool
+- queue: left queued for a separate worker, `python jobs.py`
+- inline: during submit (scripts and tests)
+
+Each job's cache key combines its kind, its parameters and the data
+versions of the tables it reads. Submitting a job whose key matches a
+finished one returns that result, and submitting one that is already queued
+or running returns the existing job. A result is therefore reused until the
+underlying data changes.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from sqlalchemy import update, delete
+from models import SessionLocal, ReadSessionLocal, Job
+from versions import version_key
+
+JOB_MODE = os.getenv("JOB_MODE", "thread").lower()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# kind -> (function(db, **params), tables it reads, whether it writes)
+JOB_KINDS = {}
+
+
+def job(kind, tables, writes=False, per_plant=True):
+    """
+    Register a function as a job kind
+
+    Read-only jobs get a read session (possibly the replica); jobs that
+    write get a primary session. Jobs that maintain instance-wide tables
+    set per_plant=False and always run unscoped.
+    """
+    def register(func):
+        JOB_KINDS[kind] = (func, tuple(tables), writes, per_plant)
+        return func
+    return register
+
+
+def describe(record):
+    return {
+        "id": record.id,
+        "kind": record.kind,
+        "status": record.status,
+        "result": json.loads(record.result) if record.result else None,
+        "error": record.error,
+        "created_at": record.created_at.isoformat() if record.created_at else None,
+        "finished_at": record.finished_at.isoformat() if record.finished_at else None
+    }
+
+
+class JobRunner:
+    """Submits, runs and looks up jobs"""
+
+    def __init__(self, session_factory=SessionLocal, read_session_factory=ReadSessionLocal,
+                 mode=JOB_MODE, workers=JOB_WORKERS):
+        if mode not in ('thread', 'queue', 'inline'):
+            raise ValueError(f"Unknown JOB_MODE: {mode}")
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory
+        self.mode = mode
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        return self._executor
+
+    def submit(self, kind, params=None, plant_id=None):
+        """
+        Queue a job, or return the cached/in-flight one with the same key
+
+        With `plant_id` the job runs in a session scoped to that plant.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        params = dict(params or {})
+        params.pop('plant_id', None)
+        if plant_id is not None and JOB_KINDS[kind][3]:
+            params['plant_id'] = plant_id
+        encoded = json.dumps(params, sort_keys=True, default=str)
+
+        # Versions come from the same database the job will read
+        read_db = self.read_session_factory()
+        try:
+            cache_key = f"{kind}|{encoded}|{version_key(read_db, JOB_KINDS[kind][1])}"
+        finally:
+            read_db.close()
+
+        db = self.session_factory()
+        try:
+            existing = db.query(Job).filter(
+                Job.cache_key == cache_key, Job.status.in_(('queued', 'running', 'done'))
+            ).order_by(Job.created_at.desc()).first()
+            if existing is not None:
+                return describe(existing)
+            record = Job(id=uuid.uuid4().hex, kind=kind, params=encoded, cache_key=cache_key, status='queued')
+            db.add(record)
+            db.commit()
+            job_id = record.id
+            info = describe(record)
+        finally:
+            db.close()
+
+        if self.mode == 'inline':
+            self.run(job_id)
+            return self.get(job_id)
+        if self.mode == 'thread':
+            self._pool().submit(self.run, job_id)
+        return info
+
+    def get(self, job_id):
+        db = self.session_factory()
+        try:
+            record = db.get(Job, job_id)
+            return describe(record) if record is not None else None
+        finally:
+            db.close()
+
+    def run(self, job_id):
+        """Claim and run one queued job; returns False if another worker has it"""
+        db = self.session_factory()
+        try:
+            claimed = db.execute(
+                update(Job).where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', started_at=datetime.now())
+            ).rowcount
+            db.commit()
+            if not claimed:
+                return False
+
+            record = db.get(Job, job_id)
+            func, _, writes, _ = JOB_KINDS[record.kind]
+            params = json.loads(record.params)
+            plant_id = params.pop('plant_id', None)
+            factory = self.session_factory if writes else self.read_session_factory
+            work_db = factory(info={'plant_id': plant_id}) if plant_id else factory()
+            try:
+                record.result = json.dumps(func(work_db, **params), default=str)
+                record.status = 'done'
+            except Exception as e:
+                work_db.rollback()
+                record.status = 'failed'
+                record.error = str(e)
+            finally:
+                work_db.close()
+            record.finished_at = datetime.now()
+            db.commit()
+            return True
+        finally:
+            db.close()
+
+    def run_pending(self, limit=None):
+        """Run queued jobs oldest first, returns how many ran"""
+        db = self.session_factory()
+        try:
+            query = db.query(Job.id).filter(Job.status == 'queued').order_by(Job.created_at)
+            if limit:
+                query = query.limit(limit)
+            job_ids = [row.id for row in query]
+        finally:
+            db.close()
+        return sum(1 for job_id in job_ids if self.run(job_id))
+
+    def requeue_stale(self, older_than=timedelta(minutes=30)):
+        """Put back jobs left running by a worker that died"""
+        db = self.session_factory()
+        try:
+            count = db.execute(
+                update(Job).where(Job.status == 'running', Job.started_at < datetime.now() - older_than)
+                .values(status='queued', started_at=None)
+            ).rowcount
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def purge(self, older_than=timedelta(days=7)):
+        """Delete finished jobs older than the cutoff"""
+        db = self.session_factory()
+        try:
+            count = db.execute(
+                delete(Job).where(Job.status.in_(('done', 'failed')), Job.finished_at < datetime.now() - older_than)
+            ).rowcount
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+@job('data_integrity', tables=('sections', 'workers', 'production_logs'))
+def data_integrity_job(db, day=None):
+    from validation import check_data_integrity
+    result = check_data_integrity(db, day=date.fromisoformat(day) if day else None)
+    if not result['success']:
+        raise RuntimeError(result['error'])
+    return result
+
+
+@job('integrity_scan', tables=('production_logs', 'integrity_scan_days'), writes=True, per_plant=False)
+def integrity_scan_job(db):
+    from integrity import scan_closed_days
+    return {day.isoformat(): counts for day, counts in scan_closed_days(db).items()}
+
+
+@job('leaderboard', tables=('worker_daily_stats', 'workers', 'sections'))
+def leaderboard_job(db, start, end, metric='efficiency', section_id=None, limit=None):
+    from reports import leaderboard
+    rows = leaderboard(db, date.fromisoformat(start), date.fromisoformat(end), metric, section_id, limit)
+    return [row._asdict() for row in rows]
+
+
+@job('payroll', tables=('production_logs', 'production_logs_archive', 'archive_watermarks', 'attendance_months',
+                        'section_attendance_months', 'items', 'workers'), writes=True)
+def payroll_job(db, start, end):
+    from payroll import run_payroll
+    return run_payroll(db, date.fromisoformat(start), date.fromisoformat(end))
+
+
+runner = JobRunner()
+
+
+if __name__ == "__main__":
+    # Worker for JOB_MODE=queue deployments (e.g. serverless web + one worker box)
+    worker = JobRunner(mode='queue')
+    while True:
+        worker.requeue_stale()
+        if not worker.run_pending():
+            worker.purge()
+            time.sleep(2)
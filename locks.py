@@ -0,0 +1,81 @@
+"""
+Per-(section, date) locking for check-then-insert writes
+
+Material flow validation reads how much input a section has left for the
+day and then inserts a log that consumes some of it. Two submissions for
+the same section and day must not both pass the check, so the check and the
+insert run under a lock keyed on (section_id, date). Other sections and
+days are not blocked.
+
+- Postgres: a transaction-scoped advisory lock (pg_advisory_xact_lock),
+  released automatically on commit or rollback, and shared by every worker
+  process.
+- SQLite: one writer at a time anyway, so writes queue on a single
+  process-wide lock instead of failing with "database is locked" (see also
+  sqlite_edge.py).
+- Anything else: an in-process lock striped by key.
+"""
+import threading
+import zlib
+from contextlib import contextmanager
+from sqlalchemy import text
+
+# High bits of the advisory lock key, so these locks cannot collide with others
+ADVISORY_NAMESPACE = 0x4D46  # "MF"
+LOCK_STRIPES = 64
+
+_writer_lock = threading.Lock()
+_striped_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def advisory_key(section_id, day):
+    """Signed 64-bit key for pg_advisory_xact_lock"""
+    return (ADVISORY_NAMESPACE << 48) | ((section_id & 0xFFFFFF) << 24) | (day.toordinal() & 0xFFFFFF)
+
+
+def _process_lock(dialect, section_id, day):
+    if dialect == 'sqlite':
+        return _writer_lock
+    return _striped_locks[zlib.crc32(f"{section_id}:{day.isoformat()}".encode()) % LOCK_STRIPES]
+
+
+@contextmanager
+def section_day_locks(db, keys):
+    """
+    Hold the locks for several (section_id, day) keys for the rest of the block
+
+    Commit (or roll back) inside the block so the writes are visible before
+    another request runs its check. On Postgres the locks last until the
+    transaction ends; an exception rolls it back. Keys are locked in sorted
+    order so two batches cannot deadlock each other.
+    """
+    keys = sorted(set(keys))
+    dialect = db.get_bind().dialect.name
+    held = []
+    if dialect == 'postgresql':
+        for section_id, day in keys:
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": advisory_key(section_id, day)})
+    else:
+        if dialect == 'sqlite':
+            # Take the connection before the lock: with the SQLite edge profile
+            # it is the process's only writer connection, and waiting for it
+            # while holding the lock would deadlock with a session that has it
+            db.connection()
+        # Several keys can share a stripe; take each process lock once, in a fixed order
+        locks = {id(lock): lock for lock in (_process_lock(dialect, *key) for key in keys)}
+        for _, lock in sorted(locks.items()):
+            lock.acquire()
+            held.append(lock)
+    try:
+        yield
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        for lock in reversed(held):
+            lock.release()
+
+
+def section_day_lock(db, section_id, day):
+    """Hold the (section, day) lock for the rest of the block"""
+    return section_day_locks(db, [(section_id, day)])
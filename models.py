@@ -1,12 +1,35 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Float, Date, DateTime, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from sqlalchemy import create_engine, event, inspect, select, text, update, insert, delete, bindparam, Table, Column, Integer, String, Text, Boolean, Float, Date, DateTime, ForeignKey, Index
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, with_loader_criteria, Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.dml import UpdateBase
+from datetime import datetime, timedelta
+import json
 import os
+import threading
+import time
+import warnings
 
 Base = declarative_base()
 
-class Worker(Base):
+# The plant this instance belongs to; rows written without a plant scope get it
+PLANT_ID = os.getenv("PLANT_ID", "main")
+
+def _plant_default(context):
+    # Plant-scoped sessions pass their plant along as an execution option
+    return context.execution_options.get('plant_id') or PLANT_ID
+
+class PlantScoped:
+    """
+    Tables holding one plant's data
+
+    Sessions created with info={'plant_id': ...} only see that plant's rows
+    and write new rows into it (see _scope_to_plant below).
+    """
+    plant_id = Column(String, nullable=False, default=_plant_default)
+
+class Worker(PlantScoped, Base):
     __tablename__ = 'workers'
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
@@ -14,14 +37,23 @@ class Worker(Base):
     created_at = Column(DateTime, default=datetime.now)
     section = relationship('Section', back_populates='workers')
 
-class Item(Base):
+    __table_args__ = (
+        Index('ix_workers_plant_section', 'plant_id', 'section_id'),
+    )
+
+class Item(PlantScoped, Base):
     __tablename__ = 'items'
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     unit = Column(String, nullable=False)
     default_target = Column(Integer, nullable=False)
+    piece_rate = Column(Float, nullable=False, default=0)  # pay per unit produced
+
+    __table_args__ = (
+        Index('ix_items_plant', 'plant_id'),
+    )
 
-class Section(Base):
+class Section(PlantScoped, Base):
     __tablename__ = 'sections'
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
@@ -32,7 +64,11 @@ class Section(Base):
     machine_downtimes = relationship('MachineDowntime', back_populates='section')
     requisitions = relationship('Requisition', back_populates='section')
 
-class ProductionLog(Base):
+    __table_args__ = (
+        Index('ix_sections_plant', 'plant_id'),
+    )
+
+class ProductionLog(PlantScoped, Base):
     __tablename__ = 'production_logs'
     id = Column(Integer, primary_key=True)
     worker_id = Column(Integer, ForeignKey('workers.id'))
@@ -50,7 +86,29 @@ class ProductionLog(Base):
     item = relationship('Item')
     section = relationship('Section', back_populates='production_logs')
 
-class Attendance(Base):
+    __table_args__ = (
+        Index('ix_production_logs_plant_date_section', 'plant_id', 'date', 'section_id'),
+    )
+
+class WorkerDailyStat(PlantScoped, Base):
+    """Per-worker daily production totals, maintained as logs are written"""
+    __tablename__ = 'worker_daily_stats'
+    worker_id = Column(Integer, ForeignKey('workers.id'), primary_key=True)
+    section_id = Column(Integer, ForeignKey('sections.id'), primary_key=True)
+    date = Column(Date, primary_key=True)
+    entries = Column(Integer, nullable=False, default=0)
+    target = Column(Integer, nullable=False, default=0)
+    actual = Column(Integer, nullable=False, default=0)
+    input_material = Column(Float, nullable=False, default=0)
+    output_material = Column(Float, nullable=False, default=0)
+    wastage = Column(Float, nullable=False, default=0)
+    overtime_hours = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_worker_daily_stats_plant_date_section', 'plant_id', 'date', 'section_id'),
+    )
+
+class Attendance(PlantScoped, Base):
     __tablename__ = 'attendance'
     id = Column(Integer, primary_key=True)
     worker_id = Column(Integer, ForeignKey('workers.id'))
@@ -61,7 +119,58 @@ class Attendance(Base):
     worker = relationship('Worker')
     section = relationship('Section', back_populates='attendance_records')
 
-class MachineDowntime(Base):
+    __table_args__ = (
+        Index('ix_attendance_plant_date_section', 'plant_id', 'date', 'section_id'),
+    )
+
+class AttendanceMonth(PlantScoped, Base):
+    """Days a worker was present in a section during a month, as a bitset (bit n = day n + 1)"""
+    __tablename__ = 'attendance_months'
+    worker_id = Column(Integer, ForeignKey('workers.id'), primary_key=True)
+    section_id = Column(Integer, ForeignKey('sections.id'), primary_key=True)
+    month = Column(Date, primary_key=True)
+    days = Column(Integer, nullable=False, default=0)
+    present = Column(Integer, nullable=False, default=0)  # popcount of days
+
+    __table_args__ = (
+        Index('ix_attendance_months_plant_month_section', 'plant_id', 'month', 'section_id'),
+    )
+
+class SectionAttendanceMonth(PlantScoped, Base):
+    """A section's month: days anyone was present (OR of the workers' bitsets) and totals"""
+    __tablename__ = 'section_attendance_months'
+    section_id = Column(Integer, ForeignKey('sections.id'), primary_key=True)
+    month = Column(Date, primary_key=True)
+    days = Column(Integer, nullable=False, default=0)
+    present = Column(Integer, nullable=False, default=0)  # worker-days present
+    workers = Column(Integer, nullable=False, default=0)  # workers present at least once
+
+class PayrollRun(PlantScoped, Base):
+    """A worker's pay for a period; inputs_digest fingerprints what it was computed from (see payroll.py)"""
+    __tablename__ = 'payroll_runs'
+    id = Column(Integer, primary_key=True)
+    worker_id = Column(Integer, ForeignKey('workers.id'), nullable=False)
+    section_id = Column(Integer, ForeignKey('sections.id'), nullable=True)
+    period_start = Column(Date, nullable=False)
+    period_end = Column(Date, nullable=False)
+    units = Column(Integer, nullable=False, default=0)
+    piece_earnings = Column(Float, nullable=False, default=0)
+    overtime_hours = Column(Float, nullable=False, default=0)
+    overtime_pay = Column(Float, nullable=False, default=0)
+    present_days = Column(Integer, nullable=False, default=0)
+    working_days = Column(Integer, nullable=False, default=0)
+    absent_days = Column(Integer, nullable=False, default=0)
+    deductions = Column(Float, nullable=False, default=0)
+    net_pay = Column(Float, nullable=False, default=0)
+    inputs_digest = Column(String, nullable=False)
+    computed_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index('ix_payroll_runs_plant_period_worker', 'plant_id', 'period_start', 'period_end', 'worker_id',
+              unique=True),
+    )
+
+class MachineDowntime(PlantScoped, Base):
     __tablename__ = 'machine_downtime'
     id = Column(Integer, primary_key=True)
     section_id = Column(Integer, ForeignKey('sections.id'))
@@ -72,18 +181,225 @@ class MachineDowntime(Base):
     created_at = Column(DateTime, default=datetime.now, nullable=False)
     section = relationship('Section', back_populates='machine_downtimes')
 
-class Requisition(Base):
+    __table_args__ = (
+        Index('ix_machine_downtime_plant_section_start', 'plant_id', 'section_id', 'start_time'),
+    )
+
+class Requisition(PlantScoped, Base):
     __tablename__ = 'requisitions'
     id = Column(Integer, primary_key=True)
     item_id = Column(Integer, ForeignKey('items.id'))
     section_id = Column(Integer, ForeignKey('sections.id'))
     quantity = Column(Integer, nullable=False)
-    status = Column(String, nullable=False, default='pending') # pending, approved, rejected
+    status = Column(String, nullable=False, default='pending') # pending, approved, issued, cancelled, rejected
     remarks = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.now, nullable=False)
     item = relationship('Item')
     section = relationship('Section', back_populates='requisitions')
 
+    __table_args__ = (
+        Index('ix_requisitions_plant_status_section', 'plant_id', 'status', 'section_id', 'created_at'),
+    )
+
+class ItemStock(PlantScoped, Base):
+    __tablename__ = 'item_stock'
+    item_id = Column(Integer, ForeignKey('items.id'), primary_key=True)
+    on_hand = Column(Integer, nullable=False, default=0)
+    reserved = Column(Integer, nullable=False, default=0) # quantity held by approved requisitions
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+    item = relationship('Item')
+
+class InventoryMovement(PlantScoped, Base):
+    __tablename__ = 'inventory_movements'
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    section_id = Column(Integer, ForeignKey('sections.id'), nullable=True) # NULL is the central store
+    quantity = Column(Float, nullable=False) # signed, positive adds stock
+    kind = Column(String, nullable=False) # production, requisition, receipt, adjustment
+    reference_id = Column(Integer, nullable=True) # production log / requisition id
+    remarks = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index('ix_inventory_movements_plant_item_section', 'plant_id', 'item_id', 'section_id', 'id'),
+    )
+
+class InventorySnapshot(PlantScoped, Base):
+    __tablename__ = 'inventory_snapshots'
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    section_id = Column(Integer, ForeignKey('sections.id'), nullable=True)
+    balance = Column(Float, nullable=False)
+    last_movement_id = Column(Integer, nullable=False) # movements up to this id are included
+    taken_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index('ix_inventory_snapshots_plant_item_section', 'plant_id', 'item_id', 'section_id', 'last_movement_id'),
+    )
+
+# Archive tables for production_logs, attendance and machine_downtime. Rows
+# (Postgres: whole monthly partitions) older than the retention window are
+# moved here by archive.py; reports union them in when a range reaches back.
+class ProductionLogArchive(PlantScoped, Base):
+    __tablename__ = 'production_logs_archive'
+    id = Column(Integer, primary_key=True)
+    worker_id = Column(Integer)
+    item_id = Column(Integer)
+    section_id = Column(Integer)
+    date = Column(Date, nullable=False)
+    target = Column(Integer, nullable=False)
+    actual = Column(Integer, nullable=False)
+    input_material = Column(Float, nullable=False)
+    output_material = Column(Float, nullable=False)
+    wastage = Column(Float, nullable=False)
+    overtime_hours = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_production_logs_archive_plant_date', 'plant_id', 'date'),
+    )
+
+class AttendanceArchive(PlantScoped, Base):
+    __tablename__ = 'attendance_archive'
+    id = Column(Integer, primary_key=True)
+    worker_id = Column(Integer)
+    section_id = Column(Integer)
+    date = Column(Date, nullable=False)
+    present = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_attendance_archive_plant_date', 'plant_id', 'date'),
+    )
+
+class MachineDowntimeArchive(PlantScoped, Base):
+    __tablename__ = 'machine_downtime_archive'
+    id = Column(Integer, primary_key=True)
+    section_id = Column(Integer)
+    machine_name = Column(String, nullable=False)
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    remarks = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_machine_downtime_archive_plant_section_start', 'plant_id', 'section_id', 'start_time'),
+    )
+
+class ArchiveWatermark(Base):
+    __tablename__ = 'archive_watermarks'
+    table_name = Column(String, primary_key=True)
+    archived_before = Column(Date, nullable=False) # rows older than this live in the archive table
+    archived_at = Column(DateTime, default=datetime.now, nullable=False)
+
+class DataVersion(Base):
+    """Write counter per table, bumped in the writing transaction (see versions.py)"""
+    __tablename__ = 'data_versions'
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class Job(Base):
+    """A background job and, once finished, its result (see jobs.py)"""
+    __tablename__ = 'jobs'
+    id = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)
+    params = Column(Text, nullable=False, default='{}') # JSON
+    cache_key = Column(String, nullable=False) # kind + params + versions of the tables it reads
+    status = Column(String, nullable=False, default='queued') # queued, running, done, failed
+    result = Column(Text, nullable=True) # JSON
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_jobs_cache_key', 'cache_key', 'status'),
+        Index('ix_jobs_status_created', 'status', 'created_at'),
+    )
+
+class IntegrityIssue(Base):
+    """An integrity problem found by the nightly scan (see integrity.py)"""
+    __tablename__ = 'integrity_issues'
+    id = Column(Integer, primary_key=True)
+    fingerprint = Column(String, nullable=False, unique=True) # stable across scans of the same day
+    day = Column(Date, nullable=False)
+    type = Column(String, nullable=False)
+    description = Column(String, nullable=False)
+    details = Column(String, nullable=True)
+    severity = Column(String, nullable=False)
+    first_seen = Column(DateTime, default=datetime.now, nullable=False)
+    last_seen = Column(DateTime, default=datetime.now, nullable=False)
+    resolved_at = Column(DateTime, nullable=True) # NULL while the issue is open
+
+    __table_args__ = (
+        Index('ix_integrity_issues_open_day', 'resolved_at', 'day', 'id'),
+        Index('ix_integrity_issues_day', 'day', 'id'),
+    )
+
+class IntegrityScanDay(Base):
+    """Per-day dirty marker: a day needs a scan when changed_at > scanned_at"""
+    __tablename__ = 'integrity_scan_days'
+    day = Column(Date, primary_key=True)
+    changed_at = Column(DateTime, default=datetime.now, nullable=False)
+    scanned_at = Column(DateTime, nullable=True)
+
+class IngestedEntry(Base):
+    """Entries applied from the ingestion log (see ingest.py), for idempotent replay"""
+    __tablename__ = 'ingested_entries'
+    id = Column(String(32), primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # applied or rejected
+    error = Column(String, nullable=True)
+    applied_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+
+class ChangeLog(Base):
+    """Inserts and updates of change-tracked tables on an edge plant (see replication.py)"""
+    __tablename__ = 'change_log'
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    changed_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    # Shipped entries are pruned; ids must still never be reused
+    __table_args__ = {'sqlite_autoincrement': True}
+
+class OutboxEvent(Base):
+    """A change to a production, attendance, downtime or requisition row (see outbox.py)"""
+    __tablename__ = 'outbox_events'
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    op = Column(String, nullable=False)  # insert, update, delete
+    row_id = Column(Integer, nullable=True)  # NULL for bulk inserts, whose ids are not known
+    plant_id = Column(String, nullable=True)
+    payload = Column(Text, nullable=False)  # the row as JSON (before a delete, after anything else)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    # Delivered events are pruned; consumers' checkpoints rely on ids never being reused
+    __table_args__ = {'sqlite_autoincrement': True}
+
+class OutboxCheckpoint(Base):
+    """Id of the last outbox event a durable consumer has handled"""
+    __tablename__ = 'outbox_checkpoints'
+    consumer = Column(String, primary_key=True)
+    last_event_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now, nullable=False)
+
+class ReplicationKey(Base):
+    """Central id of each row replicated from a plant"""
+    __tablename__ = 'replication_keys'
+    plant_id = Column(String, primary_key=True)
+    table_name = Column(String, primary_key=True)
+    source_id = Column(Integer, primary_key=True)
+    central_id = Column(Integer, nullable=False)
+
+class ReplicationMark(Base):
+    """Per plant and table, how far central has applied (highest id / change_log id)"""
+    __tablename__ = 'replication_marks'
+    plant_id = Column(String, primary_key=True)
+    table_name = Column(String, primary_key=True)
+    high_water = Column(Integer, nullable=False)
+    applied_at = Column(DateTime, default=datetime.now, nullable=False)
+
 # Supabase connection
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -100,16 +416,529 @@ else:
     # Fallback to SQLite for local development/testing if Supabase env vars are not set
     DATABASE_URL = "sqlite:///./local_test.db"
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# direct: SQLAlchemy pools connections per process (long-running servers)
+# pooler: serverless instances going through an external transaction-mode pooler
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "direct").lower()
+DATABASE_POOLER_URL = os.getenv("DATABASE_POOLER_URL")
 
+def create_db_engine(url, mode='direct', **kwargs):
+    """
+    Create an engine configured for the given pool mode
 
-# Initialize Supabase client only if environment variables are set
-if SUPABASE_URL and SUPABASE_KEY:
-    from supabase import create_client, Client
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-else:
-    supabase = None # Placeholder for local testing without Supabase client
+    In pooler mode nothing is pooled client side: every session borrows a
+    connection from the external pooler (pgbouncer, Supabase Supavisor) and
+    hands it back on close, so idle lambda instances hold no server
+    connections. Server-side prepared statements are turned off because the
+    pooler may run each transaction on a different server connection.
+    """
+    if mode == 'direct':
+        return create_engine(url, **kwargs)
+    if mode != 'pooler':
+        raise ValueError(f"Unknown DB_POOL_MODE: {mode}")
+
+    connect_args = dict(kwargs.pop('connect_args', {}))
+    driver = make_url(url).get_driver_name()
+    if driver == 'psycopg':
+        connect_args.setdefault('prepare_threshold', None)
+    elif driver == 'asyncpg':
+        connect_args.setdefault('statement_cache_size', 0)
+        connect_args.setdefault('prepared_statement_cache_size', 0)
+    return create_engine(url, poolclass=NullPool, connect_args=connect_args, **kwargs)
+
+# The engine (and with it the DBAPI driver import) is created on first
+# database use rather than at import, which keeps serverless cold starts short
+_engine = None
+_read_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine, _read_engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                url = DATABASE_POOLER_URL if DB_POOL_MODE == 'pooler' and DATABASE_POOLER_URL else DATABASE_URL
+                if DB_POOL_MODE == 'pooler' and not DATABASE_POOLER_URL and not url.startswith('sqlite'):
+                    warnings.warn(
+                        "DB_POOL_MODE=pooler but DATABASE_POOLER_URL is not set; "
+                        "connecting to the database directly without a client-side pool"
+                    )
+                if DB_POOL_MODE == 'direct' and url.startswith('sqlite'):
+                    # Single-box plants: WAL, one writer connection, pooled readers
+                    import sqlite_edge
+                    if sqlite_edge.SQLITE_PROFILE == 'edge' and sqlite_edge.is_sqlite_file(url):
+                        _engine, _read_engine = sqlite_edge.create_engines(url)
+                        return _engine
+                _engine = create_db_engine(url, DB_POOL_MODE)
+    return _engine
+
+def get_read_engine():
+    """Engine for read-only sessions: the SQLite reader pool, else the primary"""
+    engine = get_engine()
+    return _read_engine or engine
+
+# Plants with a database of their own, e.g. {"north": "postgresql://..."}.
+# Sessions scoped to such a plant use it instead of DATABASE_URL.
+PLANT_DATABASE_URLS = json.loads(os.getenv("PLANT_DATABASE_URLS") or "{}")
+_plant_engines = {}
+
+def get_plant_engine(plant_id):
+    """Engine of a plant routed to its own database, or None"""
+    url = PLANT_DATABASE_URLS.get(plant_id)
+    if url is None:
+        return None
+    if plant_id not in _plant_engines:
+        with _engine_lock:
+            if plant_id not in _plant_engines:
+                _plant_engines[plant_id] = create_db_engine(url, DB_POOL_MODE)
+    return _plant_engines[plant_id]
+
+# Optional read replica for report queries
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+
+class ReplicaRouter:
+    """
+    Decides whether read-only sessions may use the replica
+
+    Replica lag is probed at most every `check_interval` seconds. While the
+    replica is too far behind or unreachable, reads fall back to the primary.
+    """
+    def __init__(self, url=None, max_lag_seconds=30, check_interval=5, engine=None, connect_timeout=3):
+        self.url = url
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self.connect_timeout = connect_timeout
+        self._engine = engine
+        self._healthy = False
+        self._checked_at = None
+        # Separate locks: the probe creates the engine on first use
+        self._engine_lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+
+    @property
+    def configured(self):
+        return self._engine is not None or bool(self.url)
+
+    def engine(self):
+        if self._engine is None and self.url:
+            with self._engine_lock:
+                if self._engine is None:
+                    kwargs = {}
+                    if make_url(self.url).get_backend_name() == 'postgresql':
+                        # An unreachable replica must not stall the request that probes it
+                        kwargs['connect_args'] = {'connect_timeout': self.connect_timeout}
+                    self._engine = create_db_engine(self.url, DB_POOL_MODE, **kwargs)
+        return self._engine
+
+    def lag_seconds(self, engine):
+        """Seconds the replica is behind the primary (0 when not a Postgres standby)"""
+        with engine.connect() as conn:
+            if engine.dialect.name != 'postgresql':
+                conn.execute(text("SELECT 1"))
+                return 0
+            # An idle primary writes nothing, so the last replay timestamp ages
+            # even on a fully caught-up standby; only use it while WAL is pending
+            return conn.execute(text(
+                "SELECT CASE "
+                "WHEN NOT pg_is_in_recovery() THEN 0 "
+                "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+            )).scalar()
+
+    def engine_for_read(self):
+        """The replica engine if it is healthy, else None"""
+        if not self.configured:
+            return None
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            with self._probe_lock:
+                if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                    try:
+                        self._healthy = self.lag_seconds(self.engine()) <= self.max_lag_seconds
+                    except Exception:
+                        self._healthy = False
+                    self._checked_at = now
+        return self._engine if self._healthy else None
+
+replica_router = ReplicaRouter(REPLICA_DATABASE_URL, REPLICA_MAX_LAG_SECONDS)
+
+class RoutingSession(Session):
+    """
+    Session bound to the shared engine when it first needs a connection
+
+    Sessions scoped to a plant listed in PLANT_DATABASE_URLS use that
+    plant's database. Otherwise, sessions created with info={'read_only':
+    True} send their queries to the replica when one is configured and
+    healthy, else to the read engine (the query-only pool under the SQLite
+    edge profile). Flushes always go to the primary.
+    """
+    router = replica_router
+
+    def get_bind(self, mapper=None, **kw):
+        if self.bind is None:
+            plant_engine = get_plant_engine(self.info.get('plant_id'))
+            if plant_engine is not None:
+                return plant_engine
+        if self.info.get('read_only') and not self._flushing:
+            replica = self.router.engine_for_read()
+            if replica is not None:
+                return replica
+            if self.bind is None:
+                return get_read_engine()
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(mapper, **kw)
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, info={'read_only': True})
+
+# A session created with info={'plant_id': ...} is scoped to that plant:
+# every ORM query and bulk UPDATE/DELETE on plant tables gets a plant_id
+# filter, and rows it inserts (ORM or INSERT statements) belong to the plant.
+# Unscoped sessions (scripts, jobs, the consolidated admin view) see all plants.
+@event.listens_for(Session, 'do_orm_execute')
+def _scope_to_plant(orm_execute_state):
+    plant_id = orm_execute_state.session.info.get('plant_id')
+    if plant_id is None:
+        return
+    orm_execute_state.update_execution_options(plant_id=plant_id)
+    if orm_execute_state.is_orm_statement and not orm_execute_state.is_insert \
+            and not orm_execute_state.is_column_load and not orm_execute_state.is_relationship_load:
+        orm_execute_state.statement = orm_execute_state.statement.options(
+            with_loader_criteria(PlantScoped, lambda cls: cls.plant_id == plant_id, include_aliases=True)
+        )
+
+@event.listens_for(Session, 'before_flush')
+def _assign_plant(session, flush_context, instances):
+    plant_id = session.info.get('plant_id')
+    if plant_id is not None:
+        for obj in session.new:
+            if isinstance(obj, PlantScoped) and obj.plant_id is None:
+                obj.plant_id = plant_id
+
+# Every transaction that writes to a table bumps that table's data_versions
+# row in the same transaction; caches key their entries on these counters
+# (see versions.py). ORM flushes and statements run through Session.execute
+# are covered; raw SQL outside a Session is not.
+def _upsert(connection, model, rows, set_):
+    """INSERT rows, updating set_ on primary key conflicts"""
+    key = [column.name for column in model.__table__.primary_key]
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        connection.execute(upsert(model).values(rows).on_conflict_do_update(index_elements=key, set_=set_))
+        return
+    for row in rows:
+        match = [getattr(model, name) == row[name] for name in key]
+        if not connection.execute(update(model).where(*match).values(**set_)).rowcount:
+            connection.execute(insert(model).values(**row))
+
+def bump_table_versions(connection, tables):
+    """Bump data_versions for writes the listeners cannot see (e.g. COPY)"""
+    tables = sorted(set(tables) - {DataVersion.__tablename__})
+    if tables:
+        _upsert(connection, DataVersion, [{"table_name": name, "version": 1} for name in tables],
+                {"version": DataVersion.version + 1})
+
+@event.listens_for(Session, 'after_flush')
+def _bump_flushed_tables(session, flush_context):
+    tables = set()
+    for obj in list(session.new) + list(session.deleted):
+        tables.add(obj.__table__.name)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            tables.add(obj.__table__.name)
+    bump_table_versions(session.connection(), tables)
+
+    # Days whose production logs changed need a fresh integrity scan
+    days = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ProductionLog):
+            days.add(obj.date)
+            days.update(d for d in inspect(obj).attrs.date.history.deleted if d is not None)
+    mark_days_changed(session.connection(), days)
+
+    # Keep the attendance bitmaps in step: new rows are OR-ed in, changed
+    # or deleted rows have their months recomputed
+    added, changed = [], set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Attendance):
+            continue
+        if obj in session.new:
+            added.append(obj)
+        elif obj in session.deleted or session.is_modified(obj, include_collections=False):
+            state = inspect(obj)
+            old = {attr: (state.attrs[attr].history.deleted or [getattr(obj, attr)])[0]
+                   for attr in ('worker_id', 'section_id', 'date')}
+            changed.add((obj.plant_id, old['worker_id'], old['section_id'], old['date'].replace(day=1)))
+            if obj not in session.deleted:
+                changed.add((obj.plant_id, obj.worker_id, obj.section_id, obj.date.replace(day=1)))
+    add_attendance_bits(session.connection(), [
+        {"plant_id": obj.plant_id, "worker_id": obj.worker_id, "section_id": obj.section_id,
+         "date": obj.date, "present": obj.present} for obj in added
+    ])
+    recompute_attendance_months(session.connection(), changed)
+
+# Edge plants record inserts and updates of these tables in change_log so
+# replication.py can ship them; the other replicated tables are append-only
+# and shipped by id high-water mark
+REPLICATION_ROLE = os.getenv("REPLICATION_ROLE", "off").lower()
+CHANGE_TRACKED_TABLES = frozenset(('sections', 'items', 'workers', 'requisitions', 'item_stock'))
+
+def _primary_key(table):
+    return next(iter(table.primary_key.columns))
+
+@event.listens_for(Session, 'after_flush')
+def _log_flushed_changes(session, flush_context):
+    if REPLICATION_ROLE != 'edge':
+        return
+    changes = set()
+    for obj in list(session.new) + list(session.dirty):
+        table = obj.__table__
+        if table.name in CHANGE_TRACKED_TABLES and (obj in session.new or session.is_modified(obj, include_collections=False)):
+            changes.add((table.name, getattr(obj, _primary_key(table).key)))
+    log_changes(session.connection(), changes)
+
+def log_changes(connection, changes):
+    """Append (table_name, row_id) pairs to change_log"""
+    if changes:
+        now = datetime.now()
+        connection.execute(insert(ChangeLog), [
+            {"table_name": name, "row_id": row_id, "changed_at": now} for name, row_id in sorted(changes)
+        ])
+
+def mark_days_changed(connection, days):
+    """Flag days for a fresh integrity scan (see integrity.py)"""
+    if days:
+        now = datetime.now()
+        _upsert(connection, IntegrityScanDay,
+                [{"day": day, "changed_at": now} for day in sorted(days)], {"changed_at": now})
+
+def _write_worker_months(connection, bits, replace=False):
+    """
+    Write {(worker_id, section_id, month): (plant_id, days)} into attendance_months
+
+    Days are OR-ed into existing rows, or replace them with `replace`; rows
+    left without any day set are deleted. Returns {key: (plant_id, old days,
+    new days)} for the rows that changed.
+    """
+    table = AttendanceMonth.__table__
+    keys = [table.c.worker_id, table.c.section_id, table.c.month]
+    current = {(row.worker_id, row.section_id, row.month): row.days for row in connection.execute(
+        select(*keys, table.c.days).where(table.c.worker_id.in_({key[0] for key in bits}),
+                                          table.c.month.in_({key[2] for key in bits})).with_for_update()
+    )}
+    changes, inserts, updates = {}, [], []
+    for key, (plant_id, days) in bits.items():
+        old = current.get(key, 0)
+        new = days if replace else old | days
+        if new == old:
+            continue
+        changes[key] = (plant_id, old, new)
+        if not old:
+            inserts.append({"plant_id": plant_id, "worker_id": key[0], "section_id": key[1], "month": key[2],
+                            "days": new, "present": new.bit_count()})
+        elif new:
+            updates.append({"b_worker_id": key[0], "b_section_id": key[1], "b_month": key[2],
+                            "b_days": new, "b_present": new.bit_count()})
+        else:
+            connection.execute(delete(table).where(*[column == value for column, value in zip(keys, key)]))
+    if updates:
+        connection.execute(update(table).where(*[column == bindparam(f"b_{column.name}") for column in keys])
+                           .values(days=bindparam("b_days"), present=bindparam("b_present")), updates)
+    if inserts:
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(table), inserts)
+        except IntegrityError:
+            # Another transaction created some of these rows first; merge into them
+            retry = {(row["worker_id"], row["section_id"], row["month"]) for row in inserts}
+            for key in retry:
+                del changes[key]
+            changes.update(_write_worker_months(connection, {key: bits[key] for key in retry}, replace))
+    return changes
+
+def _write_section_months(connection, changes):
+    """Fold worker bitset changes into section_attendance_months"""
+    totals = {}
+    for (_, section_id, month), (plant_id, old, new) in changes.items():
+        total = totals.setdefault((section_id, month), {"plant_id": plant_id, "added": 0, "present": 0,
+                                                        "workers": 0, "cleared": False})
+        total["added"] |= new
+        total["present"] += new.bit_count() - old.bit_count()
+        total["workers"] += bool(new) - bool(old)
+        total["cleared"] |= bool(old & ~new)
+    if not totals:
+        return
+    table, months = SectionAttendanceMonth.__table__, AttendanceMonth.__table__
+    current = {(row.section_id, row.month): row for row in connection.execute(
+        select(table).where(table.c.section_id.in_({key[0] for key in totals}),
+                            table.c.month.in_({key[1] for key in totals})).with_for_update()
+    )}
+    for (section_id, month), total in sorted(totals.items()):
+        match = [table.c.section_id == section_id, table.c.month == month]
+        old = current.get((section_id, month))
+        if total["cleared"]:
+            # A day may have lost its last present worker: OR the workers' bitsets again
+            days = 0
+            for worker_days in connection.execute(select(months.c.days).where(
+                    months.c.section_id == section_id, months.c.month == month)).scalars():
+                days |= worker_days
+        else:
+            days = (old.days if old else 0) | total["added"]
+        values = {"days": days, "present": (old.present if old else 0) + total["present"],
+                  "workers": (old.workers if old else 0) + total["workers"]}
+        if old is None:
+            try:
+                with connection.begin_nested():
+                    connection.execute(insert(table).values(plant_id=total["plant_id"], section_id=section_id,
+                                                            month=month, **values))
+            except IntegrityError:
+                _write_section_months(connection, {key: change for key, change in changes.items()
+                                                   if key[1:] == (section_id, month)})
+        elif values["workers"]:
+            connection.execute(update(table).where(*match).values(**values))
+        else:
+            connection.execute(delete(table).where(*match))
+
+def add_attendance_bits(connection, rows):
+    """
+    OR present attendance rows into the attendance bitsets
+
+    `rows` are dicts with plant_id, worker_id, section_id, date and present,
+    for writers that bypass the flush hook (bulk imports, replication).
+    """
+    bits = {}
+    for row in rows:
+        if row["present"] and row["worker_id"] is not None and row["section_id"] is not None:
+            key = (row["worker_id"], row["section_id"], row["date"].replace(day=1))
+            plant_id, days = bits.get(key, (row.get("plant_id") or PLANT_ID, 0))
+            bits[key] = (plant_id, days | 1 << (row["date"].day - 1))
+    if bits:
+        _write_section_months(connection, _write_worker_months(connection, bits))
+        bump_table_versions(connection, [AttendanceMonth.__tablename__, SectionAttendanceMonth.__tablename__])
+
+def recompute_attendance_months(connection, keys):
+    """Rebuild the (plant_id, worker_id, section_id, month) bitsets, and their sections', from the rows"""
+    bits = {}
+    for plant_id, worker_id, section_id, month in keys:
+        if worker_id is None or section_id is None:
+            continue
+        next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+        days = 0
+        for source in (Attendance.__table__, AttendanceArchive.__table__):
+            for day in connection.execute(select(source.c.date).where(
+                    source.c.worker_id == worker_id, source.c.section_id == section_id, source.c.present == True,
+                    source.c.date >= month, source.c.date < next_month)).scalars():
+                days |= 1 << (day.day - 1)
+        bits[(worker_id, section_id, month)] = (plant_id, days)
+    if bits:
+        _write_section_months(connection, _write_worker_months(connection, bits, replace=True))
+        bump_table_versions(connection, [AttendanceMonth.__tablename__, SectionAttendanceMonth.__tablename__])
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bump_statement_tables(orm_execute_state):
+    statement = orm_execute_state.statement
+    if isinstance(statement, UpdateBase) and isinstance(getattr(statement, 'table', None), Table):
+        connection = orm_execute_state.session.connection()
+        bump_table_versions(connection, [statement.table.name])
+        if REPLICATION_ROLE == 'edge' and statement.table.name in CHANGE_TRACKED_TABLES and orm_execute_state.is_update:
+            # Runs before the UPDATE, in its transaction: these are the rows it will touch
+            key = _primary_key(statement.table)
+            query = select(key)
+            if statement.whereclause is not None:
+                query = query.where(statement.whereclause)
+            params = orm_execute_state.parameters
+            changes = set()
+            for params in (params if isinstance(params, list) else [params or {}]):
+                changes.update((statement.table.name, row_id) for row_id in connection.execute(query, params).scalars())
+            log_changes(connection, changes)
+
+# With OUTBOX_MODE other than off, every write to these tables appends an
+# event to outbox_events in the same transaction: ORM flushes, INSERT, UPDATE
+# and DELETE statements run through a Session, and bulk imports. outbox.py
+# delivers them to consumers.
+OUTBOX_MODE = os.getenv("OUTBOX_MODE", "off").lower()
+OUTBOX_TABLES = frozenset(('production_logs', 'attendance', 'machine_downtime', 'requisitions'))
+
+def append_outbox_events(connection, table_name, op, rows, plant_id=None):
+    """Append one event per row dict; for writers that bypass the Session (e.g. COPY)"""
+    if rows:
+        now = datetime.now()
+        connection.execute(insert(OutboxEvent), [
+            {"table_name": table_name, "op": op, "row_id": row.get('id'), "plant_id": row.get('plant_id') or plant_id,
+             "payload": json.dumps(row, default=str), "created_at": now} for row in rows
+        ])
+
+def _row(obj):
+    return {column.key: getattr(obj, column.key) for column in inspect(obj).mapper.column_attrs}
+
+@event.listens_for(Session, 'after_flush')
+def _append_flushed_events(session, flush_context):
+    if OUTBOX_MODE == 'off':
+        return
+    events = {}
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            table_name = getattr(obj, '__tablename__', None)
+            if table_name not in OUTBOX_TABLES:
+                continue
+            if op == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            events.setdefault((table_name, op), []).append(_row(obj))
+    for (table_name, op), rows in events.items():
+        append_outbox_events(session.connection(), table_name, op, sorted(rows, key=lambda row: row['id'] or 0))
+    if events:
+        session.info['outbox_written'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _append_statement_events(orm_execute_state):
+    statement = orm_execute_state.statement
+    table = getattr(statement, 'table', None)
+    if OUTBOX_MODE == 'off' or not isinstance(statement, UpdateBase) or not isinstance(table, Table) \
+            or table.name not in OUTBOX_TABLES or not orm_execute_state.execution_options.get('outbox', True):
+        return None
+    session = orm_execute_state.session
+    connection = session.connection()
+    plant_id = session.info.get('plant_id')
+    params = orm_execute_state.parameters
+    params = params if isinstance(params, list) else [params or {}]
+
+    if orm_execute_state.is_insert:
+        result = orm_execute_state.invoke_statement()
+        rows = [dict(row) for row in params if row]
+        append_outbox_events(connection, table.name, 'insert', rows, plant_id or PLANT_ID)
+    else:
+        # Before the statement, in its transaction: the rows it will touch
+        key = _primary_key(table)
+        query = select(table)
+        if statement.whereclause is not None:
+            query = query.where(statement.whereclause)
+        if plant_id is not None:
+            query = query.where(table.c.plant_id == plant_id)
+        rows = {}
+        for row_params in params:
+            rows.update((row[key.name], row) for row in connection.execute(query, row_params).mappings())
+        result = orm_execute_state.invoke_statement()
+        if orm_execute_state.is_update and rows:
+            rows = {row[key.name]: row for row in connection.execute(select(table).where(key.in_(rows))).mappings()}
+        append_outbox_events(connection, table.name, 'update' if orm_execute_state.is_update else 'delete',
+                             [dict(rows[row_id]) for row_id in sorted(rows)])
+    if rows:
+        session.info['outbox_written'] = True
+    return result
+
+def __getattr__(name):
+    # models.engine and models.supabase are still available, created lazily
+    if name == 'engine':
+        return get_engine()
+    if name == 'supabase':
+        from clients import get_supabase_client
+        return get_supabase_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,248 @@
+"""
+Change events for downstream consumers (transactional outbox)
+
+With OUTBOX_MODE other than off, every write to production_logs,
+attendance, machine_downtime and requisitions appends an event to
+outbox_events in the same transaction (the hooks live in models.py), so an
+event exists exactly when its change was committed. Each event carries the
+table, the operation (insert, update, delete), the row id and the row as
+JSON.
+
+Consumers are registered with @consumer and get events in id order, in
+batches of up to OUTBOX_BATCH_SIZE:
+- durable consumers (the default) keep their position in
+  outbox_checkpoints, committed after each batch they handle. A batch that
+  raises is retried on the next pass, so delivery is at least once and
+  handlers should be idempotent on the event id. Processes share the
+  checkpoint, and its row is locked while a batch is delivered.
+- durable=False consumers (e.g. a process-local cache) keep their position
+  in memory and start at the events written after the process started.
+
+Ids are assigned at insert but transactions commit in any order, so an id
+can briefly be missing. Delivery stops at such a gap until it fills or the
+next event is OUTBOX_GAP_SECONDS old (the missing id was rolled back).
+
+OUTBOX_MODE=thread delivers from a thread in each app process, woken
+straight after commits that wrote events and polling every OUTBOX_POLL_MS
+for the rest. OUTBOX_MODE=queue only writes events; run `python outbox.py`
+to deliver them. With OUTBOX_WEBHOOK_URL set, batches are also POSTed
+there as JSON by the durable `webhook` consumer.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import Session
+from models import SessionLocal, OutboxEvent, OutboxCheckpoint, OUTBOX_MODE
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_MS = int(os.getenv("OUTBOX_POLL_MS", "1000"))
+OUTBOX_GAP_SECONDS = float(os.getenv("OUTBOX_GAP_SECONDS", "10"))
+OUTBOX_RETENTION = timedelta(days=int(os.getenv("OUTBOX_RETENTION_DAYS", "7")))
+OUTBOX_WEBHOOK_URL = os.getenv("OUTBOX_WEBHOOK_URL")
+OUTBOX_WEBHOOK_TOKEN = os.getenv("OUTBOX_WEBHOOK_TOKEN")
+
+# name -> (function(events), tables or None for all, durable)
+CONSUMERS = {}
+
+
+def consumer(name, tables=None, durable=True):
+    """Register a function as an outbox consumer of `tables` (default: all)"""
+    def register(func):
+        CONSUMERS[name] = (func, frozenset(tables) if tables else None, durable)
+        return func
+    return register
+
+
+def describe(record):
+    return {
+        "id": record.id,
+        "table": record.table_name,
+        "op": record.op,
+        "row_id": record.row_id,
+        "plant_id": record.plant_id,
+        "row": json.loads(record.payload),
+        "created_at": record.created_at.isoformat(),
+    }
+
+
+def ready_events(records, position, now, gap_seconds=OUTBOX_GAP_SECONDS):
+    """The leading records that follow on from `position` without a gap that may still fill"""
+    ready = []
+    expected = position + 1
+    for record in records:
+        if record.id != expected and record.created_at > now - timedelta(seconds=gap_seconds):
+            break
+        ready.append(record)
+        expected = record.id + 1
+    return ready
+
+
+class OutboxDispatcher:
+    """Delivers outbox events to the registered consumers"""
+
+    def __init__(self, sessions=SessionLocal, batch_size=OUTBOX_BATCH_SIZE, poll_ms=OUTBOX_POLL_MS,
+                 gap_seconds=OUTBOX_GAP_SECONDS):
+        self.sessions = sessions
+        self.batch_size = batch_size
+        self.poll_interval = poll_ms / 1000
+        self.gap_seconds = gap_seconds
+        self._positions = {}
+        self._condition = threading.Condition()
+        self._woken = False
+        self._thread = None
+        self._stopping = False
+        self._last_purge = None
+        self._start_lock = threading.Lock()
+
+    def deliver(self, name):
+        """Hand the next batch to one consumer; returns the number of events it moved past"""
+        handler, tables, durable = CONSUMERS[name]
+        db = self.sessions()
+        try:
+            if durable:
+                checkpoint = db.get(OutboxCheckpoint, name, with_for_update=True)
+                if checkpoint is None:
+                    checkpoint = OutboxCheckpoint(consumer=name, last_event_id=0)
+                    db.add(checkpoint)
+                    db.flush()
+                position = checkpoint.last_event_id
+            else:
+                position = self._positions.get(name)
+                if position is None:
+                    position = self._positions[name] = db.query(func.max(OutboxEvent.id)).scalar() or 0
+
+            records = db.query(OutboxEvent).filter(OutboxEvent.id > position) \
+                .order_by(OutboxEvent.id).limit(self.batch_size).all()
+            ready = ready_events(records, position, datetime.now(), self.gap_seconds)
+            if not ready:
+                db.rollback()
+                return 0
+            events = [describe(record) for record in ready if tables is None or record.table_name in tables]
+            if events:
+                handler(events)
+            if durable:
+                checkpoint.last_event_id = ready[-1].id
+                checkpoint.updated_at = datetime.now()
+                db.commit()
+            else:
+                self._positions[name] = ready[-1].id
+            return len(ready)
+        except Exception as e:
+            # The position stays put; the batch is retried on the next pass
+            db.rollback()
+            print(f"Outbox consumer {name} failed: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def dispatch(self):
+        """One pass over every consumer; returns the events moved past"""
+        return sum(self.deliver(name) for name in list(CONSUMERS))
+
+    def purge(self, older_than=OUTBOX_RETENTION):
+        """Delete events past their retention that every durable consumer has handled"""
+        db = self.sessions()
+        try:
+            query = delete(OutboxEvent).where(OutboxEvent.created_at < datetime.now() - older_than)
+            durable = [name for name, (_, _, is_durable) in CONSUMERS.items() if is_durable]
+            if durable:
+                handled = db.execute(select(func.min(OutboxCheckpoint.last_event_id)).where(
+                    OutboxCheckpoint.consumer.in_(durable))).scalar() or 0
+                if db.query(func.count()).select_from(OutboxCheckpoint) \
+                        .filter(OutboxCheckpoint.consumer.in_(durable)).scalar() < len(durable):
+                    handled = 0  # a consumer that has not started yet wants everything
+                query = query.where(OutboxEvent.id <= handled)
+            count = db.execute(query).rowcount
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def purge_hourly(self):
+        if self._last_purge is None or time.monotonic() - self._last_purge > 3600:
+            self._last_purge = time.monotonic()
+            self.purge()
+
+    def wake(self):
+        """Deliver now instead of at the next poll"""
+        with self._condition:
+            self._woken = True
+            self._condition.notify()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._woken and not self._stopping:
+                    self._condition.wait(self.poll_interval)
+                self._woken = False
+                stopping = self._stopping
+            if stopping:
+                return
+            try:
+                while self.dispatch() >= self.batch_size:
+                    pass
+                self.purge_hourly()
+            except Exception as e:
+                print(f"Outbox dispatch failed: {e}")
+
+    def stop(self):
+        with self._condition:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+
+
+dispatcher = OutboxDispatcher()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_dispatcher(session):
+    if session.info.pop('outbox_written', False) and dispatcher._thread is not None:
+        dispatcher.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_events(session):
+    session.info.pop('outbox_written', None)
+
+
+def webhook_sink(events):
+    """POST a batch to OUTBOX_WEBHOOK_URL; anything but a 2xx answer raises and the batch is retried"""
+    from urllib.request import Request, urlopen
+    headers = {'Content-Type': 'application/json'}
+    if OUTBOX_WEBHOOK_TOKEN:
+        headers['Authorization'] = f"Bearer {OUTBOX_WEBHOOK_TOKEN}"
+    request = Request(OUTBOX_WEBHOOK_URL, data=json.dumps({"events": events}).encode(), headers=headers,
+                      method='POST')
+    with urlopen(request, timeout=10):
+        pass
+
+
+if OUTBOX_WEBHOOK_URL:
+    consumer('webhook')(webhook_sink)
+
+
+if __name__ == "__main__":
+    # Delivery for OUTBOX_MODE=queue deployments: python outbox.py
+    if OUTBOX_MODE == 'off':
+        print("OUTBOX_MODE is off; no events are being written")
+    worker = OutboxDispatcher()
+    while True:
+        if worker.dispatch() < worker.batch_size:
+            worker.purge_hourly()
+            time.sleep(worker.poll_interval)
@@ -0,0 +1,210 @@
+"""
+Payroll for a pay period: piece-rate earnings, overtime and absences
+
+A run computes one payroll_runs row per worker for [start, end]:
+- units and piece earnings: actual output x the item's piece_rate
+- overtime hours (the per-log overtime_hours) x PAYROLL_OVERTIME_RATE
+- absent days: days the worker's section worked (its attendance bitsets)
+  that the worker was not present anywhere, x PAYROLL_ABSENCE_DEDUCTION
+- net pay = piece earnings + overtime pay - deductions
+
+Earnings are one grouped SQL statement per section over the period's
+production logs (archived ones included), not a loop over log rows. With
+PAYROLL_PROCESSES > 1 the sections are computed in parallel in a process
+pool, each process on its own connection.
+
+Every row keeps a digest of its inputs: the worker's log totals, its
+attendance bitsets, its section's working days and the rates. A rerun
+reads the digests first (one grouped query plus the bitsets) and only
+recomputes and rewrites workers whose digest changed.
+
+python payroll.py 2024-03-01 2024-03-31
+"""
+import hashlib
+import os
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import sessionmaker
+from models import PayrollRun, ProductionLog, SectionAttendanceMonth, Item, Worker, create_db_engine, DB_POOL_MODE
+from archive import with_archive
+from attendance import _months, day_mask, month_start
+from versions import version_key
+
+PAYROLL_OVERTIME_RATE = float(os.getenv("PAYROLL_OVERTIME_RATE", "0"))
+PAYROLL_ABSENCE_DEDUCTION = float(os.getenv("PAYROLL_ABSENCE_DEDUCTION", "0"))
+PAYROLL_PROCESSES = int(os.getenv("PAYROLL_PROCESSES", "1"))
+
+
+def _logs(db, start, end):
+    """(production logs selectable, its columns, the period filter)"""
+    source = with_archive(db, ProductionLog, start)
+    return source, source.c, (source.c.date >= start, source.c.date <= end)
+
+
+def log_totals(db, start, end):
+    """{worker_id: (logs, last log id, units, overtime hours, item-weighted units)} for the period"""
+    _, logs, period = _logs(db, start, end)
+    rows = db.execute(
+        select(logs.worker_id, func.count(), func.max(logs.id), func.sum(logs.actual),
+               func.sum(logs.overtime_hours), func.sum(logs.item_id * logs.actual))
+        .where(*period).group_by(logs.worker_id)
+    )
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def attendance_days(db, start, end):
+    """
+    ({worker_id: {month: days present}}, {section_id: {month: days worked}})
+
+    Bitsets masked to [start, end]; a worker's days are OR-ed across the
+    sections they were present in.
+    """
+    workers = {}
+    for worker_id, _, month, days in _months(db, month_start(start), end, start, end):
+        months = workers.setdefault(worker_id, {})
+        months[month] = months.get(month, 0) | days
+    sections = {}
+    for section_id, month, days in db.execute(
+            select(SectionAttendanceMonth.section_id, SectionAttendanceMonth.month, SectionAttendanceMonth.days)
+            .where(SectionAttendanceMonth.month.between(month_start(start), end))):
+        sections.setdefault(section_id, {})[month] = days & day_mask(month, start, end)
+    return workers, sections
+
+
+def section_earnings(db, start, end, worker_ids):
+    """{worker_id: (units, piece earnings, overtime hours)} for some workers, in one statement"""
+    source, logs, period = _logs(db, start, end)
+    items = Item.__table__
+    rows = db.execute(
+        select(logs.worker_id, func.sum(logs.actual), func.sum(logs.actual * func.coalesce(items.c.piece_rate, 0)),
+               func.sum(logs.overtime_hours))
+        .select_from(source.join(items, items.c.id == logs.item_id, isouter=True))
+        .where(*period, logs.worker_id.in_(worker_ids)).group_by(logs.worker_id)
+    )
+    return {row[0]: (int(row[1] or 0), float(row[2] or 0), float(row[3] or 0)) for row in rows}
+
+
+def _earnings_in_process(url, plant_id, start, end, worker_ids):
+    engine = create_db_engine(url, DB_POOL_MODE)
+    db = sessionmaker(bind=engine)(info={'plant_id': plant_id})
+    try:
+        return section_earnings(db, start, end, worker_ids)
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def _earnings(db, start, end, groups, processes):
+    """section_earnings for each group of workers, in a process pool when allowed"""
+    bind = db.get_bind()
+    in_memory = bind.dialect.name == 'sqlite' and bind.url.database in (None, '', ':memory:')
+    if processes <= 1 or len(groups) <= 1 or in_memory:
+        earnings = {}
+        for worker_ids in groups:
+            earnings.update(section_earnings(db, start, end, worker_ids))
+        return earnings
+
+    # Only imported when a pool is used; the app imports this module at startup
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    url = bind.url.render_as_string(hide_password=False)
+    earnings = {}
+    with ProcessPoolExecutor(max_workers=min(processes, len(groups)),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_earnings_in_process, url, db.info.get('plant_id'), start, end, worker_ids)
+                   for worker_ids in groups]
+        for future in futures:
+            earnings.update(future.result())
+    return earnings
+
+
+def _digest(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def run_payroll(db, start, end, processes=None):
+    """
+    Compute (or bring up to date) the payroll_runs rows of [start, end]
+
+    Returns counts of workers computed, left unchanged and removed (workers
+    that no longer exist).
+    """
+    processes = PAYROLL_PROCESSES if processes is None else processes
+    workers = dict(db.query(Worker.id, Worker.section_id).all())
+    totals = log_totals(db, start, end)
+    present, worked = attendance_days(db, start, end)
+    rates = (PAYROLL_OVERTIME_RATE, PAYROLL_ABSENCE_DEDUCTION, version_key(db, ('items',)))
+
+    inputs = {}
+    for worker_id, section_id in workers.items():
+        days = present.get(worker_id, {})
+        section_days = worked.get(section_id, {})
+        inputs[worker_id] = {
+            "present_days": sum(bits.bit_count() for bits in days.values()),
+            "working_days": sum(bits.bit_count() for bits in section_days.values()),
+            "absent_days": sum((bits & ~days.get(month, 0)).bit_count() for month, bits in section_days.items()),
+            "inputs_digest": _digest(totals.get(worker_id), sorted(days.items()), section_id,
+                                     sorted(section_days.items()), rates),
+        }
+
+    period = (PayrollRun.period_start == start, PayrollRun.period_end == end)
+    stored = dict(db.execute(select(PayrollRun.worker_id, PayrollRun.inputs_digest).where(*period)).all())
+    changed = [worker_id for worker_id in workers if stored.get(worker_id) != inputs[worker_id]["inputs_digest"]]
+    removed = [worker_id for worker_id in stored if worker_id not in workers]
+
+    groups = {}
+    for worker_id in changed:
+        if totals.get(worker_id):
+            groups.setdefault(workers[worker_id], []).append(worker_id)
+    earnings = _earnings(db, start, end, list(groups.values()), processes)
+
+    now = datetime.now()
+    rows = []
+    for worker_id in changed:
+        units, piece_earnings, overtime_hours = earnings.get(worker_id, (0, 0.0, 0.0))
+        row = inputs[worker_id]
+        overtime_pay = overtime_hours * PAYROLL_OVERTIME_RATE
+        deductions = row["absent_days"] * PAYROLL_ABSENCE_DEDUCTION
+        rows.append({
+            "worker_id": worker_id, "section_id": workers[worker_id], "period_start": start, "period_end": end,
+            "units": units, "piece_earnings": round(piece_earnings, 2),
+            "overtime_hours": round(overtime_hours, 2), "overtime_pay": round(overtime_pay, 2),
+            "deductions": round(deductions, 2), "net_pay": round(piece_earnings + overtime_pay - deductions, 2),
+            "computed_at": now, **row,
+        })
+
+    if changed or removed:
+        db.execute(delete(PayrollRun).where(*period, PayrollRun.worker_id.in_(changed + removed)))
+    if rows:
+        db.execute(insert(PayrollRun), rows)
+    db.commit()
+    return {"start": start.isoformat(), "end": end.isoformat(), "workers": len(workers),
+            "computed": len(changed), "unchanged": len(workers) - len(changed), "removed": len(removed)}
+
+
+def payroll_rows(db, start, end, section_id=None):
+    """The stored payroll of a period, with worker names"""
+    query = db.query(PayrollRun, Worker.name).join(Worker, Worker.id == PayrollRun.worker_id) \
+        .filter(PayrollRun.period_start == start, PayrollRun.period_end == end).order_by(PayrollRun.worker_id)
+    if section_id is not None:
+        query = query.filter(PayrollRun.section_id == section_id)
+    return [{
+        "worker_id": row.worker_id, "worker": name, "section_id": row.section_id, "units": row.units,
+        "piece_earnings": row.piece_earnings, "overtime_hours": row.overtime_hours,
+        "overtime_pay": row.overtime_pay, "present_days": row.present_days, "working_days": row.working_days,
+        "absent_days": row.absent_days, "deductions": row.deductions, "net_pay": row.net_pay,
+        "computed_at": row.computed_at.isoformat(),
+    } for row, name in query]
+
+
+if __name__ == "__main__":
+    import sys
+    from datetime import date
+    from models import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(run_payroll(db, date.fromisoformat(sys.argv[1]), date.fromisoformat(sys.argv[2])))
+    finally:
+        db.close()
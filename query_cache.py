@@ -0,0 +1,176 @@
+"""
+In-process cache of query results, keyed on table versions
+
+Queries run by read-only sessions (get_read_db, report jobs) go through a
+do_orm_execute hook. The key is the compiled statement with its parameter
+values, the database, the session's plant and the data_versions of every
+table the statement reads. A hit returns the stored rows without touching
+the data tables; any write to one of those tables bumps its
+version (see versions.py), so the next run misses and queries afresh.
+Nothing is ever invalidated explicitly.
+
+The versions are read once per session transaction, on the bind the
+queries use (so a result read from a lagging replica is never stored under
+the primary's versions). Within a transaction a session therefore sees the
+tables as of its first cached query, like a snapshot; request sessions are
+closed at the end of the request.
+
+Only rows of columns are cached (counts, sums, report rows). Queries that
+load ORM objects run as usual: merging cached objects into a session costs
+about as much as loading them.
+
+Entries are evicted least recently used first once there are more than
+QUERY_CACHE_SIZE of them or they hold more than QUERY_CACHE_MAX_ROWS rows
+in total (0 disables the cache). Each process has its own cache; `stats()`
+reports entries, rows, hits, misses and evictions.
+
+Statements opt out with .execution_options(query_cache=False), and
+queries in other sessions opt in with query_cache=True.
+"""
+import itertools
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+from sqlalchemy import Table, event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import visitors
+from models import DataVersion
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1000"))
+QUERY_CACHE_MAX_ROWS = int(os.getenv("QUERY_CACHE_MAX_ROWS", "100000"))
+
+# Bookkeeping tables written outside the version counters, or the counters themselves
+UNCACHED_TABLES = frozenset(('data_versions', 'change_log', 'outbox_events'))
+
+
+class QueryCache:
+    """LRU map of cache key -> frozen result, bounded by entries and total rows"""
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, max_rows=QUERY_CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, frozen):
+        rows = len(frozen.data)
+        if rows > self.max_rows:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._rows -= self._entries.pop(key)[1]
+            self._entries[key] = (frozen, rows)
+            self._rows += rows
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._rows -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "rows": self._rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+cache = QueryCache()
+
+# A token per engine, so databases with equal versions never share entries
+_bind_tokens = weakref.WeakKeyDictionary()
+_next_token = itertools.count()
+# Statement cache key -> compiled SQL, shared by every entry of the same statement shape
+_compiled = {}
+
+
+def statement_tables(statement):
+    """Names of the tables a statement reads, subqueries and unions included"""
+    return frozenset(element.name for element in visitors.iterate(statement) if isinstance(element, Table))
+
+
+def _cacheable(orm_execute_state):
+    if cache.max_entries <= 0 or not orm_execute_state.is_select:
+        return False
+    if orm_execute_state.is_column_load or orm_execute_state.is_relationship_load:
+        return False
+    enabled = orm_execute_state.execution_options.get('query_cache')
+    if enabled is None:
+        enabled = orm_execute_state.session.info.get('read_only', False)
+    return enabled and getattr(orm_execute_state.statement, '_for_update_arg', None) is None
+
+
+def _session_versions(session, bind):
+    """Every table's version, read once per transaction of the session and per bind"""
+    loaded = session.info.setdefault('table_versions', {})
+    if bind not in loaded:
+        loaded[bind] = dict(session.connection(bind_arguments={'bind': bind}).execute(
+            select(DataVersion.table_name, DataVersion.version)).all())
+    return loaded[bind]
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _forget_versions(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('table_versions', None)
+
+
+def returns_entities(statement):
+    """Whether a statement loads ORM objects rather than plain rows"""
+    return any(description.get('entity') is not None and description['expr'] is description['entity']
+               for description in getattr(statement, 'column_descriptions', ()))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _cached_execute(orm_execute_state):
+    if not _cacheable(orm_execute_state):
+        return None
+    statement = orm_execute_state.statement
+    if returns_entities(statement):
+        return None
+    tables = statement_tables(statement)
+    if not tables or tables & UNCACHED_TABLES:
+        return None
+
+    session = orm_execute_state.session
+    bind = session.get_bind(**orm_execute_state.bind_arguments)
+    versions = _session_versions(session, bind)
+    if bind not in _bind_tokens:
+        _bind_tokens[bind] = next(_next_token)
+    # The SQL (compiled once per statement shape) with this run's parameter values
+    sql = statement._generate_cache_key().to_offline_string(
+        _compiled, statement, orm_execute_state.parameters or {})
+    key = (_bind_tokens[bind], sql, session.info.get('plant_id'),
+           tuple(sorted((name, versions.get(name, 0)) for name in tables)))
+
+    frozen = cache.get(key)
+    if frozen is None:
+        frozen = orm_execute_state.invoke_statement(bind_arguments={'bind': bind}).freeze()
+        cache.put(key, frozen)
+    return frozen()
+
+
+def stats():
+    return cache.stats()
@@ -0,0 +1,412 @@
+"""
+Edge-to-central delta replication
+
+Each plant runs its own (SQLite) instance of the app with
+REPLICATION_ROLE=edge. Head office runs one with REPLICATION_ROLE=central on
+Postgres. Plants push their new data to it as compressed changesets, so the
+consolidated reports never need a full database copy.
+
+What is shipped:
+- Append-only tables (production logs, attendance, downtime, inventory
+  movements): rows above a per-table id high-water mark.
+- Tables that are also updated (sections, items, workers, requisitions,
+  item stock): the current state of every row named in change_log since the
+  last change shipped. On an edge plant, every insert and update of those
+  tables is recorded in change_log in the same transaction (see models.py).
+  The first push sends these tables in full.
+
+Central keeps the marks per plant (replication_marks) and updates them in
+the transaction that applies the changeset. A push therefore starts by
+asking central where it stands, and an interrupted push just resumes from
+there. Rows get central ids of their own and the sending plant's plant_id.
+replication_keys maps each (plant, table, source id) to its central id, so
+re-applying a changeset updates rows instead of duplicating them, and
+foreign keys are translated on the way in.
+
+A changeset holds at most REPLICATION_BATCH_ROWS rows per table. Tables that
+depend on a truncated one wait for the next changeset, so references always
+resolve. Deletes are not replicated; archival on the edge does not remove
+history from central.
+
+Edge ids must be handed out in commit order, which SQLite's single writer
+guarantees.
+
+Usage on a plant (e.g. from cron every few minutes):
+    python replication.py push
+    python replication.py export changeset.bin   # offline: then upload it
+"""
+import argparse
+import json
+import os
+import zlib
+from datetime import date, datetime
+
+from sqlalchemy import Date, DateTime, bindparam, func, insert, select, update
+from models import (SessionLocal, Section, Item, Worker, Requisition, ItemStock, ProductionLog, Attendance,
+                    MachineDowntime, InventoryMovement, ChangeLog, ReplicationKey, ReplicationMark,
+                    CHANGE_TRACKED_TABLES, PLANT_ID, mark_days_changed, add_attendance_bits)
+from reports import rebuild_daily_stats
+
+REPLICATION_CENTRAL_URL = os.getenv("REPLICATION_CENTRAL_URL")
+REPLICATION_TOKEN = os.getenv("REPLICATION_TOKEN")
+REPLICATION_BATCH_ROWS = int(os.getenv("REPLICATION_BATCH_ROWS", "5000"))
+
+CHANGESET_FORMAT = 1
+# Mark name for the change_log position
+CHANGES = '_changes'
+
+# Dependency order: referenced tables first
+REPLICATED_MODELS = [Section, Item, Worker, Requisition, ItemStock,
+                     ProductionLog, Attendance, MachineDowntime, InventoryMovement]
+# Columns that refer to another table depending on the row's kind
+SOFT_REFERENCES = {
+    'inventory_movements': ('reference_id', 'kind', {'production': 'production_logs', 'requisition': 'requisitions'}),
+}
+# Lookup chunk size (SQLite bound parameter limits)
+IN_CHUNK = 500
+
+
+class ReplicationError(ValueError):
+    """The changeset cannot be applied (unknown format, gap, dangling reference)"""
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _chunks(values, size=IN_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _table_rows(table, rows):
+    columns = [column.name for column in table.columns]
+    return {"name": table.name, "columns": columns,
+            "rows": [[_json_value(row[name]) for name in columns] for row in rows]}
+
+
+def build_changeset(db, plant_id, marks, limit=REPLICATION_BATCH_ROWS):
+    """
+    Changeset with the rows central has not seen yet, given its marks
+
+    Returns (compressed bytes, more) where more says another changeset is
+    waiting, or (None, False) when there is nothing new.
+    """
+    tables = []
+    truncated = False
+    changes = {"since": marks.get(CHANGES)}
+
+    last_change = db.query(func.max(ChangeLog.id)).scalar() or 0
+    if changes["since"] is None:
+        # First push: the updatable tables in full, then changes after this point
+        changed = {model.__tablename__: None for model in REPLICATED_MODELS
+                   if model.__tablename__ in CHANGE_TRACKED_TABLES}
+        changes["upto"] = last_change
+    else:
+        entries = db.execute(
+            select(ChangeLog.id, ChangeLog.table_name, ChangeLog.row_id)
+            .where(ChangeLog.id > changes["since"]).order_by(ChangeLog.id).limit(limit)
+        ).all()
+        changed = {}
+        for _, name, row_id in entries:
+            changed.setdefault(name, set()).add(row_id)
+        changes["upto"] = entries[-1].id if entries else changes["since"]
+        truncated = len(entries) == limit
+
+    for model in REPLICATED_MODELS:
+        table = model.__table__
+        key = next(iter(table.primary_key.columns))
+        if table.name in CHANGE_TRACKED_TABLES:
+            if table.name not in changed:
+                continue
+            ids = changed[table.name]
+            if ids is None:
+                rows = db.execute(select(table).order_by(key)).mappings().all()
+            else:
+                rows = []
+                for chunk in _chunks(sorted(ids)):
+                    rows += db.execute(select(table).where(key.in_(chunk)).order_by(key)).mappings().all()
+            if rows:
+                tables.append(_table_rows(table, rows))
+            continue
+        if truncated:
+            # Rows here may refer to tracked rows that are not in this changeset
+            break
+        since = marks.get(table.name, 0)
+        rows = db.execute(select(table).where(key > since).order_by(key).limit(limit)).mappings().all()
+        if rows:
+            tables.append({**_table_rows(table, rows), "since": since, "upto": rows[-1][key.name]})
+            truncated = len(rows) == limit
+
+    if not tables and changes["upto"] == changes["since"]:
+        return None, False
+    payload = {"format": CHANGESET_FORMAT, "plant": plant_id, "changes": changes, "tables": tables}
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 6), truncated
+
+
+def read_changeset(blob):
+    try:
+        payload = json.loads(zlib.decompress(blob))
+    except (zlib.error, ValueError) as e:
+        raise ReplicationError(f"Not a changeset: {e}")
+    if payload.get("format") != CHANGESET_FORMAT:
+        raise ReplicationError(f"Unsupported changeset format: {payload.get('format')}")
+    return payload
+
+
+def get_marks(db, plant_id):
+    """{table_name: high_water} central has applied for a plant"""
+    return dict(db.execute(
+        select(ReplicationMark.table_name, ReplicationMark.high_water).where(ReplicationMark.plant_id == plant_id)
+    ).all())
+
+
+def _lookup(db, plant_id, table_name, source_ids):
+    """{source id: central id} for rows already replicated"""
+    found = {}
+    for chunk in _chunks(set(source_ids)):
+        found.update(db.execute(
+            select(ReplicationKey.source_id, ReplicationKey.central_id).where(
+                ReplicationKey.plant_id == plant_id, ReplicationKey.table_name == table_name,
+                ReplicationKey.source_id.in_(chunk))
+        ).all())
+    return found
+
+
+def _decode(table, columns, values):
+    row = dict(zip(columns, values))
+    for name, value in row.items():
+        if value is None or name not in table.c:
+            continue
+        column_type = table.c[name].type
+        if isinstance(column_type, DateTime):
+            row[name] = datetime.fromisoformat(value)
+        elif isinstance(column_type, Date):
+            row[name] = date.fromisoformat(value)
+    return row
+
+
+def _translate(db, plant_id, name, column, rows, targets):
+    """Replace source ids in `column` with central ids; targets gives each row's table"""
+    wanted = {}
+    for row, target in zip(rows, targets):
+        if row[column] is not None and target is not None:
+            wanted.setdefault(target, set()).add(row[column])
+    mapping = {target: _lookup(db, plant_id, target, ids) for target, ids in wanted.items()}
+    for row, target in zip(rows, targets):
+        if row[column] is None:
+            continue
+        if target is None or row[column] not in mapping[target]:
+            if name in SOFT_REFERENCES and column == SOFT_REFERENCES[name][0]:
+                row[column] = None  # e.g. the log was archived before the first push
+                continue
+            raise ReplicationError(f"{name}.{column} refers to unknown {target} row {row[column]}")
+        row[column] = mapping[target][row[column]]
+
+
+def _apply_table(db, plant_id, table, columns, values):
+    """Insert or update one table's rows; returns the rows in central terms"""
+    key = next(iter(table.primary_key.columns))
+    rows = [_decode(table, columns, row) for row in values]
+    source_ids = [row[key.name] for row in rows]
+    if 'plant_id' in table.c:
+        for row in rows:
+            row['plant_id'] = plant_id
+
+    self_references = []
+    for fk in table.foreign_keys:
+        target = fk.column.table.name
+        if target == table.name:
+            self_references.append(fk.parent.name)
+            continue
+        _translate(db, plant_id, table.name, fk.parent.name, rows, [target] * len(rows))
+    if table.name in SOFT_REFERENCES:
+        column, kind_column, kinds = SOFT_REFERENCES[table.name]
+        _translate(db, plant_id, table.name, column, rows, [kinds.get(row[kind_column]) for row in rows])
+    # Self references (next section) are set once every row of the batch has its central id
+    pending = {row[key.name]: {name: row.pop(name) for name in self_references} for row in rows}
+
+    if key.foreign_keys:
+        # Keyed by another table's row (item_stock by item): that row's central id is the key
+        existing = set()
+        for chunk in _chunks([row[key.name] for row in rows]):
+            existing.update(db.execute(select(key).where(key.in_(chunk))).scalars())
+        central_ids = {source: row[key.name] for source, row in zip(source_ids, rows)}
+        new = [row for row in rows if row[key.name] not in existing]
+        old = [row for row in rows if row[key.name] in existing]
+    else:
+        central_ids = _lookup(db, plant_id, table.name, source_ids)
+        new, old = [], []
+        for source, row in zip(source_ids, rows):
+            row.pop(key.name)
+            if source in central_ids:
+                old.append({**row, "_central_id": central_ids[source]})
+            else:
+                new.append((source, row))
+
+    if old:
+        if key.foreign_keys:
+            old = [{**row, "_central_id": row.pop(key.name)} for row in old]
+        db.execute(update(table).where(key == bindparam("_central_id")), old)
+    if new and key.foreign_keys:
+        db.execute(insert(table), new)
+    elif new:
+        inserted = db.execute(
+            insert(table).returning(key, sort_by_parameter_order=True), [row for _, row in new]
+        ).scalars().all()
+        db.execute(insert(ReplicationKey), [
+            {"plant_id": plant_id, "table_name": table.name, "source_id": source, "central_id": central_id}
+            for (source, _), central_id in zip(new, inserted)
+        ])
+        central_ids.update({source: central_id for (source, _), central_id in zip(new, inserted)})
+
+    for name in self_references:
+        targets = [{"_central_id": central_ids[source], name: refs[name]} for source, refs in pending.items()]
+        _translate(db, plant_id, table.name, name, targets, [table.name] * len(targets))
+        db.execute(update(table).where(key == bindparam("_central_id")), targets)
+    return rows
+
+
+def _set_mark(db, plant_id, table_name, high_water, current):
+    if table_name in current:
+        if high_water > current[table_name]:
+            db.execute(update(ReplicationMark).where(
+                ReplicationMark.plant_id == plant_id, ReplicationMark.table_name == table_name
+            ).values(high_water=high_water, applied_at=datetime.now()))
+    else:
+        db.add(ReplicationMark(plant_id=plant_id, table_name=table_name, high_water=high_water))
+    current[table_name] = max(high_water, current.get(table_name, high_water))
+
+
+def apply_changeset(db, blob, plant_id=None):
+    """
+    Apply a changeset in one transaction on central
+
+    Rows seen before are updated in place, so applying the same changeset
+    twice changes nothing. A changeset that starts past central's marks (a
+    gap), or comes from another plant than plant_id, is refused. Returns
+    {"plant", "applied": {table: rows}, "marks"}.
+    """
+    payload = read_changeset(blob)
+    if plant_id is not None and payload["plant"] != plant_id:
+        raise ReplicationError(f"Changeset is from plant {payload['plant']!r}, not {plant_id!r}")
+    plant_id = payload["plant"]
+    marks = get_marks(db, plant_id)
+    changes = payload["changes"]
+    if changes["since"] is not None and changes["since"] > marks.get(CHANGES, 0):
+        raise ReplicationError(f"Changes start after {changes['since']}, central has {marks.get(CHANGES, 0)}")
+    for entry in payload["tables"]:
+        if entry.get("since", 0) > marks.get(entry["name"], 0):
+            raise ReplicationError(f"{entry['name']} starts after id {entry['since']}, "
+                                   f"central has {marks.get(entry['name'], 0)}")
+
+    models = {model.__tablename__: model for model in REPLICATED_MODELS}
+    applied = {}
+    days = set()
+    try:
+        for entry in payload["tables"]:
+            model = models.get(entry["name"])
+            if model is None:
+                raise ReplicationError(f"Unknown table: {entry['name']}")
+            rows = _apply_table(db, plant_id, model.__table__, entry["columns"], entry["rows"])
+            applied[entry["name"]] = len(rows)
+            if model is ProductionLog:
+                days.update(row["date"] for row in rows)
+            elif model is Attendance:
+                add_attendance_bits(db.connection(), rows)
+            if "upto" in entry:
+                _set_mark(db, plant_id, entry["name"], entry["upto"], marks)
+        _set_mark(db, plant_id, CHANGES, changes["upto"], marks)
+
+        if days:
+            mark_days_changed(db.connection(), days)
+            rebuild_daily_stats(db, min(days), max(days))  # commits
+        else:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {"plant": plant_id, "applied": applied, "marks": marks}
+
+
+def prune_change_log(db, upto):
+    """Drop change_log entries central has applied"""
+    db.query(ChangeLog).filter(ChangeLog.id <= upto).delete(synchronize_session=False)
+    db.commit()
+
+
+class CentralClient:
+    """The central instance's replication API"""
+
+    def __init__(self, url=REPLICATION_CENTRAL_URL, token=REPLICATION_TOKEN, plant_id=PLANT_ID, timeout=60):
+        if not url:
+            raise ValueError("REPLICATION_CENTRAL_URL is not set")
+        self.url = url.rstrip('/')
+        self.token = token
+        self.plant_id = plant_id
+        self.timeout = timeout
+
+    def _request(self, path, data=None):
+        import urllib.request
+        request = urllib.request.Request(f"{self.url}{path}", data=data, headers={
+            "Authorization": f"Bearer {self.token}", "X-Plant-Id": self.plant_id,
+            "Content-Type": "application/octet-stream",
+        })
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def marks(self):
+        return self._request("/api/replication/marks")["marks"]
+
+    def send(self, blob):
+        return self._request("/api/replication/changesets", blob)["marks"]
+
+
+def push(db, central, limit=REPLICATION_BATCH_ROWS):
+    """
+    Send changesets until central is up to date
+
+    Returns (changesets sent, compressed bytes sent).
+    """
+    sent = size = 0
+    marks = central.marks()
+    while True:
+        blob, more = build_changeset(db, central.plant_id, marks, limit)
+        db.rollback()  # end the read transaction between changesets
+        if blob is None:
+            break
+        marks = central.send(blob)
+        sent += 1
+        size += len(blob)
+        if CHANGES in marks:
+            prune_change_log(db, marks[CHANGES])
+        if not more:
+            break
+    return sent, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ship this plant's new data to the central instance")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('push', help="send changesets to REPLICATION_CENTRAL_URL")
+    export = commands.add_parser('export', help="write the next changeset to a file (as if central had MARKS)")
+    export.add_argument('output')
+    export.add_argument('--marks', default='{}', help="central's marks as JSON, from GET /api/replication/marks")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == 'push':
+            sent, size = push(db, CentralClient())
+            print(f"Sent {sent} changesets ({size} bytes)")
+        else:
+            blob, more = build_changeset(db, PLANT_ID, json.loads(args.marks))
+            if blob is None:
+                print("Nothing to export")
+            else:
+                with open(args.output, 'wb') as f:
+                    f.write(blob)
+                print(f"Wrote {len(blob)} bytes to {args.output}" + (" (more to follow)" if more else ""))
+    finally:
+        db.close()
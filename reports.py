@@ -0,0 +1,212 @@
+"""
+Report queries backed by pre-aggregated tables and indexed keyset scans
+"""
+import base64
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, func, and_, or_, Float
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from models import ProductionLog, WorkerDailyStat, Worker, Section, MachineDowntime
+from archive import with_archive
+
+_STAT_FIELDS = ('target', 'actual', 'input_material', 'output_material', 'wastage', 'overtime_hours')
+
+LEADERBOARD_METRICS = ('efficiency', 'output', 'wastage')
+
+
+def add_to_daily_stats(db, log):
+    """
+    Fold one production log into its worker's daily aggregate row
+
+    Runs in the caller's transaction so the aggregate commits with the log.
+    """
+    key = and_(
+        WorkerDailyStat.worker_id == log.worker_id,
+        WorkerDailyStat.section_id == log.section_id,
+        WorkerDailyStat.date == log.date
+    )
+    increments = {field: getattr(WorkerDailyStat, field) + getattr(log, field) for field in _STAT_FIELDS}
+    increments['entries'] = WorkerDailyStat.entries + 1
+
+    if db.execute(update(WorkerDailyStat).where(key).values(**increments)).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(insert(WorkerDailyStat).values(
+                plant_id=log.plant_id,
+                worker_id=log.worker_id,
+                section_id=log.section_id,
+                date=log.date,
+                entries=1,
+                **{field: getattr(log, field) for field in _STAT_FIELDS}
+            ))
+    except IntegrityError:
+        # Another request created the row first
+        db.execute(update(WorkerDailyStat).where(key).values(**increments))
+
+
+def rebuild_daily_stats(db, start, end):
+    """
+    Recompute the daily aggregates for a date range from production_logs
+
+    A plant-scoped session rebuilds its own plant only.
+    """
+    db.execute(delete(WorkerDailyStat).where(WorkerDailyStat.date.between(start, end)))
+    columns = [ProductionLog.plant_id, ProductionLog.worker_id, ProductionLog.section_id, ProductionLog.date, func.count()]
+    columns += [func.sum(getattr(ProductionLog, field)) for field in _STAT_FIELDS]
+    logs = select(*columns).where(ProductionLog.date.between(start, end))
+    if db.info.get('plant_id') is not None:
+        # INSERT ... SELECT is not scoped automatically
+        logs = logs.where(ProductionLog.plant_id == db.info['plant_id'])
+    db.execute(insert(WorkerDailyStat).from_select(
+        ['plant_id', 'worker_id', 'section_id', 'date', 'entries'] + list(_STAT_FIELDS),
+        logs.group_by(ProductionLog.plant_id, ProductionLog.worker_id, ProductionLog.section_id, ProductionLog.date)
+    ))
+    db.commit()
+
+
+def leaderboard(db, start, end, metric='efficiency', section_id=None, limit=None):
+    """
+    Rank workers over a period in a single query
+
+    Workers are ranked within their section and across the plant by
+    efficiency (actual / target), output (total actual) or wastage
+    (% of input, lower is better).
+    """
+    if metric not in LEADERBOARD_METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+
+    totals = select(
+        WorkerDailyStat.worker_id,
+        WorkerDailyStat.section_id,
+        func.sum(WorkerDailyStat.target).label('target'),
+        func.sum(WorkerDailyStat.actual).label('actual'),
+        func.sum(WorkerDailyStat.input_material).label('input_material'),
+        func.sum(WorkerDailyStat.wastage).label('wastage'),
+        func.sum(WorkerDailyStat.overtime_hours).label('overtime_hours')
+    ).where(WorkerDailyStat.date.between(start, end))
+    if section_id is not None:
+        totals = totals.where(WorkerDailyStat.section_id == section_id)
+    totals = totals.group_by(WorkerDailyStat.worker_id, WorkerDailyStat.section_id).subquery()
+
+    efficiency = totals.c.actual * 100.0 / func.nullif(totals.c.target, 0)
+    wastage_pct = totals.c.wastage * 100.0 / func.nullif(totals.c.input_material, 0)
+    order = {
+        'efficiency': efficiency.desc().nulls_last(),
+        'output': totals.c.actual.desc(),
+        'wastage': wastage_pct.asc().nulls_last()
+    }[metric]
+
+    query = select(
+        totals.c.worker_id,
+        Worker.name.label('worker_name'),
+        totals.c.section_id,
+        Section.name.label('section_name'),
+        totals.c.target,
+        totals.c.actual,
+        totals.c.wastage,
+        totals.c.overtime_hours,
+        efficiency.label('efficiency'),
+        wastage_pct.label('wastage_pct'),
+        func.rank().over(partition_by=totals.c.section_id, order_by=order).label('section_rank'),
+        func.rank().over(order_by=order).label('overall_rank')
+    ).join(Worker, Worker.id == totals.c.worker_id).outerjoin(
+        Section, Section.id == totals.c.section_id
+    ).order_by('overall_rank', totals.c.worker_id)
+    if limit:
+        query = query.limit(limit)
+
+    return db.execute(query).all()
+
+
+class hours_between(FunctionElement):
+    """Hours between two timestamps, computed by the database"""
+    type = Float()
+    name = 'hours_between'
+    inherit_cache = True
+
+
+@compiles(hours_between)
+def _hours_between_default(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return "(EXTRACT(EPOCH FROM (%s - %s)) / 3600.0)" % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+
+@compiles(hours_between, 'sqlite')
+def _hours_between_sqlite(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return "((julianday(%s) - julianday(%s)) * 24.0)" % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+
+def encode_cursor(start_time, record_id):
+    return base64.urlsafe_b64encode(f"{start_time.isoformat()}|{record_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    start_time, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(start_time), int(record_id)
+
+
+def downtime_page(db, section_id=None, machine=None, start=None, end=None, min_hours=None, cursor=None, limit=20):
+    """
+    One page of downtime records, newest start_time first
+
+    Pages are addressed by an opaque cursor holding the last (start_time, id)
+    seen, so each page is an index range scan rather than an OFFSET.
+    `start` and `end` are inclusive dates. Archived records are included
+    when the range reaches back past the archive watermark.
+    """
+    downtime = with_archive(db, MachineDowntime, start).c
+    duration = hours_between(downtime.start_time, downtime.end_time)
+    query = select(
+        downtime.id,
+        downtime.section_id,
+        downtime.machine_name,
+        downtime.start_time,
+        downtime.end_time,
+        downtime.remarks,
+        duration.label('duration_hours')
+    )
+    if section_id is not None:
+        query = query.where(downtime.section_id == section_id)
+    if machine:
+        query = query.where(downtime.machine_name == machine)
+    if start is not None:
+        query = query.where(downtime.start_time >= datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        query = query.where(downtime.start_time < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    if min_hours is not None:
+        query = query.where(duration >= min_hours)
+    if cursor:
+        last_start, last_id = decode_cursor(cursor)
+        query = query.where(or_(
+            downtime.start_time < last_start,
+            and_(downtime.start_time == last_start, downtime.id < last_id)
+        ))
+
+    rows = db.execute(
+        query.order_by(downtime.start_time.desc(), downtime.id.desc()).limit(limit + 1)
+    ).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].start_time, rows[-1].id)
+    return rows, next_cursor
+
+
+if __name__ == "__main__":
+    # Backfill or repair worker_daily_stats, e.g. after a bulk import:
+    # python reports.py 2024-01-01 2024-01-31
+    import sys
+    from datetime import date
+    from models import SessionLocal
+
+    start = date.fromisoformat(sys.argv[1])
+    end = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else date.today()
+    db = SessionLocal()
+    try:
+        rebuild_daily_stats(db, start, end)
+        print(f"Daily stats rebuilt for {start} to {end}")
+    finally:
+        db.close()
@@ -0,0 +1,195 @@
+"""
+Requisition workflow: paginated pending queues, bulk approve/reject and
+stock reservation on approval
+
+Status flow: pending -> approved (stock reserved) -> issued (reservation
+consumed, stock leaves the central store) or cancelled (reservation
+released); pending -> rejected.
+"""
+from collections import OrderedDict
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload
+from models import Requisition, ItemStock
+from inventory import record_movement, record_movements
+
+
+def _pending_query(db, ids=None, section_id=None, item_id=None, status='pending'):
+    query = db.query(Requisition).filter(Requisition.status == status)
+    if ids is not None:
+        query = query.filter(Requisition.id.in_(ids))
+    if section_id is not None:
+        query = query.filter(Requisition.section_id == section_id)
+    if item_id is not None:
+        query = query.filter(Requisition.item_id == item_id)
+    return query
+
+
+def pending_requisitions(db, section_id=None, page=1, per_page=50):
+    """
+    One page of the pending queue, oldest first
+    """
+    page = max(int(page), 1)
+    per_page = min(max(int(per_page), 1), 500)
+    query = _pending_query(db, section_id=section_id)
+    total = query.count()
+    requisitions = query.options(
+        joinedload(Requisition.item), joinedload(Requisition.section)
+    ).order_by(Requisition.created_at, Requisition.id).offset((page - 1) * per_page).limit(per_page).all()
+    return {
+        "requisitions": requisitions,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "pages": (total + per_page - 1) // per_page
+    }
+
+
+def reject_requisitions(db, ids=None, section_id=None, item_id=None, remarks=''):
+    """
+    Reject every matching pending requisition in a single UPDATE
+    """
+    rejected = _pending_query(db, ids, section_id, item_id).update(
+        {Requisition.status: 'rejected', Requisition.remarks: remarks},
+        synchronize_session=False
+    )
+    db.commit()
+    return {"approved": [], "rejected": rejected, "insufficient_stock": []}
+
+
+def approve_requisitions(db, ids=None, section_id=None, item_id=None, remarks=''):
+    """
+    Approve matching pending requisitions, reserving stock for tracked items
+
+    Requisitions are allocated oldest first per item. Those that do not fit
+    in the available (on hand - reserved) quantity stay pending and are
+    reported back. Items without an item_stock row are not stock-tracked and
+    are approved without a reservation.
+    """
+    pending = _pending_query(db, ids, section_id, item_id).with_entities(
+        Requisition.id, Requisition.item_id, Requisition.section_id, Requisition.quantity
+    ).order_by(Requisition.created_at, Requisition.id).with_for_update().all()
+    if not pending:
+        return {"approved": [], "rejected": 0, "insufficient_stock": []}
+
+    by_item = OrderedDict()
+    for req in pending:
+        by_item.setdefault(req.item_id, []).append(req)
+
+    stock = {
+        s.item_id: s for s in db.query(ItemStock).filter(
+            ItemStock.item_id.in_(list(by_item))
+        ).with_for_update().all()
+    }
+
+    approved, insufficient = [], []
+    for item, reqs in by_item.items():
+        if item not in stock:
+            approved.extend(r.id for r in reqs)
+            continue
+
+        available = stock[item].on_hand - stock[item].reserved
+        fitting, total = [], 0
+        for req in reqs:
+            if total + req.quantity <= available:
+                fitting.append(req.id)
+                total += req.quantity
+            else:
+                insufficient.append(req.id)
+        if not fitting:
+            continue
+
+        # Guarded increment so a concurrent reservation can never overdraw stock
+        reserved = db.execute(
+            update(ItemStock)
+            .where(ItemStock.item_id == item, ItemStock.on_hand - ItemStock.reserved >= total)
+            .values(reserved=ItemStock.reserved + total)
+        ).rowcount
+        if reserved:
+            approved.extend(fitting)
+        else:
+            insufficient.extend(fitting)
+
+    if approved:
+        db.query(Requisition).filter(
+            Requisition.id.in_(approved), Requisition.status == 'pending'
+        ).update(
+            {Requisition.status: 'approved', Requisition.remarks: remarks},
+            synchronize_session=False
+        )
+    db.commit()
+    return {"approved": approved, "rejected": 0, "insufficient_stock": insufficient}
+
+
+def _settle_approved(db, ids, section_id, item_id, status):
+    """Move approved requisitions to `status`, giving back their reservations"""
+    approved = _pending_query(db, ids, section_id, item_id, status='approved').with_entities(
+        Requisition.id, Requisition.item_id, Requisition.section_id, Requisition.quantity
+    ).order_by(Requisition.id).with_for_update().all()
+    if not approved:
+        return []
+
+    totals = {}
+    for req in approved:
+        totals[req.item_id] = totals.get(req.item_id, 0) + req.quantity
+    tracked = {
+        row.item_id for row in db.query(ItemStock.item_id).filter(ItemStock.item_id.in_(list(totals)))
+    }
+    issued = status == 'issued'
+    for item, total in totals.items():
+        if item not in tracked:
+            continue
+        values = {"reserved": ItemStock.reserved - total}
+        if issued:
+            values["on_hand"] = ItemStock.on_hand - total
+        db.execute(update(ItemStock).where(ItemStock.item_id == item).values(**values))
+
+    if issued:
+        # Issued quantity moves from the central store to the requesting section;
+        # untracked items never had a central-store balance to draw from
+        movements = []
+        for req in approved:
+            if req.item_id in tracked:
+                movements.append({"item_id": req.item_id, "section_id": None, "quantity": -req.quantity,
+                                  "kind": "requisition", "reference_id": req.id})
+            movements.append({"item_id": req.item_id, "section_id": req.section_id, "quantity": req.quantity,
+                              "kind": "requisition", "reference_id": req.id})
+        record_movements(db, movements)
+
+    ids_done = [req.id for req in approved]
+    db.query(Requisition).filter(Requisition.id.in_(ids_done)).update(
+        {Requisition.status: status}, synchronize_session=False
+    )
+    db.commit()
+    return ids_done
+
+
+def issue_requisitions(db, ids=None, section_id=None, item_id=None):
+    """
+    Hand out approved requisitions, consuming their reservations
+
+    Returns the ids issued.
+    """
+    return _settle_approved(db, ids, section_id, item_id, 'issued')
+
+
+def cancel_requisitions(db, ids=None, section_id=None, item_id=None):
+    """
+    Cancel approved requisitions that will not be issued, releasing their reservations
+
+    Returns the ids cancelled.
+    """
+    return _settle_approved(db, ids, section_id, item_id, 'cancelled')
+
+
+def receive_stock(db, item_id, quantity):
+    """
+    Add received quantity to an item's stock, starting to track it if needed
+    """
+    stock = db.query(ItemStock).filter(ItemStock.item_id == item_id).with_for_update().first()
+    if stock is None:
+        stock = ItemStock(item_id=item_id, on_hand=0, reserved=0)
+        db.add(stock)
+    stock.on_hand += quantity
+    record_movement(db, item_id, None, quantity, 'receipt')
+    db.commit()
+    return stock
@@ -0,0 +1,310 @@
+"""
+Declarative schemas for request payloads
+
+Each payload is declared once as a Schema: its fields, how each one is
+coerced, and any checks that span several fields. `Schema.compile()` turns
+the declaration into a validator that parses and coerces every field in a
+single pass and returns a typed, immutable record (a namedtuple) that routes
+use directly, so dates are parsed once and numbers converted once.
+
+Invalid payloads raise ValidationError carrying the full list of problems.
+"""
+from collections import namedtuple
+from datetime import date, datetime
+
+
+class ValidationError(ValueError):
+    """A payload failed validation; `errors` lists every problem found"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class Field:
+    """
+    One payload field
+
+    `coerce(value, today)` returns the typed value or raises ValueError with
+    a user-facing message. Missing values (None or '') never reach it.
+    """
+
+    def __init__(self, required=True, default=None, required_error=None):
+        self.required = required
+        self.default = default
+        self.required_error = required_error
+
+    def bind(self, name):
+        self.name = name
+        if self.required_error is None:
+            self.required_error = f"Field '{name}' is required"
+        return self
+
+    def coerce(self, value, today):
+        return value
+
+
+class Int(Field):
+    def __init__(self, min=None, min_error=None, format_error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.min = min
+        self.min_error = min_error
+        self.format_error = format_error
+
+    def coerce(self, value, today):
+        if type(value) is not int:
+            if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+                raise ValueError(self.format_error or f"Field '{self.name}' must be a whole number")
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(self.format_error or f"Field '{self.name}' must be a whole number")
+        if self.min is not None and value < self.min:
+            raise ValueError(self.min_error or f"Field '{self.name}' must be at least {self.min}")
+        return value
+
+
+class Float(Field):
+    def __init__(self, min=None, min_error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.min = min
+        self.min_error = min_error
+
+    def coerce(self, value, today):
+        if type(value) is not float:
+            if isinstance(value, bool):
+                raise ValueError(f"Field '{self.name}' must be a number")
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Field '{self.name}' must be a number")
+        if value != value or value in (float('inf'), float('-inf')):
+            raise ValueError(f"Field '{self.name}' must be a number")
+        if self.min is not None and value < self.min:
+            raise ValueError(self.min_error or f"Field '{self.name}' must be at least {self.min}")
+        return value
+
+
+class Str(Field):
+    def __init__(self, max_length=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_length = max_length
+
+    def coerce(self, value, today):
+        if not isinstance(value, str):
+            raise ValueError(f"Field '{self.name}' must be text")
+        value = value.strip()
+        if not value and self.required:
+            raise ValueError(self.required_error)
+        if self.max_length is not None and len(value) > self.max_length:
+            raise ValueError(f"Field '{self.name}' must be at most {self.max_length} characters")
+        return value
+
+
+class Bool(Field):
+    """true/false, also yes/no, y/n and 1/0 as sent by forms and spreadsheets"""
+
+    TRUE = {'true', 'yes', 'y', '1'}
+    FALSE = {'false', 'no', 'n', '0'}
+
+    def coerce(self, value, today):
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in self.TRUE:
+            return True
+        if text in self.FALSE:
+            return False
+        raise ValueError(f"Field '{self.name}' must be yes or no")
+
+
+class Date(Field):
+    """YYYY-MM-DD; with `not_past`, dates before today are rejected"""
+
+    def __init__(self, not_past=False, past_error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.not_past = not_past
+        self.past_error = past_error
+
+    def coerce(self, value, today):
+        if isinstance(value, datetime):
+            value = value.date()
+        elif not isinstance(value, date):
+            if not isinstance(value, str) or len(value) != 10:
+                raise ValueError(f"Field '{self.name}' must be a date (YYYY-MM-DD)")
+            try:
+                value = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"Field '{self.name}' must be a date (YYYY-MM-DD)")
+        if self.not_past and value < today:
+            raise ValueError(self.past_error or f"Field '{self.name}' cannot be in the past")
+        return value
+
+
+class DateTime(Field):
+    """YYYY-MM-DDTHH:MM (what <input type="datetime-local"> sends)"""
+
+    def __init__(self, not_past=False, past_error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.not_past = not_past
+        self.past_error = past_error
+
+    def coerce(self, value, today):
+        if not isinstance(value, datetime):
+            if not isinstance(value, str) or len(value) != 16 or value[10] != 'T':
+                raise ValueError(f"Field '{self.name}' must be a date and time (YYYY-MM-DDTHH:MM)")
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"Field '{self.name}' must be a date and time (YYYY-MM-DDTHH:MM)")
+        if self.not_past and value.date() < today:
+            raise ValueError(self.past_error or f"Field '{self.name}' cannot be in the past")
+        return value
+
+
+class List(Field):
+    """A list of values of one field type, returned as a tuple"""
+
+    def __init__(self, item, min_items=0, empty_error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.item = item
+        self.min_items = min_items
+        self.empty_error = empty_error
+
+    def bind(self, name):
+        super().bind(name)
+        self.item.bind(name)
+        return self
+
+    def coerce(self, value, today):
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f"Field '{self.name}' must be a list")
+        if len(value) < self.min_items:
+            raise ValueError(self.empty_error or f"Field '{self.name}' needs at least {self.min_items} entries")
+        coerce = self.item.coerce
+        return tuple(coerce(item, today) for item in value)
+
+
+class Schema:
+    """
+    A payload declaration
+
+    `fields` maps payload keys to Field instances (in output order); `checks`
+    are functions taking the typed record and returning an error message or
+    None. They only run once every field has parsed.
+    """
+
+    def __init__(self, name, fields, checks=()):
+        self.name = name
+        self.fields = {key: field.bind(key) for key, field in fields.items()}
+        self.checks = tuple(checks)
+        self.record = namedtuple(name, list(self.fields))
+        self._plan = None
+
+    def compile(self):
+        """Build the single-pass validator (done once, on first use)"""
+        if self._plan is None:
+            self._plan = tuple(
+                (key, field.required, field.default, field.required_error, field.coerce)
+                for key, field in self.fields.items()
+            )
+        return self
+
+    def validate(self, data, today=None):
+        """Typed record for `data`, or ValidationError listing every problem"""
+        plan = self._plan or self.compile()._plan
+        if not isinstance(data, dict):
+            raise ValidationError(["Request body must be a JSON object"])
+        if today is None:
+            today = date.today()
+
+        errors = []
+        values = []
+        append = values.append
+        get = data.get
+        for key, required, default, required_error, coerce in plan:
+            value = get(key)
+            if value is None or value == '':
+                if required:
+                    errors.append(required_error)
+                append(default)
+                continue
+            try:
+                append(coerce(value, today))
+            except ValueError as e:
+                errors.append(str(e))
+                append(None)
+        if errors:
+            raise ValidationError(errors)
+
+        record = self.record._make(values)
+        for check in self.checks:
+            error = check(record)
+            if error:
+                errors.append(error)
+        if errors:
+            raise ValidationError(errors)
+        return record
+
+    def validate_many(self, rows, today=None):
+        """
+        Validate a batch of payloads
+
+        Returns (records, rejected) where rejected is a list of
+        (index, errors) for rows that failed; valid rows are still returned.
+        """
+        today = today or date.today()
+        validate = self.validate
+        records, rejected = [], []
+        for index, row in enumerate(rows):
+            try:
+                records.append(validate(row, today))
+            except ValidationError as e:
+                rejected.append((index, e.errors))
+        return records, rejected
+
+
+def output_within_input(entry):
+    if entry.output_material > entry.input_material:
+        return f"Output material ({entry.output_material}kg) cannot exceed input material ({entry.input_material}kg)"
+
+
+def _end_after_start(entry):
+    if entry.start_time >= entry.end_time:
+        return "End time must be after start time"
+    # A reasonable downtime is at most one day
+    if (entry.end_time - entry.start_time).total_seconds() > 24 * 3600:
+        return "Downtime duration cannot exceed 24 hours"
+
+
+BACKDATING_ERROR = "Cannot backdate entries. Date must be today or future."
+
+ProductionEntry = Schema('ProductionEntry', {
+    'worker_id': Int(min=1, min_error="Invalid worker ID"),
+    'item_id': Int(min=1, min_error="Invalid item ID"),
+    'date': Date(not_past=True, past_error=BACKDATING_ERROR),
+    'actual': Int(min=0, min_error="Actual production cannot be negative"),
+    'input_material': Float(min=0, min_error="Input material cannot be negative"),
+    'output_material': Float(min=0, min_error="Output material cannot be negative"),
+}, checks=[output_within_input]).compile()
+
+AttendanceEntry = Schema('AttendanceEntry', {
+    'workers': List(
+        Int(min=1, min_error="Invalid worker ID", format_error="Invalid worker ID format"),
+        min_items=1, empty_error="At least one worker must be selected",
+        required_error="At least one worker must be selected"
+    ),
+    'date': Date(not_past=True, past_error=BACKDATING_ERROR, required_error="Date is required"),
+}).compile()
+
+DowntimeEntry = Schema('DowntimeEntry', {
+    'machine_name': Str(),
+    'start_time': DateTime(not_past=True, past_error="Cannot backdate downtime entries"),
+    'end_time': DateTime(),
+    'remarks': Str(required=False, default=''),
+}, checks=[_end_after_start]).compile()
+
+RequisitionEntry = Schema('RequisitionEntry', {
+    'item_id': Int(min=1, min_error="Invalid item ID"),
+    'quantity': Int(min=1, min_error="Quantity must be greater than 0", format_error="Invalid quantity format"),
+}).compile()
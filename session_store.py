@@ -0,0 +1,225 @@
+"""
+Server-side session storage
+
+The default Flask session keeps the whole session (user, metadata, role and
+access token) in a signed cookie that is sent with every request. With the
+server-side backend the cookie only carries an opaque session id and the
+session data lives in a local SQLite file, fronted by a small in-memory LRU.
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it was modified"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.rotated_from = None
+
+    def regenerate(self):
+        """Drop the current data and move to a fresh id (call on login)"""
+        if self.rotated_from is None:
+            self.rotated_from = self.sid
+        self.clear()
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class SQLiteSessionStore:
+    """Session records persisted in a local SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)")
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid, now=None):
+        now = now or time.time()
+        row = self._connection().execute(
+            "SELECT data, expires_at FROM sessions WHERE sid = ?", (sid,)
+        ).fetchone()
+        if not row or row[1] <= now:
+            return None
+        return row[0], row[1]
+
+    def set(self, sid, data, expires_at):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+            (sid, data, expires_at)
+        )
+        conn.commit()
+
+    def delete(self, sid):
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        conn.commit()
+
+    def sweep(self, now=None):
+        """Delete expired sessions, returns the number removed"""
+        conn = self._connection()
+        cursor = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now or time.time(),))
+        conn.commit()
+        return cursor.rowcount
+
+
+class LRUSessionCache:
+    """Small in-memory front for the session store
+
+    Entries are only trusted for `ttl` seconds so that a logout handled by
+    another worker process is picked up quickly.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid, now=None):
+        now = now or time.time()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            data, expires_at, cached_at = entry
+            if expires_at <= now or cached_at + self.ttl <= now:
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return data, expires_at
+
+    def put(self, sid, data, expires_at, now=None):
+        with self._lock:
+            self._entries[sid] = (data, expires_at, now or time.time())
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface keeping only an opaque id in the cookie"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, cache=None, sweep_interval=300):
+        self.store = store
+        self.cache = cache if cache is not None else LRUSessionCache()
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0
+
+    def _load(self, sid):
+        record = self.cache.get(sid)
+        if record is None:
+            record = self.store.get(sid)
+            if record is None:
+                return None
+            self.cache.put(sid, *record)
+        return self.serializer.loads(record[0])
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self._load(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.rotated_from:
+            # The pre-login id must not stay usable
+            self.cache.discard(session.rotated_from)
+            self.store.delete(session.rotated_from)
+
+        if not session:
+            if session.modified:
+                self.cache.discard(session.sid)
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        expires_at = now + app.permanent_session_lifetime.total_seconds()
+        if session.modified or session.new:
+            data = self.serializer.dumps(dict(session))
+            self.store.set(session.sid, data, expires_at)
+            self.cache.put(session.sid, data, expires_at, now)
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+        if now - self._last_sweep > self.sweep_interval:
+            self._last_sweep = now
+            self.store.sweep(now)
+
+
+def regenerate_session(session):
+    """
+    Start a fresh session, e.g. before storing the user on login
+
+    Server-side sessions also get a new id and the old record is deleted, so
+    an id handed out before login can never become an authenticated session.
+    """
+    if isinstance(session, ServerSession):
+        session.regenerate()
+    else:
+        session.clear()
+
+
+def create_session_interface():
+    """Build the session interface selected by SESSION_BACKEND, or None for cookies"""
+    backend = os.getenv('SESSION_BACKEND', 'cookie').lower()
+    if backend == 'cookie':
+        return None
+    if backend == 'sqlite':
+        store = SQLiteSessionStore(os.getenv('SESSION_DB_PATH', './sessions.db'))
+        cache = LRUSessionCache(
+            max_entries=int(os.getenv('SESSION_CACHE_SIZE', '1024')),
+            ttl=int(os.getenv('SESSION_CACHE_TTL', '30'))
+        )
+        return ServerSessionInterface(store, cache, sweep_interval=int(os.getenv('SESSION_SWEEP_INTERVAL', '300')))
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
@@ -0,0 +1,82 @@
+"""
+SQLite profile for single-box plant deployments
+
+Smaller plants run the app on a LAN box against a SQLite file, often with
+several gunicorn workers. With SQLite's defaults (rollback journal, deferred
+transactions) readers and writers block each other and a read transaction
+that later writes fails with "database is locked". This profile sets up:
+
+- WAL journal, so readers never block the writer and vice versa, plus
+  tuned pragmas (synchronous=NORMAL, a larger page cache, mmap, in-memory
+  temp tables) and a busy timeout.
+- One writer connection per process. Request threads queue for it in the
+  pool instead of racing, and it starts every transaction with BEGIN
+  IMMEDIATE, so the write lock is taken up front and waiting for another
+  process's writer goes through the busy timeout rather than failing.
+- A pool of query-only connections for read sessions (get_read_db).
+
+synchronous=NORMAL with WAL cannot corrupt the database; a power cut may
+lose the last few commits.
+"""
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "edge").lower()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+
+
+def is_sqlite_file(url):
+    """True for SQLite URLs backed by a file (not in-memory databases)"""
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') \
+        and not url.database.startswith('file::memory:')
+
+
+def pragmas(read_only=False):
+    statements = [
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA synchronous = NORMAL",
+        f"PRAGMA cache_size = -{SQLITE_CACHE_MB * 1024}",
+        f"PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if read_only:
+        statements.append("PRAGMA query_only = ON")
+    else:
+        # Stored in the database file; only the writer needs to set it
+        statements.insert(0, "PRAGMA journal_mode = WAL")
+    return statements
+
+
+def _configure(engine, read_only):
+    begin = "BEGIN" if read_only else "BEGIN IMMEDIATE"
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself instead of pysqlite's implicit one
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for statement in pragmas(read_only):
+            cursor.execute(statement)
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin_transaction(connection):
+        connection.exec_driver_sql(begin)
+
+    return engine
+
+
+def create_engines(url, read_pool_size=SQLITE_READ_POOL_SIZE):
+    """(writer engine, reader engine) for a SQLite file"""
+    connect_args = {'check_same_thread': False}
+    timeout = SQLITE_BUSY_TIMEOUT_MS / 1000
+    writer = create_engine(url, connect_args=connect_args, pool_size=1, max_overflow=0, pool_timeout=timeout)
+    reader = create_engine(url, connect_args=connect_args, pool_size=read_pool_size, max_overflow=0,
+                           pool_timeout=timeout)
+    return _configure(writer, read_only=False), _configure(reader, read_only=True)
@@ -18,6 +18,43 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+// Report GETs are conditional: the last response and its ETag are kept per
+// URL for the browser session, and a 304 from the server reuses that copy.
+// A 503 (reports shed under load) is retried after its Retry-After.
+const REPORT_CACHE_PREFIX = 'report-cache:';
+const REPORT_RETRIES = 3;
+
+function fetchJSON(url, retries = REPORT_RETRIES) {
+    let cached = null;
+    try {
+        cached = JSON.parse(sessionStorage.getItem(REPORT_CACHE_PREFIX + url));
+    } catch (e) {
+        cached = null;
+    }
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    return fetch(url, { headers: headers, cache: 'no-store' }).then(response => {
+        if (response.status === 304 && cached) {
+            return cached.data;
+        }
+        if (response.status === 503 && retries > 0) {
+            const seconds = parseInt(response.headers.get('Retry-After'), 10) || 5;
+            const delay = (seconds + Math.random()) * 1000;
+            return new Promise(resolve => setTimeout(resolve, delay)).then(() => fetchJSON(url, retries - 1));
+        }
+        return response.json().then(data => {
+            const etag = response.headers.get('ETag');
+            if (response.ok && etag) {
+                try {
+                    sessionStorage.setItem(REPORT_CACHE_PREFIX + url, JSON.stringify({ etag: etag, data: data }));
+                } catch (e) {
+                    // Storage full or disabled: just skip caching
+                }
+            }
+            return data;
+        });
+    });
+}
+
 function checkAuthStatus() {
     // Check for stored auth token
     const token = localStorage.getItem('authToken');
@@ -227,8 +264,7 @@ function initializeCharts() {
     // Production Chart
     const productionCtx = document.getElementById('productionChart');
     if (productionCtx) {
-        fetch('/api/reports/production')
-            .then(response => response.json())
+        fetchJSON('/api/reports/production')
             .then(data => {
                 new Chart(productionCtx, {
                     type: 'bar',
@@ -276,8 +312,7 @@ function formatTime(time) {
 }
 
 function showWorkerHistory(workerId) {
-    fetch(`/api/worker_history/${workerId}`)
-        .then(response => response.json())
+    fetchJSON(`/api/worker_history/${workerId}`)
         .then(data => {
             // Create modal or popup to show worker history
             const modal = document.createElement('div');
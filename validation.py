@@ -1,13 +1,14 @@
 from datetime import datetime, date
 from models import SessionLocal, ProductionLog, Section
 from sqlalchemy import func
+from schemas import ValidationError, ProductionEntry, AttendanceEntry, DowntimeEntry, RequisitionEntry
 
 def validate_material_flow(section_id, output_material, entry_date, db=None):
     """
     Validate material flow between sections
     Ensures that output from one section doesn't exceed available input
     """
-    if not db:
+    if db is None:
         db = SessionLocal()
         close_db = True
     else:
@@ -65,159 +66,36 @@ def validate_no_backdating(entry_date):
     
     return {"valid": True}
 
-def validate_production_data(data):
-    """
-    Comprehensive validation for production data
-    """
-    errors = []
-    
-    # Required fields
-    required_fields = ['worker_id', 'item_id', 'date', 'actual', 'input_material', 'output_material']
-    for field in required_fields:
-        if field not in data or data[field] is None or data[field] == '':
-            errors.append(f"Field '{field}' is required")
-    
-    if errors:
-        return {"valid": False, "errors": errors}
-    
+def _validate(schema, data):
+    """Run a compiled schema, returning the {"valid", "errors", "entry"} shape"""
     try:
-        # Validate data types and ranges
-        actual = int(data['actual'])
-        input_material = float(data['input_material'])
-        output_material = float(data['output_material'])
-        
-        if actual < 0:
-            errors.append("Actual production cannot be negative")
-        
-        if input_material < 0:
-            errors.append("Input material cannot be negative")
-        
-        if output_material < 0:
-            errors.append("Output material cannot be negative")
-        
-        if output_material > input_material:
-            errors.append(f"Output material ({output_material}kg) cannot exceed input material ({input_material}kg)")
-        
-        # Validate date
-        date_validation = validate_no_backdating(data['date'])
-        if not date_validation['valid']:
-            errors.append(date_validation['error'])
-        
-        if errors:
-            return {"valid": False, "errors": errors}
-        
-        return {"valid": True}
-        
-    except ValueError as e:
-        errors.append(f"Invalid data format: {str(e)}")
-        return {"valid": False, "errors": errors}
+        return {"valid": True, "entry": schema.validate(data)}
+    except ValidationError as e:
+        return {"valid": False, "errors": e.errors}
+
+# The payload rules live in schemas.py; these wrappers keep the older dict results
+def validate_production_data(data):
+    return _validate(ProductionEntry, data)
 
 def validate_attendance_data(data):
-    """
-    Validate attendance data
-    """
-    errors = []
-    
-    # Required fields
-    if 'workers' not in data or not data['workers']:
-        errors.append("At least one worker must be selected")
-    
-    if 'date' not in data:
-        errors.append("Date is required")
-    
-    if errors:
-        return {"valid": False, "errors": errors}
-    
-    # Validate date
-    date_validation = validate_no_backdating(data['date'])
-    if not date_validation['valid']:
-        errors.append(date_validation['error'])
-    
-    # Validate worker IDs
-    try:
-        worker_ids = [int(w) for w in data['workers']]
-        if any(w <= 0 for w in worker_ids):
-            errors.append("Invalid worker ID")
-    except ValueError:
-        errors.append("Invalid worker ID format")
-    
-    if errors:
-        return {"valid": False, "errors": errors}
-    
-    return {"valid": True}
+    return _validate(AttendanceEntry, data)
 
 def validate_downtime_data(data):
-    """
-    Validate machine downtime data
-    """
-    errors = []
-    
-    # Required fields
-    required_fields = ['machine_name', 'start_time', 'end_time']
-    for field in required_fields:
-        if field not in data or not data[field]:
-            errors.append(f"Field '{field}' is required")
-    
-    if errors:
-        return {"valid": False, "errors": errors}
-    
-    try:
-        # Validate datetime format and logic
-        start_time = datetime.strptime(data['start_time'], '%Y-%m-%dT%H:%M')
-        end_time = datetime.strptime(data['end_time'], '%Y-%m-%dT%H:%M')
-        
-        if start_time >= end_time:
-            errors.append("End time must be after start time")
-        
-        if start_time.date() < date.today():
-            errors.append("Cannot backdate downtime entries")
-        
-        # Check if downtime duration is reasonable (not more than 24 hours)
-        duration_hours = (end_time - start_time).total_seconds() / 3600
-        if duration_hours > 24:
-            errors.append("Downtime duration cannot exceed 24 hours")
-        
-    except ValueError:
-        errors.append("Invalid datetime format")
-    
-    if errors:
-        return {"valid": False, "errors": errors}
-    
-    return {"valid": True}
+    return _validate(DowntimeEntry, data)
 
 def validate_requisition_data(data):
-    """
-    Validate requisition data
-    """
-    errors = []
-    
-    # Required fields
-    required_fields = ['item_id', 'quantity']
-    for field in required_fields:
-        if field not in data or data[field] is None or data[field] == '':
-            errors.append(f"Field '{field}' is required")
-    
-    if errors:
-        return {"valid": False, "errors": errors}
-    
-    try:
-        quantity = int(data['quantity'])
-        if quantity <= 0:
-            errors.append("Quantity must be greater than 0")
-    except ValueError:
-        errors.append("Invalid quantity format")
-    
-    if errors:
-        return {"valid": False, "errors": errors}
-    
-    return {"valid": True}
+    return _validate(RequisitionEntry, data)
 
-def check_data_integrity():
+def check_data_integrity(db=None, day=None):
     """
-    Check overall data integrity across the system
+    Check overall data integrity across the system for one day (default today)
     Returns a report of any issues found
     """
-    db = SessionLocal()
+    if db is None:
+        db = SessionLocal()
+        close_db = True
+    else:
+        close_db = False
     issues = []
     
     try:
@@ -226,8 +104,7 @@ def check_data_integrity():
         
         for section in sections:
             if section.next_section_id:
-                # Get today's data
-                today = date.today()
+                today = day or date.today()
                 
                 # Output from current section
                 current_output = db.query(func.sum(ProductionLog.output_material)).filter(
@@ -253,7 +130,7 @@ def check_data_integrity():
         
         # Check for missing production data (workers with no entries today)
         from models import Worker
-        today = date.today()
+        today = day or date.today()
         workers_with_production = db.query(ProductionLog.worker_id).filter(
             ProductionLog.date == today
         ).distinct().all()
@@ -264,7 +141,7 @@ def check_data_integrity():
             if worker.id not in worker_ids_with_production:
                 issues.append({
                     "type": "missing_data",
-                    "description": f"No production data for worker {worker.name} today",
+                    "description": f"No production data for worker {worker.name} on {today.isoformat()}",
                     "details": f"Worker ID: {worker.id}, Section: {worker.section.name if worker.section else 'Unknown'}",
                     "severity": "low"
                 })
@@ -274,7 +151,8 @@ def check_data_integrity():
     except Exception as e:
         return {"success": False, "error": str(e)}
     finally:
-        db.close()
+        if close_db:
+            db.close()
 
 if __name__ == "__main__":
     # Test data integrity check
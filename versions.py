@@ -0,0 +1,25 @@
+"""
+Per-table data version counters
+
+Every transaction that writes to a table bumps that table's row in
+data_versions (the listeners live in models.py so every session has them).
+Caches - job results, HTTP ETags, query results - key their entries on the
+versions of the tables they read, so an entry goes stale as soon as any of
+those tables changes and never has to be invalidated explicitly.
+"""
+from sqlalchemy import select
+from models import DataVersion
+
+
+def table_versions(db, tables):
+    """{table_name: version} for the given tables (0 for never written)"""
+    tables = sorted(set(tables))
+    rows = dict(db.execute(
+        select(DataVersion.table_name, DataVersion.version).where(DataVersion.table_name.in_(tables))
+    ).all())
+    return {name: rows.get(name, 0) for name in tables}
+
+
+def version_key(db, tables):
+    """Compact string identifying the current state of the given tables"""
+    return ','.join(f"{name}:{version}" for name, version in table_versions(db, tables).items())